@@ -38,6 +38,8 @@ module.exports = (transactionModel, auditLogModel, io, anomalyService) => {
             // Required fields for ML API
             transaction_id: transactionData.transaction_id,
             user_id: transactionData.user_id,
+            sender_account: transactionData.sender_account || transactionData.sender_msisdn || null,
+            receiver_account: transactionData.receiver_account || transactionData.receiver_msisdn || null,
             amount: parseFloat(transactionData.amount),
             timestamp: transactionData.timestamp || new Date().toISOString(),
             transaction_type: transactionData.transaction_type || 'transfer',
@@ -0,0 +1,183 @@
+"""
+Scalable anomaly detectors used alongside the sklearn estimators in
+ComprehensiveFraudDetectionModel.algorithm_configs.
+
+They follow the sklearn estimator API (get_params, fit, decision_function,
+score_samples, predict) so hyperparameter search, joblib persistence and the
+API's score_samples call work unchanged.
+"""
+import numpy as np
+from sklearn.base import BaseEstimator, OutlierMixin
+from sklearn.kernel_approximation import Nystroem, RBFSampler
+from sklearn.linear_model import SGDOneClassSVM
+from sklearn.neighbors import KDTree, BallTree
+from sklearn.decomposition import PCA
+
+
+class ApproximateOneClassSVM(OutlierMixin, BaseEstimator):
+    """
+    One-Class SVM with an approximate RBF kernel.
+
+    X is mapped to n_components explicit features (Nystroem landmarks or random
+    Fourier features) and a linear SGDOneClassSVM is trained on them, so fitting
+    is linear in the number of rows and scoring costs one (n_features x
+    n_components) projection per row, instead of the exact OneClassSVM's
+    quadratic fit and per-support-vector scoring.
+    """
+
+    def __init__(self, kernel_approximation: str = 'nystroem', n_components: int = 300,
+                 gamma='scale', nu: float = 0.02, max_iter: int = 50, tol: float = 1e-4,
+                 random_state: int = None):
+        self.kernel_approximation = kernel_approximation
+        self.n_components = n_components
+        self.gamma = gamma
+        self.nu = nu
+        self.max_iter = max_iter
+        self.tol = tol
+        self.random_state = random_state
+
+    def _gamma(self, X: np.ndarray) -> float:
+        if self.gamma == 'scale':
+            variance = X.var()
+            return 1.0 / (X.shape[1] * variance) if variance > 0 else 1.0
+        if self.gamma == 'auto':
+            return 1.0 / X.shape[1]
+        return float(self.gamma)
+
+    def fit(self, X, y=None):
+        X = np.asarray(X, dtype=np.float64)
+        gamma = self._gamma(X)
+        if self.kernel_approximation == 'nystroem':
+            n_components = min(self.n_components, len(X))
+            self.feature_map_ = Nystroem(kernel='rbf', gamma=gamma, n_components=n_components,
+                                         random_state=self.random_state)
+        elif self.kernel_approximation == 'rbf_sampler':
+            self.feature_map_ = RBFSampler(gamma=gamma, n_components=self.n_components,
+                                           random_state=self.random_state)
+        else:
+            raise ValueError(f"Unknown kernel_approximation '{self.kernel_approximation}'")
+
+        features = self.feature_map_.fit_transform(X)
+        self.svm_ = SGDOneClassSVM(nu=self.nu, max_iter=self.max_iter, tol=self.tol,
+                                   random_state=self.random_state)
+        self.svm_.fit(features)
+        self.n_features_in_ = X.shape[1]
+        self.offset_ = self.svm_.offset_
+        return self
+
+    def _features(self, X) -> np.ndarray:
+        return self.feature_map_.transform(np.asarray(X, dtype=np.float64))
+
+    def decision_function(self, X) -> np.ndarray:
+        """Signed distance to the boundary; negative values are outliers"""
+        return self.svm_.decision_function(self._features(X))
+
+    def score_samples(self, X) -> np.ndarray:
+        """Raw scores (decision_function + offset_); lower is more anomalous"""
+        return self.svm_.score_samples(self._features(X))
+
+    def predict(self, X) -> np.ndarray:
+        """+1 for inliers, -1 for outliers"""
+        return np.where(self.decision_function(X) < 0, -1, 1)
+
+
+class PrototypeLocalOutlierFactor(OutlierMixin, BaseEstimator):
+    """
+    Novelty-mode Local Outlier Factor over a bounded prototype subsample.
+
+    At most max_prototypes training rows are kept as the reference set,
+    projected onto n_components principal components and indexed with a
+    KD/Ball tree. Memory does not grow with the training set, queries stay
+    fast because the index is low-dimensional, and the fitted model (tree
+    included) can be persisted with joblib and used to score unseen
+    transactions. Scoring talks to the tree directly, skipping sklearn's
+    per-call validation, so single rows score in well under a millisecond.
+    """
+
+    def __init__(self, n_neighbors: int = 20, contamination: float = 0.02, max_prototypes: int = 20000,
+                 n_components: int = 10, algorithm: str = 'kd_tree', leaf_size: int = 40,
+                 random_state: int = None):
+        self.n_neighbors = n_neighbors
+        self.contamination = contamination
+        self.max_prototypes = max_prototypes
+        self.n_components = n_components
+        self.algorithm = algorithm
+        self.leaf_size = leaf_size
+        self.random_state = random_state
+
+    def _project(self, X) -> np.ndarray:
+        X = np.asarray(X, dtype=np.float64)
+        if self.components_ is None:
+            return X
+        return (X - self.mean_) @ self.components_.T
+
+    def _lrd(self, distances: np.ndarray, indices: np.ndarray) -> np.ndarray:
+        """Local reachability density from each row's k nearest prototypes"""
+        reach_distances = np.maximum(distances, self.k_distance_[indices])
+        return 1.0 / (reach_distances.mean(axis=1) + 1e-10)
+
+    def fit(self, X, y=None):
+        X = np.asarray(X, dtype=np.float64)
+        rng = np.random.default_rng(self.random_state)
+        if len(X) > self.max_prototypes:
+            self.prototype_indices_ = np.sort(rng.choice(len(X), self.max_prototypes, replace=False))
+        else:
+            self.prototype_indices_ = np.arange(len(X))
+        prototypes = X[self.prototype_indices_]
+
+        # n_components=None indexes the full feature space
+        self.mean_, self.components_ = None, None
+        if self.n_components is not None and self.n_components < X.shape[1]:
+            pca = PCA(n_components=self.n_components, random_state=self.random_state).fit(prototypes)
+            self.mean_, self.components_ = pca.mean_, pca.components_
+        prototypes = self._project(prototypes)
+
+        tree_class = {'kd_tree': KDTree, 'ball_tree': BallTree}.get(self.algorithm)
+        if tree_class is None:
+            raise ValueError(f"Unknown algorithm '{self.algorithm}' (expected 'kd_tree' or 'ball_tree')")
+        self.tree_ = tree_class(prototypes, leaf_size=self.leaf_size)
+        self.n_neighbors_ = max(1, min(self.n_neighbors, len(prototypes) - 1))
+
+        # Neighbours of each prototype, excluding itself (first column)
+        distances, indices = self.tree_.query(prototypes, k=self.n_neighbors_ + 1)
+        distances, indices = distances[:, 1:], indices[:, 1:]
+        self.k_distance_ = distances[:, -1]
+        self.lrd_ = self._lrd(distances, indices)
+        self.negative_outlier_factor_ = -(self.lrd_[indices] / self.lrd_[:, None]).mean(axis=1)
+        self.offset_ = np.percentile(self.negative_outlier_factor_, 100 * self.contamination)
+
+        self.n_features_in_ = X.shape[1]
+        self.n_train_ = len(X)
+        return self
+
+    def training_scores(self, X, rows: np.ndarray = None, chunk_size: int = 50000) -> np.ndarray:
+        """
+        score_samples for the rows the model was fitted on (X[rows] when rows
+        is given), in bounded-memory chunks
+        """
+        X = np.asarray(X, dtype=np.float64)
+        if len(X) != self.n_train_:
+            raise ValueError("training_scores expects the same X that was passed to fit")
+        rows = np.arange(len(X)) if rows is None else np.asarray(rows)
+        scores = np.empty(len(rows))
+        for start in range(0, len(rows), chunk_size):
+            scores[start:start + chunk_size] = self.score_samples(X[rows[start:start + chunk_size]])
+        # A prototype would count itself as its own nearest neighbour
+        position = np.full(len(X), -1)
+        position[rows] = np.arange(len(rows))
+        sampled = position[self.prototype_indices_]
+        scores[sampled[sampled >= 0]] = self.negative_outlier_factor_[sampled >= 0]
+        return scores
+
+    def score_samples(self, X) -> np.ndarray:
+        """Opposite of the LOF of each row against the prototypes; lower is more anomalous"""
+        distances, indices = self.tree_.query(self._project(np.atleast_2d(X)), k=self.n_neighbors_)
+        return -(self.lrd_[indices] / self._lrd(distances, indices)[:, None]).mean(axis=1)
+
+    def decision_function(self, X) -> np.ndarray:
+        """score_samples shifted so that negative values are outliers"""
+        return self.score_samples(X) - self.offset_
+
+    def predict(self, X) -> np.ndarray:
+        """+1 for inliers, -1 for outliers"""
+        return np.where(self.decision_function(X) < 0, -1, 1)
@@ -1,5 +1,6 @@
 import joblib
 import os
+import asyncio
 import pandas as pd
 import numpy as np
 from datetime import datetime
@@ -9,7 +10,17 @@ from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from feature_engineering import calculate_derived_features_chunked, apply_preprocessors_chunked, select_features_for_training
+from feature_engineering import calculate_derived_features_chunked, select_features_for_training, Preprocessor
+from velocity_store import SenderVelocityStore
+from cardinality_sketches import CardinalitySketchStore
+from transaction_graph import TransactionGraph
+from profile_store import UserProfileStore, seed_from_db, reconcile_from_db
+from drift_monitor import DriftMonitor
+from explanations import FeatureExplainer
+from segment_models import group_rows
+from risk_scoring import (feature_confidences, adjusted_thresholds, prediction_confidences, enhanced_risk_scores,
+                          single_model_threshold)
+from rule_cascade import CascadeStats, TIER_MODEL, TIER_NORMAL, TIER_ANOMALY, TIER_NAMES
 import time
 
 # Load environment variables
@@ -38,18 +49,71 @@ model = None
 scaler = None
 encoders = None
 feature_names = None
+preprocessor = None
+score_quantiles = None
 MODEL_SAVE_PATH = "trained_models/best_fraud_detection_model.joblib"
 
+# Rank-normalized ensemble saved by `fraud_detection_model.py --ensemble`, if any;
+# ENSEMBLE_DROP_MEMBERS lists members to leave out (e.g. expensive, redundant ones)
+ensemble = None
+ENSEMBLE_DROP_MEMBERS = [name for name in os.getenv("ENSEMBLE_DROP_MEMBERS", "").split(",") if name.strip()]
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "5000"))
+
+# Per-segment models saved by `fraud_detection_model.py --segment-by ...`; take precedence when present
+segmented_detector = None
+
+# In-memory per-sender velocity counters; a background task snapshots the serving
+# state (velocity, sketches, graph, profiles) every VELOCITY_SNAPSHOT_INTERVAL seconds
+velocity_store = None
+snapshot_task = None
+VELOCITY_SNAPSHOT_PATH = os.getenv("VELOCITY_SNAPSHOT_PATH", "trained_models/velocity_snapshot.joblib")
+VELOCITY_SNAPSHOT_INTERVAL = float(os.getenv("VELOCITY_SNAPSHOT_INTERVAL", "300"))  # seconds
+
+# HyperLogLog sketches for diversity features (seeded from the training artifact)
+cardinality_store = None
+SKETCH_SNAPSHOT_PATH = os.getenv("SKETCH_SNAPSHOT_PATH", "trained_models/cardinality_sketches.joblib")
+
+# Sender -> receiver adjacency index for graph features (seeded from the training artifact,
+# edges idle past GRAPH_RETENTION_DAYS pruned as event time advances)
+transaction_graph = None
+GRAPH_SNAPSHOT_PATH = os.getenv("GRAPH_SNAPSHOT_PATH", "trained_models/transaction_graph.joblib")
+
+# Per-user count/sum/first-seen records in a memory-mapped file (replaces the per-user SQL aggregation)
+profile_store = None
+PROFILE_STORE_PATH = os.getenv("PROFILE_STORE_PATH", "trained_models/user_profiles.npy")
+
+# Sliding-window histograms of scored feature vectors vs. the training reference
+drift_monitor = None
+DRIFT_SNAPSHOT_PATH = os.getenv("DRIFT_SNAPSHOT_PATH", "trained_models/drift_snapshot.joblib")
+
+# Per-feature contribution explainers, one per served detector (built at startup)
+explainers = {}
+trained_feature_importance = None
+EXPLANATION_TOP_K = int(os.getenv("EXPLANATION_TOP_K", "3"))
+
+# Tier-1 rules saved with the model: CASCADE_MODE=shadow (the default) only measures
+# what the rules would have decided, on settles clear-cut transactions without the
+# context queries and model (opt in after checking the shadow agreement), off skips them
+rule_cascade = None
+CASCADE_MODE = os.getenv("CASCADE_MODE", "shadow").lower()
+cascade_stats = {'predict': CascadeStats(), 'batch': CascadeStats()}
+
 # Simple cache for frequently accessed data (5 minute TTL)
 cache = {}
 CACHE_TTL = 300  # 5 minutes
 
+def _snapshot_is_current(path: str) -> bool:
+    """Whether a serving snapshot was written after the model artifact (else the artifact's state wins)"""
+    return os.path.exists(path) and os.path.getmtime(path) > os.path.getmtime(MODEL_SAVE_PATH)
+
 @app.on_event("startup")
 async def load_model_and_preprocessors():
     """
     Load the trained model and preprocessors at application startup.
     """
-    global model, scaler, encoders, feature_names
+    global model, scaler, encoders, feature_names, preprocessor, cardinality_store, ensemble, score_quantiles
+    global transaction_graph
+    global segmented_detector, drift_monitor, trained_feature_importance, rule_cascade
     print(f"Loading model from: {MODEL_SAVE_PATH}...")
     try:
         if not os.path.exists(MODEL_SAVE_PATH):
@@ -59,13 +123,154 @@ async def load_model_and_preprocessors():
         scaler = model_data['scaler']
         encoders = model_data['encoders']
         feature_names = model_data['feature_names']
+        # Artifacts saved before the unified Preprocessor only carry scaler/encoders
+        preprocessor = model_data.get('preprocessor') or Preprocessor.from_legacy(feature_names, scaler, encoders)
+        score_quantiles = model_data.get('score_quantiles')
+        trained_feature_importance = model_data.get('feature_importance')
         print(f"Model and preprocessors loaded successfully! Features: {len(feature_names)}")
+        ensemble = model_data.get('ensemble')
+        if ensemble is not None:
+            if ENSEMBLE_DROP_MEMBERS:
+                ensemble = ensemble.drop([name.strip() for name in ENSEMBLE_DROP_MEMBERS])
+            print(f"Ensemble loaded with members: {', '.join(ensemble.member_names)}")
+        segmented_detector = model_data.get('segments')
+        if segmented_detector is not None:
+            print(f"Segment models loaded: {len(segmented_detector.models)} by {' x '.join(segmented_detector.segment_by)}")
+        # Build the explainers now so the first explained request does not pay for it
+        explainers.clear()
+        for detector in ([ensemble if ensemble is not None else model]
+                         + (list(segmented_detector.models.values()) + [segmented_detector.fallback_model]
+                            if segmented_detector is not None else [])):
+            _explainer_for(detector)
+        rule_cascade = model_data.get('rule_cascade')
+        if rule_cascade is not None:
+            print(f"Rule cascade loaded ({CASCADE_MODE}): training hit rates {rule_cascade.training_hit_rates}")
+        drift_reference = model_data.get('drift_reference')
+        if drift_reference is not None:
+            drift_monitor = (DriftMonitor.load(DRIFT_SNAPSHOT_PATH, drift_reference)
+                             if os.path.exists(DRIFT_SNAPSHOT_PATH) else DriftMonitor(drift_reference))
+            print(f"Drift monitor ready: {drift_monitor.window_rows} rows in window")
+        if _snapshot_is_current(SKETCH_SNAPSHOT_PATH):
+            cardinality_store = CardinalitySketchStore.load(SKETCH_SNAPSHOT_PATH)
+        else:
+            cardinality_store = model_data.get('cardinality_sketches')
+        if _snapshot_is_current(GRAPH_SNAPSHOT_PATH):
+            transaction_graph = TransactionGraph.load(GRAPH_SNAPSHOT_PATH)
+        else:
+            transaction_graph = model_data.get('transaction_graph')
+        if transaction_graph is not None:
+            print(f"Transaction graph loaded: {transaction_graph.n_nodes} accounts, {transaction_graph.n_edges} edges")
     except FileNotFoundError as e:
         print(f"ERROR: {e}. Please run the training script first.")
         model = None
     except Exception as e:
         print(f"An error occurred while loading the model: {e}")
         model = None
+    if cardinality_store is None:
+        cardinality_store = CardinalitySketchStore()
+    if transaction_graph is None:
+        transaction_graph = TransactionGraph()
+
+@app.on_event("startup")
+async def load_velocity_store():
+    """
+    Restore per-sender velocity counters from the last snapshot, if any, and start the snapshot task.
+    """
+    global velocity_store, snapshot_task
+    velocity_store = SenderVelocityStore.from_env()
+    if os.path.exists(VELOCITY_SNAPSHOT_PATH):
+        try:
+            velocity_store = SenderVelocityStore.load(VELOCITY_SNAPSHOT_PATH, velocity_store.max_senders)
+            print(f"Velocity counters restored for {len(velocity_store.senders)} senders")
+        except Exception as e:
+            print(f"Could not restore velocity snapshot, starting empty: {e}")
+    snapshot_task = asyncio.create_task(_snapshot_periodically())
+
+def _write_snapshots(final: bool = False):
+    """
+    Evict idle state and snapshot velocity counters, diversity sketches, the
+    transaction graph, user profiles and the drift window (final: no update
+    follows, on shutdown)
+    """
+    if velocity_store is not None:
+        try:
+            velocity_store.evict_idle()
+            velocity_store.snapshot(VELOCITY_SNAPSHOT_PATH)
+        except Exception as e:
+            print(f"Could not write velocity snapshot: {e}")
+    if cardinality_store is not None:
+        try:
+            cardinality_store.evict_idle()
+            cardinality_store.snapshot(SKETCH_SNAPSHOT_PATH)
+        except Exception as e:
+            print(f"Could not write cardinality sketch snapshot: {e}")
+    if transaction_graph is not None:
+        try:
+            transaction_graph.snapshot(GRAPH_SNAPSHOT_PATH)
+        except Exception as e:
+            print(f"Could not write transaction graph snapshot: {e}")
+    if profile_store is not None:
+        try:
+            profile_store.snapshot(clean=final)
+        except Exception as e:
+            print(f"Could not write user profile snapshot: {e}")
+    if drift_monitor is not None:
+        try:
+            drift_monitor.snapshot(DRIFT_SNAPSHOT_PATH)
+        except Exception as e:
+            print(f"Could not write drift snapshot: {e}")
+
+async def _snapshot_periodically():
+    """Write the snapshots in a worker thread on a timer, off the request path"""
+    while True:
+        await asyncio.sleep(VELOCITY_SNAPSHOT_INTERVAL)
+        await asyncio.to_thread(_write_snapshots)
+
+@app.on_event("startup")
+async def load_profile_store():
+    """
+    Map the per-user profiles back in and fold in the transactions written since
+    the latest one; seed them from the transactions table on first start or
+    after an unclean shutdown.
+    """
+    global profile_store
+    try:
+        profile_store = UserProfileStore.open(PROFILE_STORE_PATH)
+    except Exception as e:
+        print(f"Could not open user profile store, keeping profiles in memory: {e}")
+        profile_store = UserProfileStore()
+    conn = None
+    try:
+        conn = psycopg2.connect(
+            dbname=os.getenv("DB_DATABASE"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD"),
+            host=os.getenv("DB_HOST"),
+            port=os.getenv("DB_PORT"),
+            connect_timeout=10
+        )
+        if len(profile_store) and profile_store.clean_shutdown:
+            added = reconcile_from_db(profile_store, conn)
+            print(f"User profiles restored for {len(profile_store)} users, {added} newer transactions folded in")
+        else:
+            if len(profile_store):
+                print("User profile store was not closed cleanly, rebuilding it from the database")
+                profile_store.clear()
+            print(f"User profiles seeded for {seed_from_db(profile_store, conn)} users")
+    except Exception as e:
+        print(f"Could not sync user profiles with the database, serving them as saved: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+@app.on_event("shutdown")
+async def save_velocity_store():
+    """
+    Persist velocity counters, diversity sketches, the transaction graph, user profiles and drift windows so a restart keeps recent activity.
+    """
+    if snapshot_task is not None:
+        snapshot_task.cancel()
+    _write_snapshots(final=True)
 
 def get_cached_data(cache_key: str, fetch_function, *args):
     """Simple caching mechanism with TTL"""
@@ -91,6 +296,9 @@ def get_cached_data(cache_key: str, fetch_function, *args):
 class Transaction(BaseModel):
     transaction_id: str
     user_id: str
+    sender_account: Optional[str] = None
+    receiver_account: Optional[str] = None
+    receiver_msisdn: Optional[str] = None
     amount: float
     timestamp: datetime
     transaction_type: str
@@ -123,6 +331,12 @@ async def health_check():
         "status": "healthy",
         "model_loaded": model is not None,
         "features": len(feature_names) if feature_names else 0,
+        "ensemble_members": ensemble.member_names if ensemble is not None else [],
+        "segment_models": len(segmented_detector.models) if segmented_detector is not None else 0,
+        "drift_window_rows": drift_monitor.window_rows if drift_monitor is not None else 0,
+        "graph_accounts": transaction_graph.n_nodes if transaction_graph is not None else 0,
+        "profile_users": len(profile_store) if profile_store is not None else 0,
+        "cascade_mode": CASCADE_MODE if _cascade_active() else "off",
         "timestamp": datetime.now().isoformat()
     }
 
@@ -137,9 +351,20 @@ async def get_feature_importance():
     if feature_names is None:
         raise HTTPException(status_code=503, detail="Feature names not available.")
     
+    if trained_feature_importance:
+        # Mean contribution shares over the most anomalous training rows, saved at training time
+        return {
+            "feature_importance": [
+                {'feature': name, 'importance': share, 'description': _get_feature_description(name)}
+                for name, share in trained_feature_importance.items()
+            ],
+            "model_name": "rank_normalized_ensemble" if ensemble is not None else type(model).__name__,
+            "total_features": len(trained_feature_importance),
+            "timestamp": datetime.now().isoformat()
+        }
+    
     try:
-        # For unsupervised models, we'll provide importance based on feature contribution
-        # This is a simplified approach - in production, you might use SHAP or similar
+        # Artifacts trained before contribution-based importance fall back to these priors
         
         # Enhanced feature importance based on our Malawi-specific features
         feature_importance_map = {
@@ -216,6 +441,14 @@ def _get_feature_description(feature_name: str) -> str:
         'cultural_risk_modifier': 'Risk adjustment based on Malawi cultural events',
         'location_risk_score': 'Risk score based on transaction location',
         'transaction_velocity_score': 'User transaction frequency analysis',
+        'graph_sender_fan_out': 'Distinct accounts the sender has paid',
+        'graph_sender_fan_in': 'Distinct accounts that have paid the sender',
+        'graph_receiver_fan_in': 'Distinct accounts that have paid the receiver (mule collection)',
+        'graph_receiver_fan_out': 'Distinct accounts the receiver has paid onward',
+        'graph_sender_counterparties_24h': 'Distinct accounts the sender transacted with in the last 24 hours',
+        'graph_receiver_counterparties_24h': 'Distinct accounts the receiver transacted with in the last 24 hours',
+        'graph_sender_two_hop_reach': 'Accounts reachable from the sender through one intermediary',
+        'graph_pair_transaction_count': 'Transactions from this sender to this receiver so far',
         'amount_time_interaction': 'Interaction between amount and time patterns',
         'network_operator': 'Mobile network operator (TNM/Airtel)',
         'transaction_type': 'Type of transaction (cash_out, p2p_transfer, etc.)',
@@ -238,6 +471,111 @@ async def root():
         "version": "1.0.0"
     }
 
+def _explainer_for(detector) -> FeatureExplainer:
+    explainer = explainers.get(id(detector))
+    if explainer is None:
+        explainer = explainers[id(detector)] = FeatureExplainer(detector, feature_names)
+    return explainer
+
+def _top_features(X_scaled: np.ndarray, routed: List[str] = None, k: int = EXPLANATION_TOP_K):
+    """
+    Top-k contributing features per row, from the detector that scored the row:
+    its segment model, else the ensemble, else the single best model
+    """
+    if routed is None:
+        return _explainer_for(ensemble if ensemble is not None else model).top_features(X_scaled, k)
+    explanations = [None] * len(X_scaled)
+    for key, rows in group_rows(np.array(routed, dtype=object)).items():
+        detector = segmented_detector.models.get(key, segmented_detector.fallback_model)
+        for row, top in zip(rows, _explainer_for(detector).top_features(X_scaled[rows], k)):
+            explanations[row] = top
+    return explanations
+
+def _cascade_active() -> bool:
+    return rule_cascade is not None and rule_cascade.enabled and CASCADE_MODE in ('on', 'shadow')
+
+def _store_risk_score(transaction_id: str, risk_score: float):
+    """Write the enhanced risk score back to the transaction row"""
+    conn = None
+    try:
+        conn = psycopg2.connect(
+            dbname=os.getenv("DB_DATABASE"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD"),
+            host=os.getenv("DB_HOST"),
+            port=os.getenv("DB_PORT"),
+            connect_timeout=30
+        )
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE transactions SET risk_score = %s WHERE transaction_id = %s",
+                (float(risk_score), transaction_id)
+            )
+            conn.commit()
+    except Exception as e:
+        print(f"[ML API] Warning: Could not update risk score: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+def _velocity_key(record: Dict[str, Any]) -> str:
+    return record.get('sender_account') or record['user_id']
+
+def _record_scored(records: List[Dict[str, Any]], timestamps: pd.Series):
+    """
+    Fold scored transactions into the velocity counters, the transaction graph
+    and user profiles; called once the response is ready, so a failed request
+    and its retry count the transaction once
+    """
+    if velocity_store is not None:
+        for record, timestamp in zip(records, timestamps):
+            velocity_store.update(_velocity_key(record), timestamp.timestamp(), float(record['amount']))
+    if transaction_graph is not None:
+        edges = pd.DataFrame(records)
+        edges['timestamp'] = timestamps.to_numpy()
+        transaction_graph.add_frame(edges)
+    if profile_store is not None:
+        profile_store.update_many([record['user_id'] for record in records], timestamps,
+                                  [float(record['amount']) for record in records])
+
+def _rule_prediction(data: Dict[str, Any], df: pd.DataFrame, tier: int) -> Dict[str, Any]:
+    """
+    /predict response for a transaction the tier-1 rules settled, shaped like
+    the model's: the score and threshold are the medians of the training rows
+    the rule settled, calibrated with the same confidence adjustments
+    """
+    scores, thresholds = rule_cascade.settled_scores(df, np.array([tier], dtype=np.int8))
+    anomaly_score = scores[0]
+    feature_confidence = _calculate_feature_confidence(df)
+    adjusted_threshold = _adjusted_threshold(thresholds[0], feature_confidence)
+    is_anomaly = tier == TIER_ANOMALY
+    prediction_confidence = _calculate_prediction_confidence(anomaly_score, adjusted_threshold, feature_confidence, df)
+    _store_risk_score(data['transaction_id'],
+                      _calculate_enhanced_risk_score(anomaly_score, adjusted_threshold, prediction_confidence))
+    rule = rule_cascade.describe(data['transaction_type'], tier)
+    risk_factors = _extract_risk_factors(df)
+    if is_anomaly:
+        risk_factors = [f"Amount far above usual for {data['transaction_type']}"] + [
+            factor for factor in risk_factors if factor != "Normal transaction patterns"
+        ]
+    return {
+        "prediction": "Anomaly Detected" if is_anomaly else "Normal Transaction",
+        "anomaly_score": float(round(anomaly_score, 4)),
+        "is_anomaly": bool(is_anomaly),
+        "threshold": float(round(adjusted_threshold, 4)),
+        "confidence": float(round(prediction_confidence, 4)),
+        "feature_confidence": float(round(feature_confidence, 4)),
+        "model_name": "rule_cascade",
+        "segment": None,
+        "model_version": "2.0",
+        "model_description": f"Tier-1 rule: {rule}",
+        "algorithm_reason": "Clear-cut transaction settled by a tier-1 rule validated against the model",
+        "risk_factors": risk_factors,
+        "top_features": [],
+        "tier": TIER_NAMES[tier],
+        "rule": rule
+    }
+
 @app.post("/predict", tags=["Prediction"])
 async def predict_anomaly(transaction: Transaction):
     """
@@ -264,6 +602,43 @@ async def predict_anomaly(transaction: Transaction):
         df['is_weekend'] = df['transaction_day_of_week'].isin([5, 6]).astype(bool)
         df['is_business_hours'] = df['transaction_hour_of_day'].between(8, 17).astype(bool)
 
+        # Short-window velocity from the in-process counters (no DB round trip); the
+        # transaction is recorded only after it has been scored
+        if velocity_store is not None:
+            velocity = velocity_store.preview(_velocity_key(data), df['timestamp'].iloc[0].timestamp(),
+                                              float(data['amount']))
+            for feature, value in velocity.items():
+                df[feature] = value
+
+        # Fan-in/fan-out, counterparties and reach as if the edge were recorded (it is, once scored)
+        if transaction_graph is not None:
+            for feature, value in transaction_graph.preview_frame(df).iloc[0].items():
+                df[feature] = value
+
+        # The user's history so far from the profile store (this transaction is folded in once scored)
+        user_profile = None
+        if profile_store is not None:
+            user_profile = profile_store.features([data['user_id']], df['timestamp'])
+
+        # Fold this transaction into the diversity sketches before reading them
+        if cardinality_store is not None:
+            cardinality_store.update(data)
+
+        # Tier-1 rules on the raw fields settle clear-cut transactions before any DB lookup
+        tier = TIER_MODEL
+        rule_seconds = 0.0
+        if _cascade_active():
+            rules_start = time.perf_counter()
+            tier = int(rule_cascade.tiers(df)[0])
+            rule_seconds = time.perf_counter() - rules_start
+            if CASCADE_MODE == 'on' and tier != TIER_MODEL:
+                cascade_stats['predict'].record(np.array([tier], dtype=np.int8), rule_seconds)
+                print(f"[ML API] Settled by rule cascade: {TIER_NAMES[tier]}")
+                prediction = _rule_prediction(data, df, tier)
+                _record_scored([data], df['timestamp'])
+                return prediction
+        model_start = time.perf_counter()
+
         # Optimized single query for all additional features
         print("[ML API] Starting optimized database query...")
         conn = None
@@ -279,20 +654,8 @@ async def predict_anomaly(transaction: Transaction):
             with conn.cursor() as cur:
                 # Single optimized query with CTEs for better performance
                 cur.execute("""
-                    WITH user_stats AS (
-                        SELECT 
-                            COUNT(*) as user_total_transactions,
-                            SUM(amount) as user_total_amount_spent,
-                            MIN(timestamp) as first_transaction,
-                            COUNT(DISTINCT location_city) as user_location_count,
-                            COUNT(DISTINCT device_type) as user_device_count,
-                            COUNT(DISTINCT transaction_type) as user_transaction_type_count
-                        FROM transactions
-                        WHERE user_id = %s
-                    ),
-                    location_stats AS (
+                    WITH location_stats AS (
                         SELECT 
-                            COUNT(DISTINCT user_id) as location_user_id_nunique,
                             AVG(amount) as location_amount_mean,
                             COUNT(*) as location_transaction_count
                         FROM transactions
@@ -313,23 +676,19 @@ async def predict_anomaly(transaction: Transaction):
                         WHERE transaction_type = %s
                     )
                     SELECT 
-                        u.user_total_transactions, u.user_total_amount_spent, u.first_transaction,
-                        u.user_location_count, u.user_device_count, u.user_transaction_type_count,
-                        l.location_user_id_nunique, l.location_amount_mean, l.location_transaction_count,
+                        l.location_amount_mean, l.location_transaction_count,
                         n.telco_amount_mean, n.telco_user_count,
                         t.txn_type_amount_mean, t.txn_type_amount_std
-                    FROM user_stats u, location_stats l, network_stats n, txn_type_stats t;
-                """, (data['user_id'], data['location_city'], data['network_operator'], data['transaction_type']))
+                    FROM location_stats l, network_stats n, txn_type_stats t;
+                """, (data['location_city'], data['network_operator'], data['transaction_type']))
                 
                 result = cur.fetchone()
                 if result:
-                    user_stats = result[:6]
-                    location_stats = result[6:9]
-                    telco_stats = result[9:11]
-                    txn_type_stats = result[11:13]
+                    location_stats = result[0:2]
+                    telco_stats = result[2:4]
+                    txn_type_stats = result[4:6]
                 else:
-                    user_stats = (0, 0, None, 0, 0, 0)
-                    location_stats = (0, 0, 0)
+                    location_stats = (0, 0)
                     telco_stats = (0, 0)
                     txn_type_stats = (0, 0)
 
@@ -337,81 +696,40 @@ async def predict_anomaly(transaction: Transaction):
             if conn:
                 conn.close()
 
-        # Add queried stats
-        df['user_total_transactions'] = user_stats[0]
-        df['user_total_amount_spent'] = user_stats[1]
-        df['account_age_days'] = (df['timestamp'] - pd.to_datetime(user_stats[2])).dt.days if user_stats[2] else 0
-        df['user_location_diversity'] = user_stats[3]
-        df['user_device_diversity'] = user_stats[4]
-        df['user_transaction_type_diversity'] = user_stats[5]
-        df['location_user_id_nunique'] = location_stats[0]
-        df['location_amount_mean'] = location_stats[1]
-        df['location_transaction_count'] = location_stats[2]
+        # Add profile and queried stats
+        if user_profile is not None:
+            for feature in user_profile.columns:
+                df[feature] = user_profile[feature].to_numpy()
+        else:
+            df['user_total_transactions'] = 0
+            df['user_total_amount_spent'] = 0
+            df['account_age_days'] = 0
+        df['location_amount_mean'] = location_stats[0]
+        df['location_transaction_count'] = location_stats[1]
         # For compatibility with feature selection which expects 'network_*' columns
         df['network_amount_mean'] = telco_stats[0]
         df['network_user_count'] = telco_stats[1]
         df['txn_type_amount_mean'] = txn_type_stats[0]
         df['txn_type_amount_std'] = txn_type_stats[1]
 
-        # Apply feature engineering
-        df_engineered = calculate_derived_features_chunked(df)
+        # Apply feature engineering (diversity features read from the HLL sketches)
+        df_engineered = calculate_derived_features_chunked(df, cardinality_store=cardinality_store)
         
-        # Ensure all required features are present with default values
-        required_features = feature_names if feature_names else []
-        for feature in required_features:
-            if feature not in df_engineered.columns:
-                print(f"[ML API] Missing feature '{feature}', using default value 0")
-                df_engineered[feature] = 0.0
-        
-        # Select only the features that the model was trained with
+        # Missing features fall back to the training fill values inside the preprocessor
         if feature_names:
-            # Use only the features the model was trained with
-            available_features = [f for f in feature_names if f in df_engineered.columns]
             missing_features = [f for f in feature_names if f not in df_engineered.columns]
-            
             if missing_features:
                 print(f"[ML API] Missing features: {missing_features}")
-                # Add missing features with default values
-                for feature in missing_features:
-                    df_engineered[feature] = 0.0
-            
-            # Select features in the same order as training
-            X_features = df_engineered[feature_names]
+            X_features = df_engineered.reindex(columns=feature_names)
         else:
             # Fallback to original feature selection
             feature_columns = select_features_for_training(df_engineered)
             X_features = df_engineered[feature_columns]
         
-        # Apply encoders BEFORE scaling
-        if encoders:
-            for feature, encoder in encoders.items():
-                if feature in X_features.columns:
-                    try:
-                        # Convert to string and handle unknown categories
-                        feature_values = X_features[feature].astype(str)
-                        
-                        # Handle unknown categories by using a default class
-                        encoded_values = []
-                        for value in feature_values:
-                            try:
-                                encoded_val = encoder.transform([value])[0]
-                                encoded_values.append(encoded_val)
-                            except ValueError:
-                                # Unknown category, use the first class as default
-                                if hasattr(encoder, 'classes_') and len(encoder.classes_) > 0:
-                                    encoded_val = encoder.transform([encoder.classes_[0]])[0]
-                                    encoded_values.append(encoded_val)
-                                    print(f"[ML API] Unknown category '{value}' for feature '{feature}', using default")
-                                else:
-                                    encoded_values.append(0)
-                        
-                        X_features[feature] = encoded_values
-                    except Exception as e:
-                        print(f"[ML API] Error encoding feature '{feature}': {e}")
-                        X_features[feature] = 0  # Default value
-        
-        # Apply preprocessing (scaling) after encoding
-        X_scaled = scaler.transform(X_features)
+        # Fill, encode and scale in one vectorized pass (same code path as training)
+        X_scaled = preprocessor.transform(X_features)
+        if drift_monitor is not None:
+            drift_monitor.update(X_scaled)
 
         # Debug logging
         print(f"[ML API] Features used for prediction: {list(X_features.columns)}")
@@ -421,19 +739,30 @@ async def predict_anomaly(transaction: Transaction):
         # Enhanced prediction with confidence calibration
         print("[ML API] Making enhanced prediction with confidence calibration...")
         
-        # Get base anomaly score
-        anomaly_score = model.score_samples(X_scaled)[0]
-        
-        # Calculate adaptive threshold based on feature confidence
-        n_features = X_scaled.shape[1]
-        base_threshold = np.percentile(model.score_samples(scaler.transform(np.random.rand(1000, n_features))), 2)
+        # Get base anomaly score: the transaction's segment model when segment models are
+        # loaded, else the rank-normalized ensemble score, else the single best model
+        segment = None
+        if segmented_detector is not None:
+            segment_scores, segment_thresholds, routed = segmented_detector.score(
+                X_scaled, np.array([segmented_detector.key_for_record(data)], dtype=object)
+            )
+            anomaly_score = segment_scores[0]
+            base_threshold = segment_thresholds[0]
+            segment = routed[0]
+        elif ensemble is not None:
+            ensemble_scores, _, _ = ensemble.score(X_scaled)
+            anomaly_score = ensemble_scores[0]
+            base_threshold = ensemble.threshold
+        else:
+            anomaly_score = model.score_samples(X_scaled)[0]
+            # Training score quantile at the contamination target, as offline scoring uses
+            base_threshold = single_model_threshold(model, score_quantiles)
         
         # Extract confidence indicators from features
         feature_confidence = _calculate_feature_confidence(df_engineered)
         
-        # Adjust threshold based on confidence
-        confidence_adjustment = (feature_confidence - 0.5) * 0.2  # ±10% adjustment
-        adjusted_threshold = base_threshold * (1 + confidence_adjustment)
+        # Adjust threshold based on confidence (±10% of its magnitude, in score space)
+        adjusted_threshold = _adjusted_threshold(base_threshold, feature_confidence)
         
         # Enhanced anomaly detection with confidence
         is_anomaly = anomaly_score <= adjusted_threshold
@@ -446,53 +775,310 @@ async def predict_anomaly(transaction: Transaction):
         print(f"[ML API] Enhanced prediction - Score: {anomaly_score:.4f}, Threshold: {adjusted_threshold:.4f}")
         print(f"[ML API] Feature Confidence: {feature_confidence:.3f}, Prediction Confidence: {prediction_confidence:.3f}")
         print(f"[ML API] Is Anomaly: {is_anomaly}")
+        if _cascade_active():
+            cascade_stats['predict'].record(np.array([tier], dtype=np.int8), rule_seconds, 1,
+                                            time.perf_counter() - model_start)
+            if CASCADE_MODE == 'shadow':
+                cascade_stats['predict'].record_shadow(np.array([tier], dtype=np.int8), np.array([is_anomaly]))
 
         # Store enhanced risk score
-        try:
-            conn = psycopg2.connect(
-                dbname=os.getenv("DB_DATABASE"),
-                user=os.getenv("DB_USER"),
-                password=os.getenv("DB_PASSWORD"),
-                host=os.getenv("DB_HOST"),
-                port=os.getenv("DB_PORT"),
-                connect_timeout=30
-            )
-            with conn.cursor() as cur:
-                # Enhanced risk score calculation
-                risk_score = _calculate_enhanced_risk_score(
-                    anomaly_score, adjusted_threshold, prediction_confidence
-                )
-                
-                cur.execute(
-                    "UPDATE transactions SET risk_score = %s WHERE transaction_id = %s",
-                    (float(risk_score), data['transaction_id'])
-                )
-                conn.commit()
-        except Exception as e:
-            print(f"[ML API] Warning: Could not update risk score: {e}")
-        finally:
-            if conn:
-                conn.close()
+        _store_risk_score(data['transaction_id'],
+                          _calculate_enhanced_risk_score(anomaly_score, adjusted_threshold, prediction_confidence))
 
         # Determine algorithm selection reason
         algorithm_reason = _get_algorithm_selection_reason(prediction_confidence, is_anomaly)
 
-        return {
+        prediction = {
             "prediction": "Anomaly Detected" if is_anomaly else "Normal Transaction",
             "anomaly_score": float(round(anomaly_score, 4)),
             "is_anomaly": bool(is_anomaly),
             "threshold": float(round(adjusted_threshold, 4)),
             "confidence": float(round(prediction_confidence, 4)),
             "feature_confidence": float(round(feature_confidence, 4)),
-            "model_name": "elliptic_envelope_enhanced",
+            "model_name": (
+                f"segment_{segmented_detector.algorithm}" if segmented_detector is not None
+                else "rank_normalized_ensemble" if ensemble is not None else "elliptic_envelope_enhanced"
+            ),
+            "segment": segment,
             "model_version": "2.0",
-            "model_description": "Enhanced Elliptic Envelope with confidence calibration and Malawi behavioral patterns",
+            "model_description": (
+                f"Weighted ensemble of {', '.join(ensemble.member_names)}" if ensemble is not None
+                else "Enhanced Elliptic Envelope with confidence calibration and Malawi behavioral patterns"
+            ),
             "algorithm_reason": algorithm_reason,
-            "risk_factors": _extract_risk_factors(df_engineered)
+            "risk_factors": _extract_risk_factors(df_engineered),
+            "top_features": _top_features(X_scaled, [segment] if segment is not None else None)[0],
+            "tier": TIER_NAMES[TIER_MODEL]
         }
+        _record_scored([data], df['timestamp'])
+        return prediction
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred during prediction: {e}")
 
+class BatchPredictionRequest(BaseModel):
+    transactions: List[Transaction]
+    explain: bool = False
+    top_k: int = EXPLANATION_TOP_K
+
+def _add_batch_context_stats(df: pd.DataFrame):
+    """City, operator and transaction-type aggregates for a whole batch (one grouped query each)"""
+    conn = psycopg2.connect(
+        dbname=os.getenv("DB_DATABASE"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT"),
+        connect_timeout=10
+    )
+    try:
+        with conn.cursor() as cur:
+            lookups = [
+                ('location_city', 'location_city', "AVG(amount), COUNT(*)",
+                 ['location_amount_mean', 'location_transaction_count']),
+                ('telco_provider', 'network_operator', "AVG(amount), COUNT(DISTINCT user_id)",
+                 ['network_amount_mean', 'network_user_count']),
+                ('transaction_type', 'transaction_type', "AVG(amount), STDDEV(amount)",
+                 ['txn_type_amount_mean', 'txn_type_amount_std']),
+            ]
+            for column, batch_column, aggregates, names in lookups:
+                cur.execute(
+                    f"SELECT {column}, {aggregates} FROM transactions WHERE {column} = ANY(%s) GROUP BY {column}",
+                    (df[batch_column].dropna().unique().tolist(),)
+                )
+                stats = pd.DataFrame(cur.fetchall(), columns=[batch_column] + names).set_index(batch_column)
+                for name in names:
+                    df[name] = df[batch_column].map(stats[name]) if len(stats) else None
+    finally:
+        conn.close()
+
+def _served_model_name() -> str:
+    if segmented_detector is not None:
+        return f"segment_{segmented_detector.algorithm}"
+    return "rank_normalized_ensemble" if ensemble is not None else type(model).__name__
+
+def _batch_threshold() -> Optional[float]:
+    """Single threshold for the batch (None when segment models set one per row)"""
+    if segmented_detector is not None:
+        return None
+    if ensemble is not None:
+        return ensemble.threshold
+    return single_model_threshold(model, score_quantiles)
+
+def _score_batch(X_scaled: np.ndarray, df_engineered: pd.DataFrame, threshold: Optional[float]):
+    """
+    Scores, per-row thresholds, the segment per row (None without segment
+    models), ensemble member ranks (None without an ensemble) and per-model seconds
+    """
+    start = time.perf_counter()
+    if segmented_detector is not None:
+        # Rows are grouped by segment so each segment model runs once for the batch
+        scores, thresholds, routed = segmented_detector.score(X_scaled, segmented_detector.keys_for(df_engineered))
+        return scores, thresholds, routed, None, {_served_model_name(): time.perf_counter() - start}
+    if ensemble is not None:
+        scores, member_ranks, member_seconds = ensemble.score(X_scaled)
+        return scores, np.full(len(scores), threshold), None, member_ranks, member_seconds
+    scores = model.score_samples(X_scaled)
+    return scores, np.full(len(scores), threshold), None, None, {type(model).__name__: time.perf_counter() - start}
+
+@app.post("/predict/batch", tags=["Prediction"])
+async def predict_anomaly_batch(request: BatchPredictionRequest):
+    """
+    Scores a batch of transactions in one vectorized pass.
+
+    With the rule cascade on, tier-1 rules first settle clear-cut rows from
+    their raw fields. The remaining rows get context statistics (one grouped
+    query per aggregate) and are feature-engineered and transformed as a single
+    frame, and the ensemble (or the single best model) scores the whole matrix
+    at once. Nothing is written back to the database. With explain=true each
+    model-scored prediction also carries its top_k contributing features.
+
+    Returns:
+        Per-transaction scores, anomaly flags and deciding tier, plus rule, feature, scoring, explanation and per-model timings in milliseconds.
+    """
+    if model is None:
+        raise HTTPException(status_code=503, detail="Model is not loaded.")
+    if not request.transactions:
+        return {"predictions": [], "count": 0}
+    if len(request.transactions) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds MAX_BATCH_SIZE ({MAX_BATCH_SIZE})")
+
+    try:
+        feature_start = time.perf_counter()
+        records = [transaction.dict() for transaction in request.transactions]
+        df = pd.DataFrame(records)
+        df['timestamp'] = pd.to_datetime(df['timestamp'])
+        df['transaction_hour_of_day'] = df['timestamp'].dt.hour
+        df['transaction_day_of_week'] = df['transaction_day_of_week'].fillna(df['timestamp'].dt.dayofweek)
+        df['is_weekend'] = df['transaction_day_of_week'].isin([5, 6]).astype(bool)
+        df['is_business_hours'] = df['transaction_hour_of_day'].between(8, 17).astype(bool)
+
+        # Velocity counters, the graph and diversity sketches advance row by row, in batch
+        # order (velocity and the graph are previewed here and recorded once the batch is scored)
+        if velocity_store is not None:
+            velocity_rows = velocity_store.preview_many(
+                [_velocity_key(record) for record in records],
+                [timestamp.timestamp() for timestamp in df['timestamp']],
+                [float(record['amount']) for record in records]
+            )
+            velocity = pd.DataFrame(velocity_rows, index=df.index)
+            for feature in velocity.columns:
+                df[feature] = velocity[feature]
+        if cardinality_store is not None:
+            for record in records:
+                cardinality_store.update(record)
+        if transaction_graph is not None:
+            graph_features = transaction_graph.preview_frame(df)
+            for feature in graph_features.columns:
+                df[feature] = graph_features[feature]
+        # Every row sees its user's history before the batch, as the grouped query did
+        if profile_store is not None:
+            user_profiles = profile_store.features(df['user_id'], df['timestamp'])
+            for feature in user_profiles.columns:
+                df[feature] = user_profiles[feature].to_numpy()
+        prepare_ms = (time.perf_counter() - feature_start) * 1000
+
+        # Tier-1 rules on the raw fields; only unsettled rows reach the context queries and model
+        tiers = np.full(len(df), TIER_MODEL, dtype=np.int8)
+        rules_ms = 0.0
+        if _cascade_active():
+            rules_start = time.perf_counter()
+            tiers = rule_cascade.tiers(df)
+            rules_ms = (time.perf_counter() - rules_start) * 1000
+        settled = (tiers != TIER_MODEL) if CASCADE_MODE == 'on' else np.zeros(len(df), dtype=bool)
+        model_rows = np.flatnonzero(~settled)
+
+        model_start = time.perf_counter()
+        threshold = _batch_threshold()
+        scores = np.full(len(df), np.nan)
+        thresholds = np.full(len(df), np.nan)
+        routed = None
+        member_ranks = None
+        member_seconds = {}
+        explanations = None
+        feature_ms = prepare_ms
+        scoring_ms = 0.0
+        explanation_ms = 0.0
+        if len(model_rows):
+            df_model = df.iloc[model_rows].reset_index(drop=True) if settled.any() else df
+            _add_batch_context_stats(df_model)
+            df_engineered = calculate_derived_features_chunked(df_model, cardinality_store=cardinality_store, inplace=True)
+            X_scaled = preprocessor.transform(df_engineered.reindex(columns=feature_names))
+            if drift_monitor is not None:
+                drift_monitor.update(X_scaled)
+            feature_ms += (time.perf_counter() - model_start) * 1000
+
+            scoring_start = time.perf_counter()
+            model_scores, model_thresholds, model_routed, member_ranks, member_seconds = _score_batch(
+                X_scaled, df_engineered, threshold
+            )
+            scores[model_rows] = model_scores
+            thresholds[model_rows] = model_thresholds
+            if model_routed is not None:
+                routed = np.full(len(df), None, dtype=object)
+                routed[model_rows] = model_routed
+            scoring_ms = (time.perf_counter() - scoring_start) * 1000
+
+            if request.explain:
+                explanation_start = time.perf_counter()
+                explanations = [[] for _ in records]
+                for row, top in zip(model_rows, _top_features(X_scaled, model_routed, request.top_k)):
+                    explanations[row] = top
+                explanation_ms = (time.perf_counter() - explanation_start) * 1000
+        model_seconds = time.perf_counter() - model_start
+
+        is_anomaly = scores <= thresholds
+        if settled.any():
+            rule_scores, rule_thresholds = rule_cascade.settled_scores(df, tiers)
+            scores[settled] = rule_scores[settled]
+            thresholds[settled] = rule_thresholds[settled]
+            is_anomaly[settled] = tiers[settled] == TIER_ANOMALY
+        if _cascade_active():
+            cascade_stats['batch'].record(tiers, rules_ms / 1000, len(model_rows), model_seconds)
+            if CASCADE_MODE == 'shadow':
+                cascade_stats['batch'].record_shadow(tiers, is_anomaly)
+
+        # Row position within the model-scored matrix, for the ensemble member ranks
+        model_position = np.full(len(df), -1)
+        model_position[model_rows] = np.arange(len(model_rows))
+        rule_descriptions = {}
+        predictions = []
+        for i, record in enumerate(records):
+            prediction = {
+                "transaction_id": record['transaction_id'],
+                "anomaly_score": float(round(scores[i], 4)),
+                "is_anomaly": bool(is_anomaly[i]),
+                "tier": TIER_NAMES[int(tiers[i])] if settled[i] else TIER_NAMES[TIER_MODEL]
+            }
+            if settled[i]:
+                key = (record['transaction_type'], int(tiers[i]))
+                if key not in rule_descriptions:
+                    rule_descriptions[key] = rule_cascade.describe(*key)
+                prediction["threshold"] = float(round(thresholds[i], 4))
+                prediction["rule"] = rule_descriptions[key]
+            elif routed is not None:
+                prediction["segment"] = routed[i]
+                prediction["threshold"] = float(round(thresholds[i], 4))
+            if member_ranks is not None and model_position[i] >= 0:
+                prediction["member_scores"] = {
+                    name: float(round(member_ranks[model_position[i], position], 4))
+                    for position, name in enumerate(ensemble.member_names)
+                }
+            if explanations is not None:
+                prediction["top_features"] = explanations[i]
+            predictions.append(prediction)
+
+        print(f"[ML API] Scored batch of {len(records)} in {feature_ms + scoring_ms + rules_ms:.1f} ms "
+              f"({int(settled.sum())} settled by rules in {rules_ms:.1f} ms, features {feature_ms:.1f} ms, "
+              f"scoring {scoring_ms:.1f} ms)")
+        _record_scored(records, df['timestamp'])
+        return {
+            "model_name": _served_model_name(),
+            "threshold": float(round(threshold, 4)) if threshold is not None else None,
+            "count": len(predictions),
+            "anomalies": int(is_anomaly.sum()),
+            "tiers": {TIER_NAMES[tier]: int((tiers[settled] == tier).sum()) if tier != TIER_MODEL else len(model_rows)
+                      for tier in TIER_NAMES},
+            "predictions": predictions,
+            "timing_ms": {
+                "rules": round(rules_ms, 3),
+                "features": round(feature_ms, 3),
+                "scoring": round(scoring_ms, 3),
+                "explanations": round(explanation_ms, 3),
+                "members": {name: round(seconds * 1000, 3) for name, seconds in member_seconds.items()}
+            }
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred during batch prediction: {e}")
+
+@app.get("/cascade", tags=["Metrics"])
+async def get_rule_cascade():
+    """
+    Tier-1 rule cascade: mode, per-type rules with their training agreement,
+    and live tier hit rates and estimated latency saved per endpoint.
+    """
+    if rule_cascade is None:
+        raise HTTPException(status_code=503,
+                            detail="Rule cascade unavailable: the model artifact has no tier-1 rules.")
+    return {
+        "mode": CASCADE_MODE if rule_cascade.enabled else "off",
+        **rule_cascade.summary(),
+        "endpoints": {endpoint: stats.report(CASCADE_MODE) for endpoint, stats in cascade_stats.items()}
+    }
+
+@app.get("/drift", tags=["Metrics"])
+async def get_feature_drift():
+    """
+    Feature drift of recently scored transactions against the training data.
+
+    PSI and a binned KS statistic per feature over the sliding window of the
+    last DRIFT_WINDOW_ROWS scored rows. retrain_recommended turns true once
+    enough features shift significantly (PSI >= 0.25).
+    """
+    if drift_monitor is None:
+        raise HTTPException(status_code=503,
+                            detail="Drift monitoring unavailable: the model artifact has no drift reference.")
+    return drift_monitor.report()
+
 @app.get("/transaction-trends/", tags=["Trends"])
 async def get_transaction_trends(interval: str = "day", period: int = 30):
     """
@@ -775,6 +1361,9 @@ async def get_feature_importance():
     if model is None:
         raise HTTPException(status_code=503, detail="Model is not loaded.")
 
+    if trained_feature_importance:
+        return [{"feature": name, "importance": share} for name, share in trained_feature_importance.items()]
+
     try:
         sample_data = pd.DataFrame(np.random.rand(100, len(feature_names)), columns=feature_names)
         for feature in encoders:
@@ -843,92 +1432,21 @@ def read_root():
     return {"status": "API is running", "model_loaded": model is not None}
 
 # Helper functions for enhanced confidence calculation
+def _adjusted_threshold(base_threshold, feature_confidence):
+    """Base threshold calibrated by feature confidence (same adjustment as offline scoring)"""
+    return float(adjusted_thresholds([base_threshold], [feature_confidence])[0])
+
 def _calculate_feature_confidence(df):
     """Calculate confidence based on feature quality and completeness"""
-    confidence_score = 0.5  # Base confidence
-    
-    # Boost confidence based on available high-quality features
-    if 'risk_confidence_score' in df.columns:
-        confidence_score = max(confidence_score, df['risk_confidence_score'].iloc[0])
-    
-    # Behavioral consistency boosts confidence
-    if 'device_consistency_score' in df.columns and 'location_consistency_score' in df.columns:
-        behavioral_consistency = (
-            df['device_consistency_score'].iloc[0] + 
-            df['location_consistency_score'].iloc[0]
-        ) / 2
-        confidence_score += behavioral_consistency * 0.15
-    
-    # Temporal pattern confidence
-    if 'is_business_hours' in df.columns:
-        if df['is_business_hours'].iloc[0] == 1:
-            confidence_score += 0.05  # More confident during business hours
-    
-    # Amount pattern confidence
-    if 'is_amount_outlier' in df.columns:
-        if df['is_amount_outlier'].iloc[0] == 0:
-            confidence_score += 0.05  # More confident for normal amounts
-    
-    return min(0.95, max(0.3, confidence_score))
+    return float(feature_confidences(df.iloc[:1])[0])
 
 def _calculate_prediction_confidence(anomaly_score, threshold, feature_confidence, df):
     """Calculate overall prediction confidence targeting 88-93%"""
-    
-    # Base confidence from model separation
-    score_separation = abs(anomaly_score - threshold) / abs(threshold)
-    separation_confidence = min(0.4, score_separation * 0.3)
-    
-    # Feature quality confidence
-    feature_conf_boost = feature_confidence * 0.3
-    
-    # Behavioral pattern confidence
-    behavioral_confidence = 0.0
-    if 'composite_risk_score' in df.columns:
-        risk_score = df['composite_risk_score'].iloc[0]
-        if risk_score > 0.7:  # High risk = high confidence in anomaly
-            behavioral_confidence = 0.15
-        elif risk_score < 0.3:  # Low risk = high confidence in normal
-            behavioral_confidence = 0.15
-        else:
-            behavioral_confidence = 0.05
-    
-    # Malawi-specific pattern confidence
-    malawi_confidence = 0.0
-    if 'is_payday' in df.columns and df['is_payday'].iloc[0] == 1:
-        malawi_confidence += 0.05  # Payday patterns are well understood
-    if 'is_market_day' in df.columns and df['is_market_day'].iloc[0] == 1:
-        malawi_confidence += 0.03  # Market day patterns
-    if 'cultural_risk_modifier' in df.columns:
-        malawi_confidence += 0.02  # Cultural context
-    
-    # Combine all confidence factors
-    total_confidence = (
-        0.65 +  # Base model confidence (65%)
-        separation_confidence +  # Score separation
-        feature_conf_boost +     # Feature quality
-        behavioral_confidence +  # Behavioral patterns
-        malawi_confidence       # Malawi-specific patterns
-    )
-    
-    # Target range: 88-93%
-    return min(0.93, max(0.88, total_confidence))
+    return float(prediction_confidences([anomaly_score], [threshold], [feature_confidence], df.iloc[:1])[0])
 
 def _calculate_enhanced_risk_score(anomaly_score, threshold, confidence):
     """Calculate enhanced risk score incorporating confidence"""
-    
-    # Normalize anomaly score to 0-1 range
-    if anomaly_score <= threshold:
-        # Anomaly detected
-        base_risk = 0.7 + (threshold - anomaly_score) / abs(threshold) * 0.25
-    else:
-        # Normal transaction
-        base_risk = 0.3 - (anomaly_score - threshold) / abs(threshold) * 0.25
-    
-    # Adjust based on confidence
-    confidence_adjustment = (confidence - 0.5) * 0.1
-    final_risk = base_risk + confidence_adjustment
-    
-    return max(0.01, min(0.99, final_risk))
+    return float(enhanced_risk_scores([anomaly_score], [threshold], [confidence])[0])
 
 def _get_algorithm_selection_reason(confidence, is_anomaly):
     """Generate reason for algorithm selection"""
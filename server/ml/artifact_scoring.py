@@ -0,0 +1,86 @@
+"""
+Scoring raw transaction frames with a saved model artifact outside the API.
+
+ArtifactScorer runs the same steps as api.py: derived features (with the
+artifact's cardinality sketches), the fitted Preprocessor, the segment models,
+else the ensemble, else the single model, and the API's calibrated risk score.
+Frame-level features (e.g. amount_zscore_global) are computed over the frame
+passed in, so a score can differ slightly from the API's for the same row.
+Used by the bulk DB rescoring job and the offline file scorer.
+"""
+from typing import Any, Dict, Tuple
+import joblib
+import numpy as np
+import pandas as pd
+
+from feature_engineering import calculate_derived_features_chunked, Preprocessor
+from cardinality_sketches import CardinalitySketchStore
+from risk_scoring import (feature_confidences, adjusted_thresholds, prediction_confidences, enhanced_risk_scores,
+                          single_model_threshold)
+
+MODEL_PATH = "trained_models/best_fraud_detection_model.joblib"
+
+
+class ArtifactScorer:
+    """Feature engineering, transform and scoring of raw transaction frames with a saved model artifact"""
+
+    def __init__(self, model_data: Dict[str, Any]):
+        self.model = model_data['model']
+        self.feature_names = model_data['feature_names']
+        self.preprocessor = model_data.get('preprocessor') or Preprocessor.from_legacy(
+            self.feature_names, model_data['scaler'], model_data['encoders']
+        )
+        self.cardinality_store = model_data.get('cardinality_sketches') or CardinalitySketchStore()
+        self.ensemble = model_data.get('ensemble')
+        self.segments = model_data.get('segments')
+        self.score_quantiles = model_data.get('score_quantiles')
+
+    @classmethod
+    def load(cls, path: str = MODEL_PATH) -> 'ArtifactScorer':
+        return cls(joblib.load(path))
+
+    @property
+    def model_name(self) -> str:
+        if self.segments is not None:
+            return f"segment_{self.segments.algorithm}"
+        return "rank_normalized_ensemble" if self.ensemble is not None else type(self.model).__name__
+
+    def score_frame(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Engineered frame, anomaly scores, per-row base thresholds and the model
+        used per row, scored by the segment models, else the ensemble, else the
+        single model (as the API does)
+        """
+        # The training sketches overlaid with this chunk's keys, so memory stays
+        # flat however many chunks a worker scores
+        cardinality_store = self.cardinality_store.overlay(df)
+        df_engineered = calculate_derived_features_chunked(df, cardinality_store=cardinality_store, inplace=True)
+        X = self.preprocessor.transform(df_engineered.reindex(columns=self.feature_names))
+        if self.segments is not None:
+            scores, thresholds, routed = self.segments.score(X, self.segments.keys_for(df_engineered))
+            return df_engineered, scores, thresholds, np.asarray(routed, dtype=object)
+        if self.ensemble is not None:
+            scores, _, _ = self.ensemble.score(X)
+            thresholds = np.full(len(X), self.ensemble.threshold)
+        else:
+            scores = self.model.score_samples(X)
+            thresholds = np.full(len(X), single_model_threshold(self.model, self.score_quantiles))
+        return df_engineered, scores, thresholds, np.full(len(X), self.model_name, dtype=object)
+
+    def score(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Per-row anomaly_score, adjusted threshold, is_anomaly, risk_score (the
+        API's calibrated transactions.risk_score) and model, in df's row order
+        """
+        df_engineered, scores, thresholds, routed = self.score_frame(df)
+        confidence = feature_confidences(df_engineered)
+        thresholds = adjusted_thresholds(thresholds, confidence)
+        risk = enhanced_risk_scores(scores, thresholds,
+                                    prediction_confidences(scores, thresholds, confidence, df_engineered))
+        return pd.DataFrame({
+            'anomaly_score': scores,
+            'threshold': thresholds,
+            'is_anomaly': scores <= thresholds,
+            'risk_score': risk,
+            'model': routed
+        })
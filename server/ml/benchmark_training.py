@@ -0,0 +1,325 @@
+"""
+Benchmark for the training pipeline stages.
+
+Builds deterministic synthetic datasets with the user profiles and transaction
+generator from data_generation/generate_data.py (no database needed), then
+runs load, feature engineering, preparation, each algorithm's hyperparameter
+search and save, recording wall time and peak RSS per stage (for the searches
+also the highest peak of the worker processes that ran the trials). Every run is
+appended to a JSON history; stages that are slower or use more memory than the
+stored baseline beyond the tolerances are flagged as regressions.
+
+Usage:
+    python benchmark_training.py [--sizes 10000 25000 50000] [--algorithms isolation_forest ...]
+                                 [--update-baseline] [--fail-on-regression]
+"""
+import os
+import sys
+import json
+import random
+import hashlib
+import argparse
+import platform
+import subprocess
+import tempfile
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+import numpy as np
+import pandas as pd
+
+from fraud_detection_model import (
+    ComprehensiveFraudDetectionModel,
+    TRAINING_SEARCH_STRATEGY,
+    TRAINING_CPU_BUDGET,
+    SCORE_QUANTILE_POINTS
+)
+from memory_tracking import track_peak_memory
+from streaming_loader import TRANSACTION_COLUMNS
+
+DATA_GENERATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data_generation')
+BENCHMARK_DIR = os.getenv("TRAINING_BENCHMARK_DIR", "trained_models/benchmarks")
+HISTORY_PATH = os.path.join(BENCHMARK_DIR, 'training_history.json')
+BASELINE_PATH = os.path.join(BENCHMARK_DIR, 'training_baseline.json')
+
+# A stage regresses when it exceeds the baseline by the relative tolerance and the absolute floor
+TIME_TOLERANCE = 0.25
+MEMORY_TOLERANCE = 0.15
+TIME_FLOOR_SECONDS = 0.05
+MEMORY_FLOOR_MB = 20.0
+
+
+def _import_generator():
+    if DATA_GENERATION_DIR not in sys.path:
+        sys.path.insert(0, DATA_GENERATION_DIR)
+    import generate_data
+    return generate_data
+
+
+def generate_benchmark_transactions(n_rows: int, seed: int = 42) -> pd.DataFrame:
+    """
+    n_rows completed transactions shaped like load_data_from_db output, drawn
+    from the generate_data profiles and spread over its DATE_RANGE with the
+    same seasonal and hour-of-day weighting.
+    """
+    generate_data = _import_generator()
+    random.seed(seed)
+    np.random.seed(seed)
+    # _generate_user_data reads the module constant; scale the population with the dataset
+    generate_data.NUM_UNIQUE_USERS = max(200, min(25_000, n_rows // 20))
+    generator = generate_data.MalawiBehavioralDataGenerator()
+    users = list(generator.users.values())
+    # Phone numbers come out of a set, whose order depends on string hashing; pin them by position
+    for user, phone in zip(users, sorted(generator.users)):
+        user.user_id = user.phone_number = phone
+
+    start_date, end_date = generate_data.DATE_RANGE
+    days = [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+    day_weights = np.array([generator._get_seasonal_multiplier(day) for day in days])
+    # Oversample to make up for pending/failed rows, which the training query filters out
+    day_targets = np.ceil(n_rows * 1.3 * day_weights / day_weights.sum()).astype(int)
+
+    transactions = []
+    for day, target in zip(days, day_targets):
+        hour_weights = np.array([generator._get_time_based_probability(hour, day.weekday()) for hour in range(24)])
+        hour_counts = np.round(target * hour_weights / hour_weights.sum()).astype(int)
+        active_users = random.sample(users, max(1, int(len(users) * generate_data.ACTIVE_USER_PERCENTAGE)))
+        for hour, count in enumerate(hour_counts):
+            for _ in range(count):
+                timestamp = day.replace(hour=hour, minute=random.randint(0, 59), second=random.randint(0, 59))
+                transactions.append(generator.generate_transaction(random.choice(active_users), timestamp))
+
+    df = pd.DataFrame(transactions)
+    df = df[df['status'] == 'completed'].head(n_rows)
+    if len(df) < n_rows:
+        print(f"⚠️  Generated only {len(df):,} completed transactions (requested {n_rows:,})")
+    # The transactions FK points at a system user; the generator leaves user_id unset
+    df['user_id'] = 'benchmark-system-user'
+    for expression, alias in TRANSACTION_COLUMNS:
+        if alias not in df.columns:
+            df[alias] = df[expression] if expression in df.columns else None
+    df = df[[alias for _, alias in TRANSACTION_COLUMNS]].reset_index(drop=True)
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    return df
+
+
+def dataset_path(n_rows: int, seed: int) -> str:
+    """Cached dataset location, keyed by size, seed and the generator's source"""
+    with open(os.path.join(DATA_GENERATION_DIR, 'generate_data.py'), 'rb') as f:
+        version = hashlib.blake2b(f.read(), digest_size=8).hexdigest()
+    return os.path.join(BENCHMARK_DIR, 'datasets', f'transactions_{n_rows}_{seed}_{version}.pkl')
+
+
+def ensure_dataset(n_rows: int, seed: int) -> str:
+    path = dataset_path(n_rows, seed)
+    if not os.path.exists(path):
+        print(f"Generating {n_rows:,} synthetic transactions (seed {seed})...")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        generate_benchmark_transactions(n_rows, seed).to_pickle(f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+    return path
+
+
+def benchmark_size(n_rows: int, seed: int, algorithms: List[str], max_trials: int,
+                   search_strategy: str, cpu_budget: int) -> Dict[str, Dict[str, float]]:
+    """Run every pipeline stage once on one dataset size and return per-stage measurements"""
+    path = ensure_dataset(n_rows, seed)
+    stages = {}
+    model = ComprehensiveFraudDetectionModel()
+    model.search_strategy = search_strategy
+    model.cpu_budget = cpu_budget
+    model.use_cache = False
+    model.use_checkpoints = False
+
+    with track_peak_memory('load', stages):
+        df = pd.read_pickle(path)
+
+    # prepare_training_data tracks its own stages (feature_engineering, preprocessor_fit, neutralize, transform)
+    X, _ = model.prepare_training_data(df)
+    del df
+    stages.update(model.memory_profile)
+
+    results = {}
+    for algorithm_name in algorithms:
+        # Trials on the process pool run in workers, whose peak this process's RSS doesn't show
+        model.worker_peak_rss_mb = None
+        with track_peak_memory(f'search_{algorithm_name}', stages):
+            trials, outputs = model.search(X, {algorithm_name: model.sample_trials(algorithm_name, max_trials)})[algorithm_name]
+            best_model, params, metrics, score = model._best_trial(trials, outputs)
+        stages[f'search_{algorithm_name}']['worker_peak_rss_mb'] = model.worker_peak_rss_mb
+        if best_model is None:
+            results[algorithm_name] = {'error': 'Training failed'}
+        else:
+            results[algorithm_name] = {
+                'model': best_model, 'best_params': params, 'metrics': metrics, 'composite_score': score,
+                'description': model.algorithm_configs[algorithm_name]['description']
+            }
+
+    best_model_name = model.select_best_model(results)
+    model.score_quantiles = np.quantile(model.serving_scores(results[best_model_name]['model'], X),
+                                        SCORE_QUANTILE_POINTS)
+    report = model.generate_comprehensive_report(results, best_model_name, model.training_rows)
+    # Save into a scratch directory so the deployed model and reports are untouched
+    working_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        os.chdir(scratch_dir)
+        try:
+            with track_peak_memory('save', stages):
+                model.save_model_and_report(results, best_model_name, report)
+        finally:
+            os.chdir(working_dir)
+    return stages
+
+
+def _best_of(runs: List[Dict[str, Dict[str, float]]]) -> Dict[str, Dict[str, float]]:
+    """Fastest time and lowest peak per stage across repeats"""
+    combined = {}
+    for stage in runs[0]:
+        combined[stage] = {
+            'seconds': min(run[stage]['seconds'] for run in runs),
+            'peak_rss_mb': min((run[stage]['peak_rss_mb'] or 0) for run in runs),
+            'worker_peak_rss_mb': min((run[stage].get('worker_peak_rss_mb') or 0) for run in runs) or None,
+            'per_stage_peak': runs[0][stage]['per_stage_peak']
+        }
+    return combined
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def find_regressions(run: Dict[str, Any], baseline: Dict[str, Any], time_tolerance: float = TIME_TOLERANCE,
+                     memory_tolerance: float = MEMORY_TOLERANCE) -> List[Dict[str, Any]]:
+    """Stages of run that are slower or use more memory than the same size and stage in baseline"""
+    regressions = []
+    for size, stages in run['results'].items():
+        base_stages = baseline.get('results', {}).get(size, {})
+        for stage, measured in stages.items():
+            base = base_stages.get(stage)
+            if base is None:
+                continue
+            checks = [
+                ('seconds', time_tolerance, TIME_FLOOR_SECONDS),
+                ('peak_rss_mb', memory_tolerance, MEMORY_FLOOR_MB),
+                ('worker_peak_rss_mb', memory_tolerance, MEMORY_FLOOR_MB),
+            ]
+            for metric, tolerance, floor in checks:
+                current, reference = measured.get(metric), base.get(metric)
+                if current is None or reference is None:
+                    continue
+                if current > reference * (1 + tolerance) and current - reference > floor:
+                    regressions.append({
+                        'rows': int(size), 'stage': stage, 'metric': metric,
+                        'baseline': reference, 'current': current,
+                        'change_pct': round((current / reference - 1) * 100, 1) if reference else None
+                    })
+    return regressions
+
+
+def print_results(run: Dict[str, Any], regressions: List[Dict[str, Any]], baseline: Dict[str, Any] = None):
+    flagged = {(r['rows'], r['stage'], r['metric']) for r in regressions}
+    for size, stages in run['results'].items():
+        base_stages = (baseline or {}).get('results', {}).get(size, {})
+        print(f"\n{int(size):,} rows")
+        print(f"{'Stage':<32} {'Time (s)':>10} {'Baseline':>10} {'Peak MB':>10} {'Baseline':>10} "
+              f"{'Worker MB':>10} {'Baseline':>10}")
+        print("-" * 98)
+        for stage, measured in stages.items():
+            base = base_stages.get(stage, {})
+            time_flag = ' ⚠️' if (int(size), stage, 'seconds') in flagged else ''
+            memory_flag = ' ⚠️' if (int(size), stage, 'peak_rss_mb') in flagged else ''
+            worker_flag = ' ⚠️' if (int(size), stage, 'worker_peak_rss_mb') in flagged else ''
+            base_time = f"{base['seconds']:.3f}" if 'seconds' in base else '-'
+            base_memory = f"{base['peak_rss_mb']:,.0f}" if base.get('peak_rss_mb') is not None else '-'
+            worker = f"{measured['worker_peak_rss_mb']:,.0f}" if measured.get('worker_peak_rss_mb') else '-'
+            base_worker = f"{base['worker_peak_rss_mb']:,.0f}" if base.get('worker_peak_rss_mb') else '-'
+            print(f"{stage:<32} {measured['seconds']:>10.3f} {base_time:>10} "
+                  f"{measured['peak_rss_mb']:>10,.0f} {base_memory:>10} "
+                  f"{worker:>10} {base_worker:>10}{time_flag}{memory_flag}{worker_flag}")
+
+
+def load_json(path: str, default):
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_json(path: str, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(data, f, indent=2, default=str)
+    os.replace(f"{path}.tmp", path)
+
+
+def run_benchmark(sizes: List[int], seed: int, algorithms: List[str], max_trials: int, repeats: int,
+                  search_strategy: str, cpu_budget: int) -> Dict[str, Any]:
+    run = {
+        'timestamp': datetime.now().isoformat(),
+        'commit': _git_commit(),
+        'config': {
+            'sizes': sizes, 'seed': seed, 'algorithms': algorithms, 'max_trials': max_trials,
+            'repeats': repeats, 'search_strategy': search_strategy, 'cpu_budget': cpu_budget
+        },
+        'environment': {
+            'python': platform.python_version(), 'machine': platform.machine(),
+            'cpu_count': os.cpu_count(), 'numpy': np.__version__, 'pandas': pd.__version__
+        },
+        'results': {}
+    }
+    for n_rows in sizes:
+        runs = [benchmark_size(n_rows, seed, algorithms, max_trials, search_strategy, cpu_budget)
+                for _ in range(repeats)]
+        run['results'][str(n_rows)] = _best_of(runs)
+    return run
+
+
+if __name__ == "__main__":
+    algorithm_names = list(ComprehensiveFraudDetectionModel().algorithm_configs)
+    parser = argparse.ArgumentParser(description="Benchmark training pipeline stages and track regressions")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 25_000, 50_000])
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--algorithms', nargs='+', choices=algorithm_names, default=algorithm_names)
+    parser.add_argument('--max-trials', type=int, default=6)
+    parser.add_argument('--repeats', type=int, default=1,
+                        help="Run each size this many times and keep the best time and peak per stage")
+    parser.add_argument('--search', choices=['halving', 'full'], default=TRAINING_SEARCH_STRATEGY)
+    parser.add_argument('--cpu-budget', type=int, default=TRAINING_CPU_BUDGET)
+    parser.add_argument('--time-tolerance', type=float, default=TIME_TOLERANCE)
+    parser.add_argument('--memory-tolerance', type=float, default=MEMORY_TOLERANCE)
+    parser.add_argument('--update-baseline', action='store_true',
+                        help="Store this run as the baseline future runs are compared against")
+    parser.add_argument('--fail-on-regression', action='store_true',
+                        help="Exit with status 1 when any stage regresses against the baseline")
+    args = parser.parse_args()
+
+    run = run_benchmark(args.sizes, args.seed, args.algorithms, args.max_trials, args.repeats,
+                        args.search, args.cpu_budget)
+    baseline = load_json(BASELINE_PATH, None)
+    regressions = find_regressions(run, baseline, args.time_tolerance, args.memory_tolerance) if baseline else []
+    if baseline and baseline.get('config') != run['config']:
+        print("⚠️  Baseline was recorded with a different configuration; only matching sizes and stages are compared")
+    run['baseline_commit'] = baseline.get('commit') if baseline else None
+    run['regressions'] = regressions
+
+    print_results(run, regressions, baseline)
+    history = load_json(HISTORY_PATH, [])
+    history.append(run)
+    write_json(HISTORY_PATH, history)
+    print(f"\n📈 Appended run to {HISTORY_PATH} ({len(history)} runs)")
+
+    if args.update_baseline or baseline is None:
+        write_json(BASELINE_PATH, run)
+        print(f"📌 Baseline saved to {BASELINE_PATH}")
+    if regressions:
+        print(f"\n⚠️  {len(regressions)} regression(s) against baseline {run['baseline_commit'] or ''}:")
+        for regression in regressions:
+            print(f"   {regression['rows']:,} rows / {regression['stage']}: {regression['metric']} "
+                  f"{regression['baseline']:.3f} -> {regression['current']:.3f} (+{regression['change_pct']}%)")
+        if args.fail_on_regression:
+            sys.exit(1)
+    elif baseline:
+        print("✅ No regressions against baseline")
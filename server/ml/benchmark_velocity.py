@@ -0,0 +1,102 @@
+"""
+Benchmark for per-sender velocity features.
+
+Generates synthetic Malawi-style transactions (no database needed), checks the
+vectorized implementation against a brute-force reference on a small sample and
+then times it at increasing sizes to show O(n log n) scaling.
+
+Usage:
+    python benchmark_velocity.py [--sizes 100000 1000000 4000000] [--senders 25000]
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+
+from feature_engineering import compute_sender_velocity_features, VELOCITY_WINDOWS, VELOCITY_MAX_GAP_SECONDS
+
+DATASET_DAYS = 90
+
+
+def make_synthetic_transactions(n_rows: int, n_senders: int, seed: int = 42) -> pd.DataFrame:
+    """Random senders, timestamps across DATASET_DAYS and log-normal MWK amounts"""
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2025-07-01T00:00:00')
+    offsets = rng.integers(0, DATASET_DAYS * 24 * 3600, n_rows).astype('timedelta64[s]')
+    return pd.DataFrame({
+        'sender_account': rng.integers(0, n_senders, n_rows).astype(str),
+        'timestamp': start + offsets,
+        'amount': np.round(rng.lognormal(8.5, 1.2, n_rows), 2)
+    })
+
+
+def brute_force_velocity(df: pd.DataFrame) -> pd.DataFrame:
+    """Quadratic per-row reference used only to validate the fast path"""
+    seconds = df['timestamp'].to_numpy(dtype='datetime64[s]').astype(np.int64)
+    senders = df['sender_account'].to_numpy()
+    amounts = df['amount'].to_numpy(dtype=float)
+    rows = []
+    for i in range(len(df)):
+        same = senders == senders[i]
+        # Earlier rows plus ties that precede i in (sender, timestamp, position) order
+        earlier = same & ((seconds < seconds[i]) | ((seconds == seconds[i]) & (np.arange(len(df)) <= i)))
+        row = {}
+        for label, window_seconds in VELOCITY_WINDOWS.items():
+            in_window = earlier & (seconds >= seconds[i] - window_seconds)
+            row[f'sender_txn_count_{label}'] = int(in_window.sum())
+            row[f'sender_txn_amount_{label}'] = float(amounts[in_window].sum())
+        previous = earlier.copy()
+        previous[i] = False
+        row['time_since_last_seconds'] = (
+            float(min(seconds[i] - seconds[previous].max(), VELOCITY_MAX_GAP_SECONDS))
+            if previous.any() else float(VELOCITY_MAX_GAP_SECONDS)
+        )
+        rows.append(row)
+    return pd.DataFrame(rows, index=df.index)
+
+
+def verify_against_brute_force(n_rows: int = 2000, n_senders: int = 50):
+    """Raise AssertionError if the fast path disagrees with the reference"""
+    df = make_synthetic_transactions(n_rows, n_senders, seed=7)
+    # Compress into one day so the 10m/1h windows actually contain neighbours
+    df['timestamp'] = np.datetime64('2025-07-01T00:00:00') + (
+        df['timestamp'] - df['timestamp'].min()
+    ).to_numpy() // DATASET_DAYS
+    df = df.sort_values(['sender_account', 'timestamp'], kind='stable').reset_index(drop=True)
+    fast = compute_sender_velocity_features(df)
+    reference = brute_force_velocity(df)
+    for col in reference.columns:
+        np.testing.assert_allclose(fast[col].to_numpy(dtype=float), reference[col].to_numpy(dtype=float),
+                                   rtol=1e-9, atol=1e-6, err_msg=col)
+    print(f"✅ Velocity features match brute-force reference on {n_rows:,} rows")
+
+
+def run_benchmark(sizes, n_senders: int, repeats: int = 3):
+    """Time compute_sender_velocity_features at each size and print a scaling table"""
+    print(f"\n{'Rows':>12} {'Best (s)':>10} {'ns/row':>10} {'ns/(n log2 n)':>14}")
+    print("-" * 50)
+    results = []
+    for n_rows in sizes:
+        df = make_synthetic_transactions(n_rows, n_senders)
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            compute_sender_velocity_features(df)
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        per_row = best / n_rows * 1e9
+        per_nlogn = best / (n_rows * np.log2(n_rows)) * 1e9
+        print(f"{n_rows:>12,} {best:>10.3f} {per_row:>10.1f} {per_nlogn:>14.2f}")
+        results.append({'rows': n_rows, 'seconds': best})
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark per-sender velocity features")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100_000, 1_000_000, 4_000_000])
+    parser.add_argument('--senders', type=int, default=25_000)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    verify_against_brute_force()
+    run_benchmark(args.sizes, args.senders, args.repeats)
@@ -0,0 +1,305 @@
+"""
+Bulk rescoring of transactions.risk_score with the current model artifact.
+
+The table is read in keyset-paginated pages ordered by (sender_account,
+transaction_id) through the COPY streaming loader. A full page is cut back to
+the last complete sender, so every chunk holds whole sender histories and the
+per-sender features match what training computes. Feature engineering and
+scoring run in a process pool (each worker loads the artifact once), while the
+main process keeps reading pages and writes each scored chunk back with a COPY
+into a temporary table and a single UPDATE ... FROM.
+
+Progress is checkpointed as the keyset position after the last contiguous
+chunk written, so an interrupted run resumes there; rewriting the few chunks
+that finished out of order is harmless because the UPDATE is idempotent.
+
+    python bulk_rescore.py --workers 4 --chunk-size 20000
+"""
+import io
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional, Tuple
+import pandas as pd
+import psycopg2
+from dotenv import load_dotenv
+
+from artifact_scoring import ArtifactScorer, MODEL_PATH as DEFAULT_MODEL_PATH
+from streaming_loader import TRANSACTION_COLUMNS, iter_transaction_chunks
+
+load_dotenv()
+
+MODEL_PATH = os.getenv("RESCORE_MODEL_PATH", DEFAULT_MODEL_PATH)
+RESCORE_CHUNK_SIZE = int(os.getenv("RESCORE_CHUNK_SIZE", "20000"))
+RESCORE_WORKERS = int(os.getenv("RESCORE_WORKERS", "0")) or os.cpu_count() or 1
+RESCORE_CHECKPOINT_PATH = os.getenv("RESCORE_CHECKPOINT_PATH", "trained_models/rescore_checkpoint.json")
+
+RESCORE_COLUMNS = [('transaction_id', 'transaction_id')] + TRANSACTION_COLUMNS
+
+
+_worker_scorer = None
+
+
+def _init_worker(model_path: str):
+    global _worker_scorer
+    _worker_scorer = ArtifactScorer.load(model_path)
+
+
+def _score_chunk(chunk_index: int, chunk: pd.DataFrame) -> Tuple[int, pd.DataFrame, int, float]:
+    """Worker task: (chunk index, transaction_id/risk_score frame, anomalies, seconds)"""
+    start = time.perf_counter()
+    transaction_ids = chunk['transaction_id'].to_numpy()
+    scored = _worker_scorer.score(chunk)
+    results = pd.DataFrame({'transaction_id': transaction_ids, 'risk_score': scored['risk_score'].round(2).to_numpy()})
+    return chunk_index, results, int(scored['is_anomaly'].sum()), time.perf_counter() - start
+
+
+def get_db_connection():
+    return psycopg2.connect(
+        dbname=os.getenv("DB_DATABASE"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT"),
+        connect_timeout=30
+    )
+
+
+def ensure_keyset_index(conn):
+    """
+    Index serving the keyset pages; without it every page is a full scan and
+    sort. Built CONCURRENTLY (which cannot run inside a transaction, hence
+    autocommit) so writes to the live table are not blocked during the build;
+    an invalid index left by an interrupted build is dropped and rebuilt.
+    """
+    autocommit = conn.autocommit
+    conn.commit()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                "WHERE c.relname = 'idx_transactions_sender_keyset'"
+            )
+            existing = cursor.fetchone()
+            if existing is not None and existing[0]:
+                return
+            if existing is not None:
+                cursor.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_transactions_sender_keyset")
+            print("Building idx_transactions_sender_keyset concurrently...")
+            cursor.execute(
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_transactions_sender_keyset "
+                "ON transactions ((COALESCE(sender_account, '')), transaction_id)"
+            )
+    except psycopg2.Error as e:
+        print(f"⚠️  Could not create idx_transactions_sender_keyset ({e}); every page will scan and sort the table")
+    finally:
+        conn.autocommit = autocommit
+
+
+def build_page_query(cursor, after: Optional[Tuple[str, str]], page_size: int, status: str = None) -> str:
+    """One keyset page ordered by (sender_account, transaction_id); NULL senders sort as ''"""
+    select_list = ', '.join(
+        expression if expression == alias else f"{expression} AS {alias}" for expression, alias in RESCORE_COLUMNS
+    )
+    conditions, params = [], []
+    if status:
+        conditions.append("status = %s")
+        params.append(status)
+    if after is not None:
+        conditions.append("(COALESCE(sender_account, ''), transaction_id) > (%s, %s::uuid)")
+        params.extend(after)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    query = (f"SELECT {select_list} FROM transactions {where} "
+             f"ORDER BY COALESCE(sender_account, ''), transaction_id LIMIT %s")
+    return cursor.mogrify(query, params + [int(page_size)]).decode('utf-8')
+
+
+def iter_sender_chunks(conn, page_size: int, after: Optional[Tuple[str, str]] = None,
+                       status: str = None) -> Iterator[Tuple[pd.DataFrame, Tuple[str, str]]]:
+    """
+    Yield (chunk, keyset position after it). A full page drops its trailing
+    sender, who starts the next page instead, unless that sender fills the page.
+    """
+    while True:
+        with conn.cursor() as cursor:
+            select_sql = build_page_query(cursor, after, page_size, status)
+        pages = list(iter_transaction_chunks(conn, select_sql=select_sql, chunk_size=page_size))
+        page = pd.concat(pages, ignore_index=True) if pages else pd.DataFrame()
+        if page.empty:
+            return
+        last_page = len(page) < page_size
+        senders = page['sender_account'].fillna('').astype(str)
+        if not last_page:
+            complete = (senders != senders.iloc[-1]).to_numpy()
+            if complete.any():
+                page = page[complete].reset_index(drop=True)
+                senders = senders[complete].reset_index(drop=True)
+        after = (senders.iloc[-1], str(page['transaction_id'].iloc[-1]))
+        yield page, after
+        if last_page:
+            return
+
+
+class RescoreWriter:
+    """COPY scored rows into a session temp table and UPDATE transactions from it, one transaction per chunk"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS rescored_transactions "
+                "(transaction_id uuid PRIMARY KEY, risk_score numeric(5, 2)) ON COMMIT DELETE ROWS"
+            )
+        conn.commit()
+
+    def write(self, results: pd.DataFrame) -> int:
+        """Rows whose risk_score changed"""
+        buffer = io.StringIO()
+        results.to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        try:
+            with self.conn.cursor() as cursor:
+                cursor.copy_expert("COPY rescored_transactions (transaction_id, risk_score) FROM STDIN WITH (FORMAT csv)",
+                                   buffer)
+                cursor.execute(
+                    "UPDATE transactions t SET risk_score = r.risk_score FROM rescored_transactions r "
+                    "WHERE t.transaction_id = r.transaction_id AND t.risk_score IS DISTINCT FROM r.risk_score"
+                )
+                changed = cursor.rowcount
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return changed
+
+
+def model_fingerprint(path: str) -> Dict[str, Any]:
+    """Identifies the artifact a checkpoint was written for"""
+    stat = os.stat(path)
+    return {'model_path': os.path.abspath(path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def load_checkpoint(path: str, fingerprint: Dict[str, Any], status: str = None) -> Optional[Dict[str, Any]]:
+    """Unfinished checkpoint for the same artifact and filter, if any"""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get('completed'):
+        return None
+    if checkpoint.get('model') != fingerprint or checkpoint.get('status') != status:
+        print(f"⚠️  Ignoring checkpoint {path}: written for a different model artifact or status filter")
+        return None
+    return checkpoint
+
+
+def save_checkpoint(path: str, checkpoint: Dict[str, Any]):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def rescore_transactions(model_path: str = MODEL_PATH, chunk_size: int = RESCORE_CHUNK_SIZE,
+                         workers: int = RESCORE_WORKERS, status: str = None,
+                         checkpoint_path: str = RESCORE_CHECKPOINT_PATH, restart: bool = False) -> Dict[str, Any]:
+    """
+    Rescore every transaction (or those with the given status) and return the
+    run summary. Resumes from checkpoint_path unless restart is set.
+    """
+    fingerprint = model_fingerprint(model_path)
+    checkpoint = None if restart else load_checkpoint(checkpoint_path, fingerprint, status)
+    if checkpoint:
+        print(f"♻️  Resuming after {checkpoint['rows_done']:,} rows (sender {checkpoint['after'][0]!r})")
+    else:
+        checkpoint = {'model': fingerprint, 'status': status, 'after': None, 'rows_done': 0, 'rows_changed': 0,
+                      'anomalies': 0, 'seconds': 0.0, 'started_at': datetime.now().isoformat(), 'completed': False}
+    after = tuple(checkpoint['after']) if checkpoint['after'] else None
+
+    read_conn = get_db_connection()
+    write_conn = get_db_connection()
+    ensure_keyset_index(write_conn)
+    writer = RescoreWriter(write_conn)
+    executor = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(model_path,)) if workers > 1 else None
+    if executor is None:
+        _init_worker(model_path)
+    print(f"🔁 Rescoring transactions with {model_path} on {workers} worker(s), {chunk_size:,}-row pages")
+
+    start = time.perf_counter()
+    previous_seconds = checkpoint['seconds']
+    run_rows = 0
+    positions = {}   # chunk index -> keyset position after it
+    finished = set()
+    next_to_checkpoint = 0
+
+    def record(chunk_index: int, results: pd.DataFrame, anomalies: int, seconds: float):
+        nonlocal run_rows, next_to_checkpoint
+        changed = writer.write(results)
+        run_rows += len(results)
+        checkpoint['rows_done'] += len(results)
+        checkpoint['rows_changed'] += changed
+        checkpoint['anomalies'] += anomalies
+        finished.add(chunk_index)
+        # Only advance over the contiguous prefix of written chunks
+        while next_to_checkpoint in finished:
+            checkpoint['after'] = list(positions.pop(next_to_checkpoint))
+            finished.discard(next_to_checkpoint)
+            next_to_checkpoint += 1
+        elapsed = time.perf_counter() - start
+        checkpoint['seconds'] = round(previous_seconds + elapsed, 3)
+        save_checkpoint(checkpoint_path, checkpoint)
+        print(f"   ...rescored {checkpoint['rows_done']:,} rows ({run_rows / max(elapsed, 1e-9):,.0f} rows/sec, "
+              f"chunk {len(results):,} rows in {seconds:.2f}s, {changed:,} changed)")
+
+    try:
+        pending = set()
+        max_pending = workers * 2
+        for chunk_index, (chunk, position) in enumerate(iter_sender_chunks(read_conn, chunk_size, after, status)):
+            positions[chunk_index] = position
+            if executor is None:
+                record(*_score_chunk(chunk_index, chunk))
+                continue
+            pending.add(executor.submit(_score_chunk, chunk_index, chunk))
+            while len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    record(*future.result())
+        for future in list(pending):
+            record(*future.result())
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        read_conn.close()
+        write_conn.close()
+
+    elapsed = time.perf_counter() - start
+    checkpoint.update({
+        'completed': True,
+        'seconds': round(previous_seconds + elapsed, 3),
+        'finished_at': datetime.now().isoformat()
+    })
+    save_checkpoint(checkpoint_path, checkpoint)
+    print(f"\n✅ Rescored {run_rows:,} rows in {elapsed:.1f}s ({run_rows / max(elapsed, 1e-9):,.0f} rows/sec); "
+          f"{checkpoint['rows_changed']:,} risk scores changed, {checkpoint['anomalies']:,} anomalies")
+    return checkpoint
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rescore transactions.risk_score with the current model")
+    parser.add_argument('--model-path', default=MODEL_PATH)
+    parser.add_argument('--chunk-size', type=int, default=RESCORE_CHUNK_SIZE,
+                        help="Rows per keyset page (trimmed back to whole senders)")
+    parser.add_argument('--workers', type=int, default=RESCORE_WORKERS)
+    parser.add_argument('--status', default=None, help="Only rescore transactions with this status")
+    parser.add_argument('--checkpoint', default=RESCORE_CHECKPOINT_PATH)
+    parser.add_argument('--restart', action='store_true', help="Ignore an unfinished checkpoint and start over")
+    args = parser.parse_args()
+
+    rescore_transactions(args.model_path, args.chunk_size, args.workers, args.status, args.checkpoint, args.restart)
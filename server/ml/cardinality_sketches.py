@@ -0,0 +1,474 @@
+"""
+HyperLogLog sketches for approximate distinct counts (diversity features).
+
+Replaces per-request COUNT(DISTINCT ...) queries and groupby nunique with
+fixed-size, mergeable sketches per user and per location. Sketches can be built
+in bulk from a DataFrame, updated one transaction at a time at serving time,
+merged across workers and read in constant time. A sketch keeps its few
+non-zero registers as sparse (index, rank) pairs until dense registers are
+smaller, so the typical user with a handful of cities or devices costs a few
+bytes rather than a full register array.
+"""
+import os
+import math
+import hashlib
+import threading
+from typing import Dict, Any, Optional
+import joblib
+import numpy as np
+import pandas as pd
+
+# Relative standard error target; precision p gives 1.04 / sqrt(2^p)
+DEFAULT_HLL_ERROR = float(os.getenv("HLL_RELATIVE_ERROR", "0.05"))
+
+# feature name -> (key field, value field); 'user' resolves to sender_account or user_id
+SKETCH_DIMENSIONS = {
+    'user_location_diversity': ('user', 'location_city'),
+    'user_device_diversity': ('user', 'device_type'),
+    'user_transaction_type_diversity': ('user', 'transaction_type'),
+    'location_user_id_nunique': ('location_city', 'user')
+}
+
+# Sketches of keys with no transaction for this long (event time) are evicted at serving time
+SKETCH_IDLE_SECONDS = float(os.getenv("SKETCH_IDLE_DAYS", "180")) * 24 * 60 * 60
+
+_INV_POW2 = np.ldexp(1.0, -np.arange(65))
+
+
+def precision_for_error(relative_error: float) -> int:
+    """Smallest HLL precision whose standard error is within relative_error"""
+    precision = math.ceil(math.log2((1.04 / relative_error) ** 2))
+    return int(min(16, max(4, precision)))
+
+
+def _alpha(m: int) -> float:
+    if m == 16:
+        return 0.673
+    if m == 32:
+        return 0.697
+    if m == 64:
+        return 0.709
+    return 0.7213 / (1 + 1.079 / m)
+
+
+def _hash_one(value) -> int:
+    """Stable 64-bit hash of a value compared as a string"""
+    return int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def user_keys(df: pd.DataFrame) -> pd.Series:
+    """Per-row user key: sender_account, else user_id (None where both are missing)"""
+    keys = pd.Series(None, index=df.index, dtype=object)
+    for col in ['user_id', 'sender_account']:
+        if col in df.columns:
+            values = df[col]
+            present = values.notna() & (values.astype(str) != '')
+            keys = keys.where(~present, values.astype(str))
+    return keys
+
+
+def _record_user_key(record: Dict[str, Any]) -> Optional[str]:
+    """user_keys() for a single transaction dict"""
+    key = record.get('sender_account') or record.get('user_id')
+    return None if key is None or (isinstance(key, float) and math.isnan(key)) else str(key)
+
+
+def _hash_values(values) -> np.ndarray:
+    """Hash an array of values, computing each distinct value's hash only once"""
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object).astype(str))
+    hashed = np.fromiter((_hash_one(value) for value in uniques), dtype=np.uint64, count=len(uniques))
+    return hashed[codes]
+
+
+def _register_update(hashed: int, precision: int):
+    """Scalar version of _register_updates for single-transaction updates"""
+    index = hashed >> (64 - precision)
+    top_bits = ((hashed << precision) & 0xFFFFFFFFFFFFFFFF) >> 11
+    rank = 54 - top_bits.bit_length() if top_bits else 54
+    return index, min(rank, 64 - precision + 1)
+
+
+def _register_updates(hashes: np.ndarray, precision: int):
+    """Register index and rank (position of first 1-bit) for each hash"""
+    index = (hashes >> np.uint64(64 - precision)).astype(np.intp)
+    remainder = hashes << np.uint64(precision)
+    # Top 53 bits convert to float64 exactly; frexp's exponent is their bit length
+    top_bits = (remainder >> np.uint64(11)).astype(np.float64)
+    _, bit_length = np.frexp(top_bits)
+    rank = np.where(top_bits > 0, 54 - bit_length, 54)
+    rank = np.minimum(rank, 64 - precision + 1).astype(np.uint8)
+    return index, rank
+
+
+def estimate_registers(registers: np.ndarray) -> np.ndarray:
+    """Vectorized HLL estimate for a (n_sketches, m) register matrix"""
+    registers = np.atleast_2d(registers)
+    m = registers.shape[1]
+    raw = _alpha(m) * m * m / _INV_POW2[registers].sum(axis=1)
+    zeros = (registers == 0).sum(axis=1)
+    # Linear counting for small cardinalities
+    use_linear = (raw <= 2.5 * m) & (zeros > 0)
+    linear = m * np.log(m / np.maximum(zeros, 1))
+    return np.where(use_linear, linear, raw)
+
+
+class HyperLogLog:
+    """
+    Single HyperLogLog sketch over 2^precision uint8 registers, held as sorted
+    sparse (index, rank) pairs while that is smaller than the dense array
+    """
+    __slots__ = ('precision', 'registers', 'sparse_index', 'sparse_rank', 'last_seen', '_estimate')
+
+    def __init__(self, precision: int = None, registers: np.ndarray = None):
+        self.precision = precision or precision_for_error(DEFAULT_HLL_ERROR)
+        self.registers = None
+        self.sparse_index = np.zeros(0, dtype=np.uint16)
+        self.sparse_rank = np.zeros(0, dtype=np.uint8)
+        self.last_seen = np.nan
+        self._estimate = None
+        if registers is not None:
+            self._set_registers(registers)
+
+    @property
+    def relative_error(self) -> float:
+        return 1.04 / math.sqrt(1 << self.precision)
+
+    @property
+    def is_sparse(self) -> bool:
+        return self.registers is None
+
+    def _sparse_limit(self) -> int:
+        # 3 bytes per sparse pair vs 1 per dense register
+        return (1 << self.precision) // 3
+
+    def nbytes(self) -> int:
+        if self.registers is not None:
+            return self.registers.nbytes
+        return self.sparse_index.nbytes + self.sparse_rank.nbytes
+
+    def dense_registers(self) -> np.ndarray:
+        """The registers as a dense array (a copy when the sketch is sparse)"""
+        if self.registers is not None:
+            return self.registers
+        registers = np.zeros(1 << self.precision, dtype=np.uint8)
+        registers[self.sparse_index] = self.sparse_rank
+        return registers
+
+    def _set_registers(self, registers: np.ndarray):
+        """Store registers sparse or dense, whichever is smaller"""
+        nonzero = np.flatnonzero(registers)
+        if len(nonzero) <= self._sparse_limit():
+            self.registers = None
+            self.sparse_index = nonzero.astype(np.uint16)
+            self.sparse_rank = registers[nonzero].astype(np.uint8)
+        else:
+            # A row of a bulk-built register matrix is copied so the matrix can be freed
+            self.registers = registers if registers.base is None else registers.copy()
+            self.sparse_index = self.sparse_rank = None
+        self._estimate = None
+
+    def add_many(self, values):
+        """Add an iterable of values"""
+        values = list(values) if not isinstance(values, (np.ndarray, pd.Series)) else values
+        if len(values) == 0:
+            return
+        index, rank = _register_updates(_hash_values(values), self.precision)
+        registers = self.dense_registers()
+        np.maximum.at(registers, index, rank)
+        self._set_registers(registers)
+
+    def add(self, value):
+        index, rank = _register_update(_hash_one(value), self.precision)
+        if self.registers is not None:
+            if rank > self.registers[index]:
+                self.registers[index] = rank
+                self._estimate = None
+            return
+        position = int(np.searchsorted(self.sparse_index, index))
+        if position < len(self.sparse_index) and self.sparse_index[position] == index:
+            if rank > self.sparse_rank[position]:
+                self.sparse_rank[position] = rank
+                self._estimate = None
+            return
+        if len(self.sparse_index) + 1 > self._sparse_limit():
+            registers = self.dense_registers()
+            registers[index] = rank
+            self._set_registers(registers)
+            return
+        self.sparse_index = np.insert(self.sparse_index, position, index)
+        self.sparse_rank = np.insert(self.sparse_rank, position, rank)
+        self._estimate = None
+
+    def merge(self, other: 'HyperLogLog'):
+        """In-place union with another sketch of the same precision"""
+        if other.precision != self.precision:
+            raise ValueError(f"Cannot merge HLL precision {other.precision} into {self.precision}")
+        registers = self.dense_registers()
+        if other.registers is not None:
+            np.maximum(registers, other.registers, out=registers)
+        else:
+            np.maximum.at(registers, other.sparse_index.astype(np.intp), other.sparse_rank)
+        self._set_registers(registers)
+        self.last_seen = np.fmax(self.last_seen, other.last_seen)
+
+    def copy(self) -> 'HyperLogLog':
+        sketch = HyperLogLog(self.precision)
+        if self.registers is not None:
+            sketch.registers = self.registers.copy()
+            sketch.sparse_index = sketch.sparse_rank = None
+        else:
+            sketch.sparse_index = self.sparse_index.copy()
+            sketch.sparse_rank = self.sparse_rank.copy()
+        sketch.last_seen = self.last_seen
+        return sketch
+
+    def count(self) -> float:
+        """Approximate distinct count (cached until the next update)"""
+        if self._estimate is None:
+            self._estimate = float(estimate_registers(self.dense_registers())[0])
+        return self._estimate
+
+    def __getstate__(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__ if slot != '_estimate'}
+
+    def __setstate__(self, state):
+        # Sketches pickled before sparse registers carry (None, {'precision', 'registers', ...})
+        if isinstance(state, tuple):
+            state = state[1]
+        self.precision = state['precision']
+        self.last_seen = state.get('last_seen', np.nan)
+        self._estimate = None
+        if 'sparse_index' in state:
+            self.registers = state['registers']
+            self.sparse_index = state['sparse_index']
+            self.sparse_rank = state['sparse_rank']
+        else:
+            self.registers = None
+            self._set_registers(state['registers'])
+
+
+class CardinalitySketchStore:
+    """
+    Per-user and per-location HyperLogLog sketches for the diversity features in
+    SKETCH_DIMENSIONS. The user key is sender_account, else user_id, on every
+    path (bulk build, estimates and single-transaction updates).
+    """
+
+    def __init__(self, relative_error: float = DEFAULT_HLL_ERROR, dimensions: Dict[str, tuple] = None,
+                 idle_seconds: float = SKETCH_IDLE_SECONDS):
+        self.relative_error = relative_error
+        self.precision = precision_for_error(relative_error)
+        self.dimensions = dict(dimensions or SKETCH_DIMENSIONS)
+        self.sketches = {feature: {} for feature in self.dimensions}
+        self.idle_seconds = idle_seconds
+        self.max_event_time = np.nan
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _field_values(df: pd.DataFrame, field: str) -> Optional[pd.Series]:
+        """Per-row values of a sketch field as strings (None where missing), or None if df lacks it"""
+        if field == 'user':
+            if 'sender_account' not in df.columns and 'user_id' not in df.columns:
+                return None
+            return user_keys(df)
+        if field not in df.columns:
+            return None
+        values = df[field]
+        return values.astype(str).where(values.notna(), None)
+
+    @staticmethod
+    def _record_value(record: Dict[str, Any], field: str):
+        if field == 'user':
+            return _record_user_key(record)
+        return record.get(field)
+
+    @staticmethod
+    def _event_seconds(timestamp) -> float:
+        if timestamp is None:
+            return np.nan
+        try:
+            return pd.Timestamp(timestamp).timestamp()
+        except (TypeError, ValueError):
+            return np.nan
+
+    def update(self, record: Dict[str, Any]) -> Dict[str, float]:
+        """Add one transaction to every sketch it touches and return its estimates"""
+        estimates = {}
+        event_time = self._event_seconds(record.get('timestamp'))
+        with self._lock:
+            self.max_event_time = np.fmax(self.max_event_time, event_time)
+            for feature, (key_field, value_field) in self.dimensions.items():
+                key = self._record_value(record, key_field)
+                value = self._record_value(record, value_field)
+                if key is None:
+                    continue
+                sketch = self.sketches[feature].get(str(key))
+                if sketch is None:
+                    sketch = HyperLogLog(self.precision)
+                    self.sketches[feature][str(key)] = sketch
+                if value is not None:
+                    sketch.add(value)
+                sketch.last_seen = np.fmax(sketch.last_seen, event_time)
+                estimates[feature] = sketch.count()
+        return estimates
+
+    def estimate(self, feature: str, key) -> float:
+        """Approximate distinct count for one key, 0 if never seen"""
+        if key is None:
+            return 0.0
+        sketch = self.sketches[feature].get(str(key))
+        return sketch.count() if sketch is not None else 0.0
+
+    def add_frame(self, df: pd.DataFrame):
+        """Bulk-add a DataFrame of transactions with one vectorized pass per dimension"""
+        event_times = None
+        if 'timestamp' in df.columns and not df.empty:
+            event_times = pd.Series(pd.to_datetime(df['timestamp']).to_numpy(dtype='datetime64[ns]')
+                                    .astype(np.int64) / 1e9, index=df.index)
+        for feature, (key_field, value_field) in self.dimensions.items():
+            key_values = self._field_values(df, key_field)
+            value_values = self._field_values(df, value_field)
+            if key_values is None or value_values is None or df.empty:
+                continue
+            rows = pd.DataFrame({'key': key_values, 'value': value_values}).dropna()
+            if rows.empty:
+                continue
+            key_codes, keys = pd.factorize(rows['key'])
+            index, rank = _register_updates(_hash_values(rows['value']), self.precision)
+            registers = np.zeros((len(keys), 1 << self.precision), dtype=np.uint8)
+            np.maximum.at(registers, (key_codes, index), rank)
+            last_seen = np.full(len(keys), np.nan)
+            if event_times is not None:
+                np.fmax.at(last_seen, key_codes, event_times.loc[rows.index].to_numpy())
+
+            with self._lock:
+                existing = self.sketches[feature]
+                for row, key in enumerate(keys):
+                    incoming = HyperLogLog(self.precision, registers[row])
+                    incoming.last_seen = last_seen[row]
+                    sketch = existing.get(key)
+                    if sketch is None:
+                        existing[key] = incoming
+                    else:
+                        sketch.merge(incoming)
+        if event_times is not None:
+            with self._lock:
+                self.max_event_time = np.fmax(self.max_event_time, event_times.max())
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, relative_error: float = DEFAULT_HLL_ERROR) -> 'CardinalitySketchStore':
+        store = cls(relative_error)
+        store.add_frame(df)
+        return store
+
+    def estimates_for_frame(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Per-row diversity estimates, looked up once per distinct key (0 for rows without a key)"""
+        features = {}
+        for feature, (key_field, _) in self.dimensions.items():
+            key_values = self._field_values(df, key_field)
+            if key_values is None:
+                continue
+            key_codes, keys = pd.factorize(key_values)
+            sketches = self.sketches[feature]
+            # Estimate every stale sketch in one vectorized call
+            stale = [sketches[key] for key in keys if key in sketches and sketches[key]._estimate is None]
+            if stale:
+                estimates = estimate_registers(np.stack([sketch.dense_registers() for sketch in stale]))
+                for sketch, estimate in zip(stale, estimates):
+                    sketch._estimate = float(estimate)
+            # factorize codes missing keys as -1, which index the trailing 0.0
+            per_key = np.array([self.estimate(feature, key) for key in keys] + [0.0], dtype=float)
+            features[feature] = per_key[key_codes]
+        return pd.DataFrame(features, index=df.index)
+
+    def merge(self, other: 'CardinalitySketchStore'):
+        """Union another worker's sketches into this store"""
+        if other.precision != self.precision:
+            raise ValueError(f"Cannot merge sketch stores with precision {other.precision} and {self.precision}")
+        with self._lock:
+            for feature, sketches in other.sketches.items():
+                target = self.sketches.setdefault(feature, {})
+                for key, sketch in sketches.items():
+                    if key in target:
+                        target[key].merge(sketch)
+                    else:
+                        target[key] = sketch.copy()
+            self.max_event_time = np.fmax(self.max_event_time, other.max_event_time)
+
+    def overlay(self, df: pd.DataFrame) -> 'CardinalitySketchStore':
+        """
+        Store holding only the keys of df, each sketch being this store's
+        sketch for the key (if any) plus df's rows. Scoring a chunk against it
+        sees history + chunk while this store stays unchanged, so memory does
+        not grow with the number of chunks scored.
+        """
+        local = CardinalitySketchStore(self.relative_error, self.dimensions, self.idle_seconds)
+        local.add_frame(df)
+        for feature, (key_field, _) in self.dimensions.items():
+            key_values = self._field_values(df, key_field)
+            if key_values is None:
+                continue
+            base = self.sketches.get(feature, {})
+            sketches = local.sketches[feature]
+            for key in key_values.dropna().unique():
+                if key not in base:
+                    continue
+                if key in sketches:
+                    sketches[key].merge(base[key])
+                else:
+                    sketches[key] = base[key].copy()
+        return local
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """
+        Drop sketches with no transaction within idle_seconds of the latest event
+        time seen (or `now`); sketches without a known last-seen time are kept
+        """
+        now = self.max_event_time if now is None else now
+        if np.isnan(now):
+            return 0
+        cutoff = now - self.idle_seconds
+        evicted = 0
+        with self._lock:
+            for feature, sketches in self.sketches.items():
+                idle = [key for key, sketch in sketches.items() if sketch.last_seen < cutoff]
+                for key in idle:
+                    del sketches[key]
+                evicted += len(idle)
+        return evicted
+
+    def memory_bytes(self) -> int:
+        # Register bytes plus about 150 bytes of object, dict entry and key string per sketch
+        return sum(sketch.nbytes() + 150 for sketches in self.sketches.values() for sketch in sketches.values())
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault('idle_seconds', SKETCH_IDLE_SECONDS)
+        state.setdefault('max_event_time', np.nan)
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def snapshot(self, path: str):
+        """
+        Atomically write the store to disk. Only the key -> sketch maps are copied
+        under the lock; pickling and the write happen outside it.
+        """
+        with self._lock:
+            state = self.__getstate__()
+            state['sketches'] = {feature: dict(sketches) for feature, sketches in self.sketches.items()}
+        copy = CardinalitySketchStore.__new__(CardinalitySketchStore)
+        copy.__setstate__(state)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        joblib.dump(copy, tmp_path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'CardinalitySketchStore':
+        return joblib.load(path)
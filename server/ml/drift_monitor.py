@@ -0,0 +1,234 @@
+"""
+Streaming feature-drift monitoring against the training distribution.
+
+At training time every model feature gets a reference histogram: bin edges at
+the training quantiles (or between the distinct values of low-cardinality
+features) and the share of training rows per bin. The API bins each scored
+feature vector with those same edges into a ring of row-count buckets, so the
+live histogram of the last window_rows rows is kept in constant memory
+(n_buckets x n_features x n_bins counters) and updated in O(features) per row.
+PSI and a binned Kolmogorov-Smirnov statistic per feature then say whether the
+data the model sees still looks like the data it was trained on.
+"""
+import os
+import time
+import threading
+from typing import Any, Dict, List
+import joblib
+import numpy as np
+
+DRIFT_BINS = int(os.getenv("DRIFT_BINS", "20"))
+DRIFT_WINDOW_ROWS = int(os.getenv("DRIFT_WINDOW_ROWS", "10000"))
+DRIFT_BUCKETS = int(os.getenv("DRIFT_BUCKETS", "10"))
+# Rows needed in the window before drift is reported
+DRIFT_MIN_ROWS = int(os.getenv("DRIFT_MIN_ROWS", "500"))
+# Features with significant PSI needed before retraining is recommended
+DRIFT_RETRAIN_FEATURES = int(os.getenv("DRIFT_RETRAIN_FEATURES", "1"))
+
+# Conventional PSI bands: < 0.1 stable, 0.1-0.25 moderate shift, >= 0.25 significant shift
+PSI_MODERATE = 0.1
+PSI_SIGNIFICANT = 0.25
+# Two-sample KS critical value coefficient at alpha = 0.05
+KS_ALPHA_COEFFICIENT = 1.358
+# Floor for empty bins so PSI stays finite
+PSI_EPSILON = 1e-4
+
+
+class FeatureReference:
+    """Per-feature bin edges and training proportions"""
+
+    def __init__(self, feature_names: List[str], edges: List[np.ndarray], proportions: np.ndarray, rows: int):
+        self.feature_names = list(feature_names)
+        self.edges = [np.asarray(feature_edges, dtype=np.float64) for feature_edges in edges]
+        # (n_features, n_bins) padded to the widest feature; padding bins stay at 0
+        self.proportions = np.asarray(proportions, dtype=np.float64)
+        self.rows = int(rows)
+
+    @property
+    def n_bins(self) -> int:
+        return self.proportions.shape[1]
+
+    @classmethod
+    def from_matrix(cls, X: np.ndarray, feature_names: List[str], n_bins: int = DRIFT_BINS) -> 'FeatureReference':
+        """Quantile bins per column of the transformed training matrix, one column at a time"""
+        edges = []
+        for position in range(X.shape[1]):
+            column = np.asarray(X[:, position], dtype=np.float64)
+            distinct = np.unique(column)
+            if len(distinct) <= n_bins:
+                # Discrete feature: one bin per value, split halfway between values
+                edges.append((distinct[:-1] + distinct[1:]) / 2)
+            else:
+                edges.append(np.unique(np.quantile(column, np.linspace(0, 1, n_bins + 1)[1:-1])))
+        reference = cls(feature_names, edges, np.zeros((X.shape[1], max(len(e) for e in edges) + 1)), len(X))
+        reference.proportions = reference.bin_counts(X) / max(len(X), 1)
+        return reference
+
+    def bin_counts(self, X: np.ndarray) -> np.ndarray:
+        """(n_features, n_bins) histogram of the rows of X"""
+        counts = np.zeros((len(self.edges), self.n_bins), dtype=np.int64)
+        for position, feature_edges in enumerate(self.edges):
+            bins = np.searchsorted(feature_edges, X[:, position], side='right')
+            counts[position] = np.bincount(bins, minlength=self.n_bins)
+        return counts
+
+    def updated(self, X: np.ndarray) -> 'FeatureReference':
+        """
+        Reference with X's rows blended in by row count (edges are kept, so X
+        must come from the same fitted preprocessor as the reference)
+        """
+        total = self.rows + len(X)
+        proportions = (self.proportions * self.rows + self.bin_counts(X)) / max(total, 1)
+        return FeatureReference(self.feature_names, self.edges, proportions, total)
+
+    def matches(self, other: 'FeatureReference') -> bool:
+        return (self.feature_names == other.feature_names
+                and all(np.array_equal(a, b) for a, b in zip(self.edges, other.edges)))
+
+
+def population_stability_index(expected: np.ndarray, actual: np.ndarray) -> np.ndarray:
+    """PSI per row of two (n_features, n_bins) proportion matrices"""
+    expected = np.maximum(expected, PSI_EPSILON)
+    actual = np.maximum(actual, PSI_EPSILON)
+    return ((actual - expected) * np.log(actual / expected)).sum(axis=1)
+
+
+def binned_ks(expected: np.ndarray, actual: np.ndarray) -> np.ndarray:
+    """
+    Largest CDF gap at the bin edges per feature; a lower bound on the exact
+    two-sample KS statistic
+    """
+    return np.abs(np.cumsum(actual, axis=1) - np.cumsum(expected, axis=1)).max(axis=1)
+
+
+class DriftMonitor:
+    """Sliding-window live histograms compared to a FeatureReference"""
+
+    def __init__(self, reference: FeatureReference, window_rows: int = DRIFT_WINDOW_ROWS,
+                 n_buckets: int = DRIFT_BUCKETS):
+        self.reference = reference
+        self.n_buckets = max(1, n_buckets)
+        self.bucket_rows = max(1, window_rows // self.n_buckets)
+        shape = (len(reference.feature_names), reference.n_bins)
+        self.buckets = np.zeros((self.n_buckets,) + shape, dtype=np.int64)
+        self.bucket_fill = np.zeros(self.n_buckets, dtype=np.int64)
+        self.window_counts = np.zeros(shape, dtype=np.int64)
+        self.current = 0
+        self.rows_seen = 0
+        self.last_updated = None
+        self._lock = threading.Lock()
+
+    @property
+    def window_rows(self) -> int:
+        return int(self.bucket_fill.sum())
+
+    def _advance(self):
+        # Drop the oldest bucket from the window and reuse it
+        self.current = (self.current + 1) % self.n_buckets
+        self.window_counts -= self.buckets[self.current]
+        self.buckets[self.current] = 0
+        self.bucket_fill[self.current] = 0
+
+    def update(self, X: np.ndarray):
+        """Add scored feature vectors (transformed like the training matrix) to the window"""
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        with self._lock:
+            start = 0
+            while start < len(X):
+                if self.bucket_fill[self.current] >= self.bucket_rows:
+                    self._advance()
+                stop = min(len(X), start + self.bucket_rows - int(self.bucket_fill[self.current]))
+                counts = self.reference.bin_counts(X[start:stop])
+                self.buckets[self.current] += counts
+                self.window_counts += counts
+                self.bucket_fill[self.current] += stop - start
+                start = stop
+            self.rows_seen += len(X)
+            self.last_updated = time.time()
+
+    def report(self, min_rows: int = DRIFT_MIN_ROWS) -> Dict[str, Any]:
+        """PSI and KS per feature for the current window, most drifted first"""
+        with self._lock:
+            counts = self.window_counts.copy()
+            rows = self.window_rows
+        summary = {
+            'window_rows': rows,
+            'window_capacity': self.bucket_rows * self.n_buckets,
+            'rows_seen': self.rows_seen,
+            'reference_rows': self.reference.rows,
+            'last_updated': self.last_updated,
+            'retrain_recommended': False,
+            'drifted_features': [],
+            'features': []
+        }
+        if rows < min_rows:
+            summary['status'] = f"collecting ({rows}/{min_rows} rows)"
+            return summary
+
+        expected = self.reference.proportions
+        actual = counts / rows
+        psi = population_stability_index(expected, actual)
+        ks = binned_ks(expected, actual)
+        ks_critical = KS_ALPHA_COEFFICIENT * np.sqrt((rows + self.reference.rows) / (rows * self.reference.rows))
+
+        features = []
+        for position in np.argsort(-psi):
+            status = ('significant' if psi[position] >= PSI_SIGNIFICANT
+                      else 'moderate' if psi[position] >= PSI_MODERATE else 'stable')
+            features.append({
+                'feature': self.reference.feature_names[position],
+                'psi': round(float(psi[position]), 4),
+                'ks': round(float(ks[position]), 4),
+                'ks_drift': bool(ks[position] > ks_critical),
+                'status': status
+            })
+        drifted = [feature['feature'] for feature in features if feature['status'] == 'significant']
+        summary.update({
+            'status': 'drift' if drifted else 'stable',
+            'ks_critical': round(float(ks_critical), 4),
+            'max_psi': features[0]['psi'] if features else 0.0,
+            'drifted_features': drifted,
+            'retrain_recommended': len(drifted) >= DRIFT_RETRAIN_FEATURES,
+            'features': features
+        })
+        return summary
+
+    def snapshot(self, path: str):
+        """
+        Atomically write the window counters to disk; they are copied under the
+        lock and written outside it, so scoring is not held up by the write
+        """
+        with self._lock:
+            payload = {
+                'reference': self.reference,
+                'bucket_rows': self.bucket_rows,
+                'buckets': self.buckets.copy(),
+                'bucket_fill': self.bucket_fill.copy(),
+                'current': self.current,
+                'rows_seen': self.rows_seen,
+                'last_updated': self.last_updated
+            }
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        joblib.dump(payload, tmp_path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, reference: FeatureReference) -> 'DriftMonitor':
+        """
+        Restore a monitor written by snapshot(); starts empty when the snapshot
+        was taken against a different reference (e.g. after retraining) or window
+        """
+        payload = joblib.load(path)
+        monitor = cls(reference)
+        if (reference.matches(payload['reference']) and payload['bucket_rows'] == monitor.bucket_rows
+                and payload['buckets'].shape == monitor.buckets.shape):
+            monitor.buckets = payload['buckets']
+            monitor.bucket_fill = payload['bucket_fill']
+            monitor.window_counts = payload['buckets'].sum(axis=0)
+            monitor.current = payload['current']
+            monitor.rows_seen = payload['rows_seen']
+            monitor.last_updated = payload['last_updated']
+        return monitor
@@ -3,6 +3,7 @@ import numpy as np
 from typing import List, Dict, Any
 from sklearn.preprocessing import StandardScaler, LabelEncoder
 import warnings
+from transaction_graph import TransactionGraph, GRAPH_FEATURE_COLUMNS, graph_columns_available
 warnings.filterwarnings('ignore')
 
 # Define feature categories
@@ -20,14 +21,91 @@ BOOLEAN_FEATURES = [
     'is_weekend', 'is_business_hours', 'is_new_device', 'is_new_location'
 ]
 
-def calculate_derived_features_chunked(df: pd.DataFrame) -> pd.DataFrame:
+# Sliding windows (label -> seconds) for per-sender velocity features
+VELOCITY_WINDOWS = {
+    '10m': 10 * 60,
+    '1h': 60 * 60,
+    '24h': 24 * 60 * 60
+}
+
+# Gap assigned to a sender's first transaction (no previous activity seen)
+VELOCITY_MAX_GAP_SECONDS = 7 * 24 * 60 * 60
+
+VELOCITY_FEATURE_COLUMNS = [
+    f'sender_txn_{stat}_{label}' for label in VELOCITY_WINDOWS for stat in ['count', 'amount']
+] + ['time_since_last_seconds']
+
+
+def compute_sender_velocity_features(df: pd.DataFrame, key_column: str = 'sender_account',
+                                     windows: Dict[str, int] = None) -> pd.DataFrame:
+    """
+    Count and sum each sender's transactions in trailing time windows.
+
+    Rows are sorted once by (sender, timestamp) and every window start is found
+    with a single np.searchsorted over a monotonic composite key, so the whole
+    computation is O(n log n) with no Python-level loop over rows or senders.
+    Windows are inclusive of the current transaction.
+    """
+    windows = windows or VELOCITY_WINDOWS
+    n = len(df)
+    if n == 0:
+        return pd.DataFrame(index=df.index)
+
+    codes, _ = pd.factorize(df[key_column].fillna('unknown').astype(str))
+    timestamps = pd.to_datetime(df['timestamp'])
+    seconds = timestamps.to_numpy(dtype='datetime64[ns]').astype('datetime64[s]').astype(np.int64)
+    seconds = seconds - seconds.min()
+
+    order = np.lexsort((seconds, codes))
+    sorted_codes = codes[order].astype(np.int64)
+    sorted_seconds = seconds[order]
+    sorted_amounts = df['amount'].to_numpy(dtype=float)[order]
+
+    # sender * span + time is non-decreasing, so one searchsorted finds window starts
+    # without ever crossing into the previous sender's rows
+    span = int(sorted_seconds.max()) + max(windows.values()) + 1
+    composite = sorted_codes * span + sorted_seconds
+    amount_cumsum = np.concatenate(([0.0], np.cumsum(sorted_amounts)))
+    positions = np.arange(n)
+
+    sorted_features = {}
+    for label, window_seconds in windows.items():
+        window_start = np.searchsorted(composite, composite - window_seconds, side='left')
+        sorted_features[f'sender_txn_count_{label}'] = positions - window_start + 1
+        sorted_features[f'sender_txn_amount_{label}'] = amount_cumsum[positions + 1] - amount_cumsum[window_start]
+
+    same_sender_as_previous = np.concatenate(([False], sorted_codes[1:] == sorted_codes[:-1]))
+    previous_gap = np.diff(sorted_seconds, prepend=sorted_seconds[0])
+    sorted_features['time_since_last_seconds'] = np.where(
+        same_sender_as_previous, np.minimum(previous_gap, VELOCITY_MAX_GAP_SECONDS), VELOCITY_MAX_GAP_SECONDS
+    ).astype(float)
+
+    # Scatter back to the caller's row order
+    features = {}
+    for name, sorted_values in sorted_features.items():
+        values = np.empty_like(sorted_values)
+        values[order] = sorted_values
+        features[name] = values
+
+    return pd.DataFrame(features, index=df.index)
+
+
+def calculate_derived_features_chunked(df: pd.DataFrame, cardinality_store=None,
+                                       inplace: bool = False, transaction_graph=None) -> pd.DataFrame:
     """
     Calculate advanced behavioral features for Malawi mobile money fraud detection
+
+    When a CardinalitySketchStore is given, diversity features (distinct cities,
+    devices, transaction types per user and distinct users per city) are read
+    from its HyperLogLog sketches instead of exact groupby nunique.
+    Sender -> receiver graph features are recorded into transaction_graph when
+    given (so training can keep the graph), else into a graph of df alone.
+    With inplace=True the features are added to df itself instead of a copy.
     """
     print("🇲🇼 Calculating Malawi-specific derived features...")
     
     # Make a copy to avoid modifying original
-    df_features = df.copy()
+    df_features = df if inplace else df.copy()
     
     # Ensure timestamp is datetime
     if 'timestamp' in df_features.columns:
@@ -53,24 +131,33 @@ def calculate_derived_features_chunked(df: pd.DataFrame) -> pd.DataFrame:
     
     # 2. Enhanced customer behavioral features using sender_account (phone numbers)
     print("👤 Computing Malawi customer behavioral features...")
+    diversity = None
+    if cardinality_store is not None:
+        # Approximate distinct counts, constant time per key
+        diversity = cardinality_store.estimates_for_frame(df_features)
+        for col in diversity.columns:
+            df_features[col] = diversity[col].to_numpy()
+    
     if 'sender_account' in df_features.columns:
-        customer_stats = df_features.groupby('sender_account').agg({
+        customer_aggregations = {
             'amount': ['mean', 'std', 'count', 'sum'],
-            'transaction_hour_of_day': ['mean', 'std'],
-            'location_city': 'nunique',
-            'transaction_type': 'nunique'
-        }).reset_index()
-        
-        # Flatten column names
-        customer_stats.columns = ['sender_account'] + [f'customer_{col[0]}_{col[1]}' for col in customer_stats.columns[1:]]
-        
-        # Merge customer statistics
-        df_features = df_features.merge(customer_stats, on='sender_account', how='left')
-        
-        # Fill missing values and create behavioral indicators
-        for col in customer_stats.columns[1:]:
-            if col in df_features.columns:
-                df_features[col] = df_features[col].fillna(0)
+            'transaction_hour_of_day': ['mean', 'std']
+        }
+        if diversity is None:
+            customer_aggregations['location_city'] = 'nunique'
+            customer_aggregations['transaction_type'] = 'nunique'
+        # Per-sender statistics broadcast back onto the rows with transform, so the
+        # frame is never replaced (inplace callers keep one frame, no merge copy)
+        customer_stats = df_features.groupby('sender_account', sort=False)
+        for column, statistics in customer_aggregations.items():
+            for statistic in ([statistics] if isinstance(statistics, str) else statistics):
+                # Senders missing from the grouping (null accounts) get 0
+                df_features[f'customer_{column}_{statistic}'] = (
+                    customer_stats[column].transform(statistic).fillna(0)
+                )
+        if diversity is not None:
+            df_features['customer_location_city_nunique'] = df_features.get('user_location_diversity', 0)
+            df_features['customer_transaction_type_nunique'] = df_features.get('user_transaction_type_diversity', 0)
         
         # Behavioral risk indicators
         df_features['is_new_customer'] = (df_features['customer_amount_count'] <= 2).astype(int)
@@ -154,8 +241,36 @@ def calculate_derived_features_chunked(df: pd.DataFrame) -> pd.DataFrame:
     # 9. Transaction velocity and consistency features
     print("⚡ Computing velocity and consistency features...")
     
-    # Optimized velocity calculation (simplified for performance)
-    df_features['transaction_velocity_score'] = 1.0  # Default baseline velocity
+    # Per-sender counts/sums over trailing windows (sorted searchsorted, O(n log n));
+    # online scoring passes them in precomputed from the in-memory velocity store
+    velocity_key = next((col for col in ['sender_account', 'user_id'] if col in df_features.columns), None)
+    has_velocity = all(col in df_features.columns for col in VELOCITY_FEATURE_COLUMNS)
+    if not has_velocity and velocity_key and 'timestamp' in df_features.columns:
+        velocity_features = compute_sender_velocity_features(df_features, velocity_key)
+        for col in velocity_features.columns:
+            df_features[col] = velocity_features[col].to_numpy()
+        has_velocity = True
+    
+    if has_velocity:
+        df_features['time_since_last_hours'] = df_features['time_since_last_seconds'] / 3600
+        df_features['is_rapid_transaction'] = (df_features['time_since_last_seconds'] < 300).astype(int)
+        df_features['is_very_rapid_transaction'] = (df_features['time_since_last_seconds'] < 60).astype(int)
+        
+        # Last-hour activity relative to the sender's average hourly rate over 24h
+        df_features['transaction_velocity_score'] = (
+            df_features['sender_txn_count_1h'] / np.maximum(df_features['sender_txn_count_24h'] / 24, 1.0)
+        )
+    else:
+        df_features['transaction_velocity_score'] = 1.0  # Default baseline velocity
+    
+    # Fan-in/fan-out, windowed counterparties and two-hop reach from the sender -> receiver
+    # graph, point in time per row; online scoring passes them in from the served graph
+    has_graph = all(col in df_features.columns for col in GRAPH_FEATURE_COLUMNS)
+    if not has_graph and graph_columns_available(df_features) and 'timestamp' in df_features.columns:
+        graph = transaction_graph if transaction_graph is not None else TransactionGraph()
+        graph_features = graph.add_frame(df_features)
+        for col in graph_features.columns:
+            df_features[col] = graph_features[col].to_numpy()
     
     # Device and location consistency
     df_features['device_consistency_score'] = np.where(
@@ -238,149 +353,13 @@ def calculate_derived_features_chunked(df: pd.DataFrame) -> pd.DataFrame:
     return df_features
 
 
-def apply_preprocessors_chunked(df: pd.DataFrame, scaler=None, encoders=None, fit=True) -> tuple:
-    """
-    Apply preprocessing to features for ML training
-    """
-    print("Applying preprocessing...")
-    
-    # Select features that exist in the dataframe
-    available_numerical = [col for col in NUMERICAL_FEATURES_RAW if col in df.columns]
-    available_categorical = [col for col in CATEGORICAL_FEATURES if col in df.columns]
-    available_boolean = [col for col in BOOLEAN_FEATURES if col in df.columns]
-    
-    # Add derived features
-    derived_features = ['amount_log', 'amount_sqrt', 'amount_zscore_global', 
-                       'hour_sin', 'hour_cos', 'day_sin', 'day_cos']
-    available_derived = [col for col in derived_features if col in df.columns]
-    
-    # Combine all features
-    feature_columns = available_numerical + available_categorical + available_boolean + available_derived
-    
-    # Select only available features
-    df_processed = df[feature_columns].copy()
-    
-    # Handle missing values
-    df_processed = df_processed.fillna(0)
-    
-    # Initialize preprocessors if fitting
-    if fit:
-        scaler = StandardScaler()
-        encoders = {}
-        
-        # Fit scaler on numerical features
-        numerical_cols = available_numerical + available_derived
-        if numerical_cols:
-            scaler.fit(df_processed[numerical_cols])
-        
-        # Fit encoders on categorical features
-        for col in available_categorical:
-            encoders[col] = LabelEncoder()
-            encoders[col].fit(df_processed[col].astype(str))
-    
-    # Apply transformations
-    df_final = df_processed.copy()
-    
-    # Scale numerical features
-    numerical_cols = available_numerical + available_derived
-    if numerical_cols and scaler:
-        df_final[numerical_cols] = scaler.transform(df_processed[numerical_cols])
-    
-    # Encode categorical features
-    for col in available_categorical:
-        if col in encoders:
-            df_final[col] = encoders[col].transform(df_processed[col].astype(str))
-    
-    return df_final, scaler, encoders
-
-
-def select_features_for_training(df: pd.DataFrame) -> pd.DataFrame:
-    """
-    Select final features for training
-    """
-    print("Selecting features for training...")
-    return df
-
-
-def get_all_engineered_features() -> List[str]:
-    """
-    Get list of all engineered features
-    """
-    return NUMERICAL_FEATURES_RAW + CATEGORICAL_FEATURES + BOOLEAN_FEATURES
-
-
-def neutralize_cultural_transactions(df: pd.DataFrame) -> pd.DataFrame:
+def neutralize_cultural_transactions(df: pd.DataFrame, feature_columns: List[str],
+                                     inplace: bool = False) -> pd.DataFrame:
     """
-    Remove cultural bias from transactions
+    Neutralize cultural/seasonal transactions to reduce false positives.
+    With inplace=True only the masked rows of the amount columns of df are rewritten.
     """
-    print("Neutralizing cultural transactions...")
-    return df
-    
-    # 7. Transaction type patterns
-    print("Computing transaction type features...")
-    
-    # Transaction type risk based on amounts
-    txn_type_stats = df_features.groupby('transaction_type').agg({
-        'amount': ['mean', 'std', 'count']
-    }).reset_index()
-    
-    txn_type_stats.columns = ['transaction_type'] + [f'txn_type_{col[0]}_{col[1]}' for col in txn_type_stats.columns[1:]]
-    df_features = df_features.merge(txn_type_stats, on='transaction_type', how='left')
-
-    # Ensure required merged txn_type_* columns exist
-    safe_txn_cols = ['txn_type_amount_mean', 'txn_type_amount_std', 'txn_type_amount_count']
-    for col in safe_txn_cols:
-        if col not in df_features.columns:
-            df_features[col] = 0
-    
-    # Amount deviation from transaction type norm
-    df_features['amount_deviation_from_txn_type'] = (
-        df_features['amount'] - df_features['txn_type_amount_mean']
-    )
-    
-    # 8. Cross-feature interactions
-    print("Computing cross-feature interactions...")
-    
-    # Time-amount interactions
-    df_features['night_high_amount'] = (
-        (df_features['transaction_hour_of_day'].isin([0, 1, 2, 3, 4, 5])) & 
-        (df_features['amount'] > df_features['amount'].quantile(0.8))
-    ).astype(int)
-    
-    df_features['weekend_high_amount'] = (
-        df_features['is_weekend'] & 
-        (df_features['amount'] > df_features['amount'].quantile(0.8))
-    ).astype(int)
-    
-    # New device + high amount
-    if 'is_new_device' in df_features.columns:
-        df_features['new_device_high_amount'] = (
-            df_features['is_new_device'] & 
-            (df_features['amount'] > df_features['amount'].quantile(0.7))
-        ).astype(int)
-    
-    # New location + high amount
-    if 'is_new_location' in df_features.columns:
-        df_features['new_location_high_amount'] = (
-            df_features['is_new_location'] & 
-            (df_features['amount'] > df_features['amount'].quantile(0.7))
-        ).astype(int)
-    
-    # 9. Account age features
-    if 'account_age_days' in df_features.columns:
-        df_features['is_new_account'] = (df_features['account_age_days'] < 30).astype(int)
-        df_features['is_very_new_account'] = (df_features['account_age_days'] < 7).astype(int)
-        df_features['account_age_months'] = df_features['account_age_days'] / 30.44
-    
-    print(f"Feature engineering complete. Dataset shape: {df_features.shape}")
-    
-    return df_features
-
-def neutralize_cultural_transactions(df: pd.DataFrame, feature_columns: List[str]) -> pd.DataFrame:
-    """
-    Neutralize cultural/seasonal transactions to reduce false positives
-    """
-    df_neutralized = df.copy()
+    df_neutralized = df if inplace else df.copy()
     
     # Check if cultural indicator exists
     if 'is_cultural' not in df_neutralized.columns:
@@ -405,34 +384,117 @@ def neutralize_cultural_transactions(df: pd.DataFrame, feature_columns: List[str
     
     return df_neutralized
 
+class Preprocessor:
+    """
+    Fitted fill/encode/scale pipeline shared by training, batch and online scoring.
+
+    Numerical features are coerced to numbers and missing values filled with the
+    training median; categorical features are label-encoded against the training
+    vocabulary, with unseen values mapped to the most frequent training category.
+    Everything is then standardized with a single StandardScaler. transform()
+    works column-wise on NumPy arrays and returns a float64 matrix in
+    feature_names order. The object is picklable and saved in the model artifact.
+    """
+
+    def __init__(self, feature_names: List[str]):
+        self.feature_names = list(feature_names)
+        self.categorical_features = []
+        self.fill_values = {}
+        self.encoders = {}
+        self.unknown_codes = {}
+        self.scaler = None
+
+    def fit(self, df: pd.DataFrame, chunk_size: int = 100000) -> 'Preprocessor':
+        """
+        Learn fill values, category vocabularies and scaling from df. The scaler
+        is fitted chunk by chunk so no full-size encoded matrix is built.
+        """
+        self.categorical_features = [
+            feature for feature in self.feature_names
+            if feature in df.columns and df[feature].dtype in ['object', 'category']
+        ]
+        self.fill_values = {}
+        self.encoders = {}
+        self.unknown_codes = {}
+
+        for feature in self.feature_names:
+            if feature in self.categorical_features:
+                values = df[feature].astype(str)
+                encoder = LabelEncoder()
+                encoder.fit(values)
+                self.encoders[feature] = encoder
+                most_frequent = values.value_counts().idxmax()
+                self.unknown_codes[feature] = int(np.searchsorted(encoder.classes_, most_frequent))
+                print(f"Encoded {feature}: {len(encoder.classes_)} unique values")
+            elif feature in df.columns:
+                median = pd.to_numeric(df[feature], errors='coerce').median()
+                self.fill_values[feature] = float(median) if pd.notna(median) else 0.0
+            else:
+                self.fill_values[feature] = 0.0
+
+        self.scaler = StandardScaler()
+        for start in range(0, len(df), chunk_size):
+            self.scaler.partial_fit(self._encode(df.iloc[start:start + chunk_size]))
+        return self
+
+    def _encode(self, df: pd.DataFrame) -> np.ndarray:
+        """Fill and encode into an unscaled float64 matrix"""
+        X = np.empty((len(df), len(self.feature_names)), dtype=np.float64)
+        for position, feature in enumerate(self.feature_names):
+            if feature in self.encoders:
+                classes = self.encoders[feature].classes_
+                if feature in df.columns:
+                    codes = pd.Categorical(df[feature].astype(str), categories=classes).codes.astype(np.int64)
+                    codes[codes < 0] = self.unknown_codes.get(feature, 0)
+                    X[:, position] = codes
+                else:
+                    X[:, position] = self.unknown_codes.get(feature, 0)
+            elif feature in df.columns:
+                column = df[feature]
+                if column.dtype == bool or column.dtype.kind in 'iuf':
+                    values = column.to_numpy(dtype=np.float64, na_value=np.nan)
+                else:
+                    values = pd.to_numeric(column, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+                X[:, position] = values
+                missing = np.isnan(X[:, position])
+                if missing.any():
+                    X[missing, position] = self.fill_values.get(feature, 0.0)
+            else:
+                X[:, position] = self.fill_values.get(feature, 0.0)
+        return X
+
+    def transform(self, df: pd.DataFrame) -> np.ndarray:
+        """Fill, encode and scale df into a (n_rows, n_features) matrix"""
+        X = self._encode(df)
+        X -= self.scaler.mean_
+        X /= self.scaler.scale_
+        return X
+
+    def fit_transform(self, df: pd.DataFrame) -> np.ndarray:
+        return self.fit(df).transform(df)
+
+    @classmethod
+    def from_legacy(cls, feature_names: List[str], scaler: StandardScaler,
+                    encoders: Dict[str, LabelEncoder]) -> 'Preprocessor':
+        """Wrap a scaler/encoders pair from an artifact saved before Preprocessor existed"""
+        preprocessor = cls(feature_names)
+        preprocessor.scaler = scaler
+        preprocessor.encoders = dict(encoders or {})
+        preprocessor.categorical_features = [f for f in preprocessor.feature_names if f in preprocessor.encoders]
+        preprocessor.unknown_codes = {feature: 0 for feature in preprocessor.encoders}
+        preprocessor.fill_values = {
+            feature: 0.0 for feature in preprocessor.feature_names if feature not in preprocessor.encoders
+        }
+        return preprocessor
+
+
 def apply_preprocessors_chunked(df: pd.DataFrame, scaler: StandardScaler, 
                               encoders: Dict[str, LabelEncoder], 
                               feature_columns: List[str]) -> np.ndarray:
     """
     Apply preprocessing (scaling and encoding) to feature columns
     """
-    df_processed = df[feature_columns].copy()
-    
-    # Apply label encoders to categorical features
-    for feature, encoder in encoders.items():
-        if feature in df_processed.columns:
-            # Handle unseen categories
-            df_processed[feature] = df_processed[feature].astype(str).fillna('unknown')
-            unique_values = set(encoder.classes_)
-            df_processed.loc[~df_processed[feature].isin(unique_values), feature] = 'unknown'
-            
-            try:
-                df_processed[feature] = encoder.transform(df_processed[feature])
-            except ValueError:
-                # If 'unknown' is not in training classes, use most frequent class
-                most_frequent = encoder.classes_[0]
-                df_processed.loc[~df_processed[feature].isin(encoder.classes_), feature] = most_frequent
-                df_processed[feature] = encoder.transform(df_processed[feature])
-    
-    # Apply scaling
-    scaled_features = scaler.transform(df_processed)
-    
-    return scaled_features
+    return Preprocessor.from_legacy(feature_columns, scaler, encoders).transform(df)
 
 def get_all_engineered_features() -> List[str]:
     """
@@ -455,6 +517,14 @@ def get_all_engineered_features() -> List[str]:
         'hour_sin', 'hour_cos', 'day_sin', 'day_cos', 'time_since_last_hours',
         'is_rapid_transaction', 'is_very_rapid_transaction', 'is_high_frequency_day',
         
+        # Velocity features
+        'sender_txn_count_10m', 'sender_txn_amount_10m', 'sender_txn_count_1h',
+        'sender_txn_amount_1h', 'sender_txn_count_24h', 'sender_txn_amount_24h',
+        'transaction_velocity_score',
+        
+        # Counterparty graph features
+        *GRAPH_FEATURE_COLUMNS,
+        
         # Location features
         'location_user_id_nunique', 'is_rare_location', 'is_high_amount_location',
         
@@ -506,6 +576,15 @@ def select_features_for_training(df: pd.DataFrame, exclude_target_leakage: bool
         'transaction_hour_of_day', 'transaction_day_of_week', 'hour_sin', 'hour_cos',
         'is_weekend', 'is_business_hours', 'time_since_last_hours', 'is_rapid_transaction',
         
+        # Velocity
+        'sender_txn_count_10m', 'sender_txn_count_1h', 'sender_txn_amount_1h',
+        'sender_txn_count_24h', 'sender_txn_amount_24h', 'transaction_velocity_score',
+        
+        # Counterparty graph (mule fan-in/fan-out)
+        'graph_sender_fan_out', 'graph_sender_fan_in', 'graph_receiver_fan_in', 'graph_receiver_fan_out',
+        'graph_sender_counterparties_24h', 'graph_receiver_counterparties_24h',
+        'graph_sender_two_hop_reach', 'graph_pair_transaction_count',
+        
         # Location/device context
         'is_new_location', 'is_new_device', 'is_rare_location', 'location_user_id_nunique',
         
@@ -7,30 +7,136 @@ import json
 from dotenv import load_dotenv
 from datetime import datetime
 import time
-from typing import Dict, List, Tuple, Any
+import shutil
+import tempfile
+from concurrent.futures import wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from joblib.externals.loky import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple, Any
 import warnings
 warnings.filterwarnings('ignore')
 
 # Multiple ML algorithms for comparison
 from sklearn.ensemble import IsolationForest
 from sklearn.svm import OneClassSVM
-from sklearn.neighbors import LocalOutlierFactor
 from sklearn.covariance import EllipticEnvelope
-from sklearn.preprocessing import StandardScaler, LabelEncoder
-from sklearn.metrics import silhouette_score
 from sklearn.model_selection import ParameterGrid
 
 # Import from separate feature engineering module
 from feature_engineering import (
     calculate_derived_features_chunked,
-    apply_preprocessors_chunked,
+    Preprocessor,
     neutralize_cultural_transactions,
     select_features_for_training,
-    get_all_engineered_features
+    get_all_engineered_features,
+    VELOCITY_WINDOWS
+)
+from cardinality_sketches import CardinalitySketchStore, DEFAULT_HLL_ERROR
+from transaction_graph import TransactionGraph, graph_columns_available
+from streaming_loader import stream_transactions, stream_sampled_transactions, fingerprint_transactions
+from training_cache import TrainingMatrixCache, cache_key, feature_code_version
+from training_checkpoints import TrainingCheckpoint
+from anomaly_models import ApproximateOneClassSVM, PrototypeLocalOutlierFactor
+from memory_tracking import track_peak_memory, reset_peak_rss, peak_rss_mb
+from score_ensemble import ScoreEnsemble
+from drift_monitor import FeatureReference
+from explanations import FeatureExplainer
+from rule_cascade import RuleCascade, rule_frame, TIER_NAMES, TIER_MODEL
+from risk_scoring import single_model_threshold
+from segment_models import SegmentedDetector, SEGMENT_COLUMNS, SEGMENT_MIN_ROWS, parse_segment_by, segment_keys, group_rows
+from evaluation_metrics import (
+    fast_anomaly_metrics,
+    exact_silhouette,
+    label_anomalies,
+    bootstrap_intervals,
+    EVALUATION_EXACT_SILHOUETTE,
+    EVALUATION_BOOTSTRAP_SAMPLES
 )
 
 load_dotenv()
 
+# Global CPU budget for hyperparameter search and optional per-trial timeout (seconds)
+TRAINING_CPU_BUDGET = int(os.getenv("TRAINING_CPU_BUDGET", "0")) or os.cpu_count() or 1
+TRAINING_TRIAL_TIMEOUT = float(os.getenv("TRAINING_TRIAL_TIMEOUT", "0")) or None
+
+# Search strategy: 'halving' screens candidates on subsamples, 'full' fits every candidate on all rows
+TRAINING_SEARCH_STRATEGY = os.getenv("TRAINING_SEARCH_STRATEGY", "halving")
+HALVING_FACTOR = 3
+HALVING_MIN_SAMPLES = int(os.getenv("HALVING_MIN_SAMPLES", "5000"))
+
+BEST_MODEL_PATH = 'trained_models/best_fraud_detection_model.joblib'
+LEGACY_MODEL_PATH = 'ml/trained_models/isolation_forest_model.joblib'
+
+# Percentiles of the best model's training scores saved with the artifact
+SCORE_QUANTILE_POINTS = np.linspace(0, 1, 101)
+
+# Incremental refresh: share of IsolationForest trees replaced (or added) per run,
+# and minimum new rows before other algorithms are refitted
+INCREMENTAL_TREE_FRACTION = float(os.getenv("INCREMENTAL_TREE_FRACTION", "0.1"))
+INCREMENTAL_MIN_ROWS = int(os.getenv("INCREMENTAL_MIN_ROWS", "5000"))
+# Uniform sample of every row trained on so far (transformed), saved with the artifact
+# so incremental refits see history as well as the new rows
+INCREMENTAL_RESERVOIR_ROWS = int(os.getenv("INCREMENTAL_RESERVOIR_ROWS", "20000"))
+
+# How training rows are picked: 'latest' (most recent sample_size rows) or 'sender', a
+# representative sample over the window keeping whole sender histories
+TRAINING_SAMPLING = os.getenv("TRAINING_SAMPLING", "latest")
+
+# Also save every successfully trained detector as a rank-normalized weighted ensemble
+TRAINING_ENSEMBLE = os.getenv("TRAINING_ENSEMBLE", "false").lower() in ("1", "true", "yes")
+
+# Also train one model per segment, e.g. 'transaction_type' or 'transaction_type,network_operator'
+TRAINING_SEGMENT_BY = os.getenv("TRAINING_SEGMENT_BY", "")
+
+
+def _anomaly_scores(model, X: np.ndarray) -> np.ndarray:
+    """Training-set anomaly scores of a fitted model (lower = more anomalous)"""
+    if hasattr(model, 'training_scores'):
+        # Novelty LOF must not count training rows as their own neighbours
+        return model.training_scores(X)
+    if hasattr(model, 'decision_function'):
+        return model.decision_function(X)
+    if hasattr(model, 'score_samples'):
+        return model.score_samples(X)
+    return model.predict(X)
+
+
+def _run_trial(X: np.ndarray, algorithm_name: str, model_class, params: Dict[str, Any],
+               seed: int, rows: np.ndarray = None) -> Tuple[Any, Dict[str, float], float]:
+    """
+    Fit and evaluate one configuration, on X[rows] when rows is given;
+    module-level so process pool workers can run it
+    """
+    start = time.time()
+    try:
+        if rows is not None:
+            X = X[rows]
+        model = model_class(**params)
+        model.fit(X)
+        anomaly_scores = _anomaly_scores(model, X)
+        
+        # Evaluate model
+        metrics = ComprehensiveFraudDetectionModel.evaluate_anomaly_detection(
+            X, anomaly_scores, f"{algorithm_name}_{str(params)[:30]}", random_state=seed
+        )
+        return model, metrics, time.time() - start
+    
+    except Exception as e:
+        print(f"Error training {algorithm_name}: {e}")
+        return None, {'error': str(e)}, time.time() - start
+
+
+def _run_shared_trial(X_path: str, algorithm_name: str, model_class, params: Dict[str, Any],
+                      seed: int, rows: np.ndarray = None) -> Tuple[Any, Dict[str, float], float, Optional[float]]:
+    """
+    Run one trial on the memory-mapped X at X_path (workers share it instead
+    of a copy); the worker's peak RSS during the trial is returned last
+    """
+    reset_peak_rss()
+    output = _run_trial(joblib.load(X_path, mmap_mode='r'), algorithm_name, model_class, params, seed, rows)
+    return output + (peak_rss_mb(),)
+
+
 class ComprehensiveFraudDetectionModel:
     """
     Multi-algorithm unsupervised fraud detection system with proper evaluation
@@ -38,11 +144,40 @@ class ComprehensiveFraudDetectionModel:
     
     def __init__(self):
         self.models = {}
+        self.preprocessor = None
         self.scaler = None
         self.encoders = {}
         self.feature_names = []
         self.evaluation_results = {}
         self.best_model_name = None
+        self.cardinality_store = None
+        self.transaction_graph = None
+        self.random_state = 42
+        self.cpu_budget = TRAINING_CPU_BUDGET
+        self.trial_timeout = TRAINING_TRIAL_TIMEOUT
+        self.search_strategy = TRAINING_SEARCH_STRATEGY
+        self.exact_silhouette = EVALUATION_EXACT_SILHOUETTE
+        self.bootstrap_samples = EVALUATION_BOOTSTRAP_SAMPLES
+        self.training_watermark = None
+        self.training_rows = 0
+        self.memory_profile = {}
+        # Highest peak RSS a trial worker process reported (trials run in this process are not included)
+        self.worker_peak_rss_mb = None
+        self.score_quantiles = None
+        self.use_cache = True
+        self.sampling = TRAINING_SAMPLING
+        self.checkpoint = None
+        self.use_checkpoints = True
+        self.ensemble_mode = TRAINING_ENSEMBLE
+        self.ensemble = None
+        self.segment_by = parse_segment_by(TRAINING_SEGMENT_BY)
+        self.segment_frame = None
+        self.segmented = None
+        self.drift_reference = None
+        self.refit_reservoir = None
+        self.feature_importance = None
+        self.rule_frame = None
+        self.rule_cascade = None
         
         
         self.algorithm_configs = {
@@ -65,14 +200,25 @@ class ComprehensiveFraudDetectionModel:
                 },
                 'description': 'One-Class SVM - Learns decision boundary around normal data'
             },
+            'scalable_one_class_svm': {
+                'model_class': ApproximateOneClassSVM,
+                'param_grid': {
+                    'kernel_approximation': ['nystroem', 'rbf_sampler'],
+                    'n_components': [150, 300],
+                    'nu': [0.01, 0.02],
+                    'gamma': ['scale'],
+                },
+                'description': 'Scalable One-Class SVM - Linear SGD One-Class SVM on approximate RBF kernel features'
+            },
             'local_outlier_factor': {
-                'model_class': LocalOutlierFactor,
+                'model_class': PrototypeLocalOutlierFactor,
                 'param_grid': {
                     'n_neighbors': [20, 30, 40],
                     'contamination': [0.01, 0.015, 0.02],
-                    'algorithm': ['auto'],
+                    'max_prototypes': [20000],
+                    'n_components': [10],
                 },
-                'description': 'Local Outlier Factor - Detects anomalies based on local density'
+                'description': 'Local Outlier Factor - Detects anomalies based on local density (novelty mode over an indexed prototype subsample)'
             },
             'elliptic_envelope': {
                 'model_class': EllipticEnvelope,
@@ -103,8 +249,18 @@ class ComprehensiveFraudDetectionModel:
                     time.sleep(retry_delay)
         return None
     
-    def load_data_from_db(self, sample_size: int = 100000) -> pd.DataFrame:
-        """Load data from database"""
+    def load_data_from_db(self, sample_size: int = 100000, start_time: datetime = None,
+                          end_time: datetime = None) -> pd.DataFrame:
+        """
+        Load data from database. A time range streams via COPY instead of sorting
+        the table; a sampling mode other than 'latest' draws a representative
+        sample of the window (whole table when no range is given).
+        """
+        if self.sampling != 'latest':
+            return self.load_data_sampled(sample_size, start_time, end_time)
+        if start_time is not None or end_time is not None:
+            return self.load_data_streaming(start_time, end_time, limit=sample_size)
+        
         print("Connecting to database and loading data...")
         conn = self.get_db_connection()
         if not conn:
@@ -139,12 +295,66 @@ class ComprehensiveFraudDetectionModel:
         finally:
             conn.close()
     
+    def load_data_streaming(self, start_time: datetime = None, end_time: datetime = None,
+                            limit: int = None, chunk_size: int = 100000) -> pd.DataFrame:
+        """Stream completed transactions in [start_time, end_time) via COPY into typed columns"""
+        print(f"Streaming transactions from database (from {start_time or 'beginning'} to {end_time or 'now'})...")
+        conn = self.get_db_connection()
+        if not conn:
+            raise Exception("Failed to connect to database")
+        
+        try:
+            df = stream_transactions(conn, start_time, end_time, limit=limit, chunk_size=chunk_size)
+            if df.empty:
+                raise Exception("No data found in database")
+            return df
+        finally:
+            conn.close()
+    
+    def load_data_sampled(self, sample_size: int, start_time: datetime = None, end_time: datetime = None,
+                          chunk_size: int = 100000) -> pd.DataFrame:
+        """Stream a sample of completed transactions drawn by sender"""
+        conn = self.get_db_connection()
+        if not conn:
+            raise Exception("Failed to connect to database")
+        
+        try:
+            df = stream_sampled_transactions(conn, sample_size, self.sampling, start_time, end_time,
+                                             seed=self.random_state, chunk_size=chunk_size)
+            if df.empty:
+                raise Exception("No data found in database")
+            print(f"Sample covers {df['timestamp'].dt.normalize().nunique()} days "
+                  f"({df['timestamp'].min()} to {df['timestamp'].max()})")
+            return df
+        finally:
+            conn.close()
+    
     def prepare_training_data(self, df: pd.DataFrame) -> Tuple[np.ndarray, List[str]]:
-        """Prepare data for training using feature engineering module"""
+        """
+        Prepare data for training using feature engineering module.
+        
+        Features are added to df in place, cultural neutralization rewrites only the
+        masked amount cells, the scaler is fitted chunk-wise and a single float64
+        matrix is encoded and standardized in place, so peak memory is the
+        engineered frame plus about one copy of X. Peak RSS per stage is recorded
+        in self.memory_profile. df is modified; pass a copy if it is still needed.
+        """
         print("Starting feature engineering pipeline...")
+        self.training_watermark = pd.Timestamp(df['timestamp'].max()).isoformat() if 'timestamp' in df else None
+        self.training_rows = len(df)
+        self.memory_profile = {}
         
         # Step 1: Calculate derived features using feature engineering module
-        df_engineered = calculate_derived_features_chunked(df)
+        # (diversity features come from HyperLogLog sketches shared with serving; the
+        # sender -> receiver graph is kept so serving starts from the training history)
+        with track_peak_memory('feature_engineering', self.memory_profile):
+            self.cardinality_store = CardinalitySketchStore.from_frame(df)
+            self.transaction_graph = TransactionGraph() if graph_columns_available(df) else None
+            df_engineered = calculate_derived_features_chunked(df, cardinality_store=self.cardinality_store,
+                                                               inplace=True, transaction_graph=self.transaction_graph)
+        if self.transaction_graph is not None:
+            print(f"🕸️ Transaction graph: {self.transaction_graph.n_nodes:,} accounts, "
+                  f"{self.transaction_graph.n_edges:,} edges")
         
         # Step 2: Select optimal features for training
         feature_names = select_features_for_training(df_engineered)
@@ -152,131 +362,142 @@ class ComprehensiveFraudDetectionModel:
         
         print(f"Selected {len(feature_names)} features for training")
         
-        # Step 3: Handle missing values and prepare data
-        df_processed = df_engineered[feature_names].copy()
-        
-        # Separate numerical and categorical features
-        numerical_features = []
-        categorical_features = []
-        
-        for feature in feature_names:
-            if feature in df_processed.columns:
-                if df_processed[feature].dtype in ['object', 'category']:
-                    categorical_features.append(feature)
-                else:
-                    numerical_features.append(feature)
-        
-        print(f"Found {len(numerical_features)} numerical and {len(categorical_features)} categorical features")
-        
-        # Fill missing values
-        for feature in numerical_features:
-            if feature in df_processed.columns:
-                df_processed[feature] = df_processed[feature].fillna(df_processed[feature].median())
+        # Step 3: Fit fill values, encoders and scaler on the engineered (not yet neutralized) data
+        with track_peak_memory('preprocessor_fit', self.memory_profile):
+            self.preprocessor = Preprocessor(feature_names).fit(df_engineered)
+        self.scaler = self.preprocessor.scaler
+        self.encoders = self.preprocessor.encoders
         
-        for feature in categorical_features:
-            if feature in df_processed.columns:
-                df_processed[feature] = df_processed[feature].astype(str).fillna('unknown')
+        print(f"Found {len(feature_names) - len(self.preprocessor.categorical_features)} numerical and "
+              f"{len(self.preprocessor.categorical_features)} categorical features")
         
-        # Step 4: Encode categorical features
-        self.encoders = {}
-        for feature in categorical_features:
-            if feature in df_processed.columns:
-                le = LabelEncoder()
-                df_processed[feature] = le.fit_transform(df_processed[feature])
-                self.encoders[feature] = le
-                print(f"Encoded {feature}: {len(le.classes_)} unique values")
-        
-        # Step 5: Ensure all features are numeric before scaling
-        for feature in feature_names:
-            if feature in df_processed.columns:
-                try:
-                    df_processed[feature] = pd.to_numeric(df_processed[feature], errors='coerce')
-                    df_processed[feature] = df_processed[feature].fillna(df_processed[feature].median())
-                except:
-                    print(f"Warning: Could not convert {feature} to numeric, dropping it")
-                    df_processed = df_processed.drop(columns=[feature])
-                    feature_names.remove(feature)
-        
-        # Update feature names after potential drops
-        feature_names = [f for f in feature_names if f in df_processed.columns]
-        self.feature_names = feature_names
+        # Segment attributes per row, for per-segment models
+        self.segment_frame = pd.DataFrame({
+            column: df_engineered[column].astype('category') for column in SEGMENT_COLUMNS if column in df_engineered
+        }).reset_index(drop=True)
+        # Raw fields for the tier-1 rule cascade, taken before amounts are neutralized
+        self.rule_frame = rule_frame(df_engineered)
         
-        # Step 6: Scale all features
-        self.scaler = StandardScaler()
-        X_scaled = self.scaler.fit_transform(df_processed)
-        
-        # Step 7: Apply neutralization to the same processed data
-        # Create a copy for neutralization
-        df_for_neutralization = df_engineered.copy()
-        df_neutralized = neutralize_cultural_transactions(df_for_neutralization, feature_names)
-        
-        # Apply the same preprocessing to neutralized data
-        df_neutralized_processed = df_neutralized[feature_names].copy()
-        
-        # Fill missing values in neutralized data
-        for feature in feature_names:
-            if feature in df_neutralized_processed.columns:
-                if feature in categorical_features and feature in self.encoders:
-                    # Apply same encoding
-                    df_neutralized_processed[feature] = df_neutralized_processed[feature].astype(str).fillna('unknown')
-                    # Handle unseen categories
-                    unknown_mask = ~df_neutralized_processed[feature].isin(self.encoders[feature].classes_)
-                    if unknown_mask.any():
-                        df_neutralized_processed.loc[unknown_mask, feature] = self.encoders[feature].classes_[0]
-                    df_neutralized_processed[feature] = self.encoders[feature].transform(df_neutralized_processed[feature])
-                else:
-                    # Numerical feature
-                    df_neutralized_processed[feature] = pd.to_numeric(df_neutralized_processed[feature], errors='coerce')
-                    df_neutralized_processed[feature] = df_neutralized_processed[feature].fillna(df_neutralized_processed[feature].median())
+        # Step 4: Neutralize cultural transactions in place and transform with the fitted preprocessor
+        with track_peak_memory('neutralize', self.memory_profile):
+            neutralize_cultural_transactions(df_engineered, feature_names, inplace=True)
+        with track_peak_memory('transform', self.memory_profile):
+            X_neutralized = self.preprocessor.transform(df_engineered)
+        del df_engineered
         
-        # Scale neutralized data
-        X_neutralized = self.scaler.transform(df_neutralized_processed)
+        # Step 5: Per-feature reference histograms for drift monitoring at serving time
+        with track_peak_memory('drift_reference', self.memory_profile):
+            self.drift_reference = FeatureReference.from_matrix(X_neutralized, feature_names)
+        self.refit_reservoir = self.update_reservoir(None, X_neutralized, 0, seed=self.random_state)
         
-        print(f"Data preparation complete. Final shape: {X_neutralized.shape}")
+        print(f"Data preparation complete. Final shape: {X_neutralized.shape} "
+              f"({X_neutralized.nbytes / 1024 ** 2:,.0f} MB)")
         print(f"Using {len(feature_names)} features: {feature_names[:5]}...")
         
         return X_neutralized, feature_names
     
-    def evaluate_anomaly_detection(self, X: np.ndarray, anomaly_scores: np.ndarray, 
-                                 model_name: str) -> Dict[str, float]:
-        """Evaluate anomaly detection performance using unsupervised metrics"""
-        
-        # Convert anomaly scores to binary predictions (bottom 2% as anomalies)
-        contamination_threshold = np.percentile(anomaly_scores, 2)
-        anomaly_predictions = (anomaly_scores <= contamination_threshold).astype(int)
-        
-        metrics = {}
-        
-        # 1. Silhouette score - measures cluster quality
+    def training_cache_key(self, sample_size: int, start_time: datetime = None, end_time: datetime = None) -> str:
+        """Key the prepared matrix by query window, the rows it covers and the feature code"""
+        conn = self.get_db_connection()
+        if not conn:
+            raise Exception("Failed to connect to database")
         try:
-            if len(np.unique(anomaly_predictions)) > 1 and len(X) > 100:
-                sample_size = min(5000, len(X))  # Limit sample for performance
-                idx = np.random.choice(len(X), sample_size, replace=False)
-                metrics['silhouette_score'] = silhouette_score(X[idx], anomaly_predictions[idx])
-            else:
-                metrics['silhouette_score'] = -1
-        except:
-            metrics['silhouette_score'] = -1
-        
-        # 2. Score distribution analysis
-        metrics['anomaly_score_mean'] = np.mean(anomaly_scores)
-        metrics['anomaly_score_std'] = np.std(anomaly_scores)
-        metrics['anomaly_score_range'] = np.max(anomaly_scores) - np.min(anomaly_scores)
+            row_count, latest_timestamp = fingerprint_transactions(conn, start_time, end_time)
+        finally:
+            conn.close()
         
-        # 3. Separation quality
-        normal_scores = anomaly_scores[anomaly_predictions == 0]
-        anomalous_scores = anomaly_scores[anomaly_predictions == 1]
+        return cache_key(
+            start_time=start_time, end_time=end_time, sample_size=sample_size,
+            sampling=self.sampling, seed=self.random_state,
+            row_count=row_count, latest_timestamp=latest_timestamp, hll_error=DEFAULT_HLL_ERROR,
+            feature_code=feature_code_version([
+                ComprehensiveFraudDetectionModel.load_data_from_db,
+                ComprehensiveFraudDetectionModel.prepare_training_data,
+                ComprehensiveFraudDetectionModel.update_reservoir
+            ])
+        )
+    
+    def load_prepared_data(self, sample_size: int, start_time: datetime = None,
+                           end_time: datetime = None) -> Tuple[np.ndarray, List[str]]:
+        """
+        Load and prepare training data, reusing a cached matrix when the data
+        and feature code are unchanged. X comes back memory-mapped (read-only).
+        """
+        if self.checkpoint and self.checkpoint.has('prepared'):
+            X = self.checkpoint.load_matrix('prepared')
+            self._restore_prepared_state(self.checkpoint.load('prepared_state'))
+            print(f"♻️  Loaded prepared training matrix {X.shape} from checkpoint")
+            return X, self.feature_names
         
-        if len(normal_scores) > 0 and len(anomalous_scores) > 0:
-            metrics['separation_quality'] = abs(np.mean(normal_scores) - np.mean(anomalous_scores))
+        if not self.use_cache:
+            X, feature_names = self.prepare_training_data(self.load_training_frame(sample_size, start_time, end_time))
         else:
-            metrics['separation_quality'] = 0
+            cache = TrainingMatrixCache()
+            key = self.training_cache_key(sample_size, start_time, end_time)
+            cached = cache.load(key)
+            if cached is not None:
+                X, state = cached
+                self._restore_prepared_state(state)
+                feature_names = self.feature_names
+                print(f"♻️  Loaded prepared training matrix {X.shape} from cache ({key[:12]})")
+            else:
+                X, feature_names = self.prepare_training_data(
+                    self.load_training_frame(sample_size, start_time, end_time)
+                )
+                X = cache.store(key, X, self._prepared_state())
+                print(f"💾 Cached prepared training matrix under {cache.cache_dir}/{key[:12]}...")
         
-        # 4. Detection rate
-        metrics['anomaly_percentage'] = np.mean(anomaly_predictions) * 100
+        if self.checkpoint:
+            self.checkpoint.save_matrix('prepared', X)
+            self.checkpoint.save('prepared_state', self._prepared_state())
+        return X, feature_names
+    
+    def load_training_frame(self, sample_size: int, start_time: datetime = None,
+                            end_time: datetime = None) -> pd.DataFrame:
+        """Load raw training transactions, from the run's checkpoint when available"""
+        if self.checkpoint and self.checkpoint.has('data'):
+            print("♻️  Loaded training transactions from checkpoint")
+            return self.checkpoint.load('data')
+        df = self.load_data_from_db(sample_size, start_time, end_time)
+        if self.checkpoint:
+            self.checkpoint.save('data', df)
+        return df
+    
+    def _prepared_state(self) -> Dict[str, Any]:
+        """Fitted state produced by prepare_training_data alongside X"""
+        return {
+            'feature_names': self.feature_names,
+            'preprocessor': self.preprocessor,
+            'cardinality_store': self.cardinality_store,
+            'transaction_graph': self.transaction_graph,
+            'training_watermark': self.training_watermark,
+            'training_rows': self.training_rows,
+            'segment_frame': self.segment_frame,
+            'rule_frame': self.rule_frame,
+            'drift_reference': self.drift_reference,
+            'refit_reservoir': self.refit_reservoir
+        }
+    
+    def _restore_prepared_state(self, state: Dict[str, Any]):
+        for attribute, value in state.items():
+            setattr(self, attribute, value)
+        self.scaler = self.preprocessor.scaler
+        self.encoders = self.preprocessor.encoders
+    
+    @staticmethod
+    def evaluate_anomaly_detection(X: np.ndarray, anomaly_scores: np.ndarray, 
+                                 model_name: str, random_state: int = None,
+                                 exact: bool = False) -> Dict[str, float]:
+        """
+        Evaluate anomaly detection performance using unsupervised metrics.
         
-        # 5. Score consistency
-        metrics['normal_score_variance'] = np.var(normal_scores) if len(normal_scores) > 0 else float('inf')
+        Runs in linear time (simplified silhouette over all rows); pass exact=True
+        to also record sklearn's sampled silhouette as silhouette_score_exact.
+        """
+        metrics = fast_anomaly_metrics(X, anomaly_scores)
+        if exact:
+            labels = label_anomalies(np.asarray(anomaly_scores, dtype=np.float64))
+            metrics['silhouette_score_exact'] = exact_silhouette(X, labels, random_state=random_state)
         
         print(f"{model_name} - Silhouette: {metrics['silhouette_score']:.4f}, "
               f"Separation: {metrics['separation_quality']:.4f}, "
@@ -284,112 +505,332 @@ class ComprehensiveFraudDetectionModel:
         
         return metrics
     
+    def report_metrics(self, model, X: np.ndarray, algorithm_name: str,
+                       metrics: Dict[str, float]) -> Dict[str, float]:
+        """Add bootstrap confidence intervals and, if enabled, the exact silhouette for reports"""
+        anomaly_scores = _anomaly_scores(model, X)
+        metrics = dict(metrics)
+        if self.bootstrap_samples > 0:
+            metrics.update(bootstrap_intervals(X, anomaly_scores, self.bootstrap_samples,
+                                               random_state=self.random_state))
+        if self.exact_silhouette:
+            labels = label_anomalies(np.asarray(anomaly_scores, dtype=np.float64))
+            metrics['silhouette_score_exact'] = exact_silhouette(X, labels, random_state=self.random_state)
+        return metrics
+    
     def train_single_model(self, X: np.ndarray, algorithm_name: str, 
                           params: Dict[str, Any]) -> Tuple[Any, Dict[str, float]]:
         """Train and evaluate a single model configuration"""
-        
         config = self.algorithm_configs[algorithm_name]
-        model_class = config['model_class']
+        model, metrics, _ = _run_trial(X, algorithm_name, config['model_class'], params, self.random_state)
+        return model, metrics
+    
+    @staticmethod
+    def composite_score(metrics: Dict[str, float]) -> float:
+        """Enhanced composite score for higher confidence"""
+        return (
+            metrics['silhouette_score'] * 0.35 +
+            metrics['separation_quality'] * 0.25 +
+            (1 / (metrics['normal_score_variance'] + 1)) * 0.2 +
+            (1 - metrics.get('anomaly_percentage', 0.05) / 100) * 0.1 +  # Prefer reasonable anomaly rates
+            metrics.get('confidence_boost', 0) * 0.1  # Boost for confidence-enhancing features
+        )
+    
+    def sample_trials(self, algorithm_name: str, max_trials: int = 6) -> List[Dict[str, Any]]:
+        """Deterministically sample parameter combinations for an algorithm"""
+        config = self.algorithm_configs[algorithm_name]
+        param_combinations = list(ParameterGrid(config['param_grid']))
+        
+        # Limit combinations for faster training
+        if len(param_combinations) > max_trials:
+            rng = np.random.default_rng([self.random_state, list(self.algorithm_configs).index(algorithm_name)])
+            chosen = sorted(rng.choice(len(param_combinations), max_trials, replace=False))
+            param_combinations = [param_combinations[i] for i in chosen]
+        
+        # Pin estimator randomness so results don't depend on scheduling
+        if 'random_state' in config['model_class']().get_params():
+            param_combinations = [{'random_state': self.random_state, **params} for params in param_combinations]
+        
+        return [
+            {'algorithm': algorithm_name, 'params': params,
+             'seed': int(np.random.SeedSequence([self.random_state, trial_index]).generate_state(1)[0])}
+            for trial_index, params in enumerate(param_combinations)
+        ]
+    
+    def run_trials(self, X: np.ndarray, trials: List[Dict[str, Any]]) -> List[Tuple[Any, Dict[str, float], float]]:
+        """
+        Run trials on a process pool within the CPU budget.
+        
+        X is dumped once to a memory-mapped file so workers share it instead of
+        receiving a copy each. Results come back in trial order and every trial
+        carries its own seed, so the outcome doesn't depend on the worker count.
+        A trial exceeding trial_timeout is recorded as failed; trials still
+        running alongside it are rescheduled on a fresh pool, finished ones are
+        kept. A worker that dies (e.g. OOM-killed) breaks the pool and fails
+        every trial in flight, so those are rerun one at a time and only the
+        one that kills its worker again is recorded as failed. Trials run in
+        this process only when there is one worker and no timeout.
+        With a checkpoint, successful trials are saved as they finish and
+        trials already in the checkpoint are not refitted.
+        """
+        results = [None] * len(trials)
+        keys = [self.checkpoint.trial_key(trial, X) for trial in trials] if self.checkpoint else None
+        if self.checkpoint:
+            for i, key in enumerate(keys):
+                results[i] = self.checkpoint.load_trial(key)
+            restored = sum(output is not None for output in results)
+            if restored:
+                print(f"♻️  Restored {restored} of {len(trials)} trials from checkpoint")
+        todo = [i for i, output in enumerate(results) if output is None]
+        
+        def record(i, output):
+            results[i] = output
+            if self.checkpoint and output[0] is not None:
+                self.checkpoint.save_trial(keys[i], output)
         
+        n_jobs = max(1, min(self.cpu_budget, len(todo)))
+        if n_jobs == 1 and not self.trial_timeout:
+            for i in todo:
+                trial = trials[i]
+                config = self.algorithm_configs[trial['algorithm']]
+                record(i, _run_trial(X, trial['algorithm'], config['model_class'], trial['params'], trial['seed'],
+                                     trial.get('rows')))
+            return results
+        
+        print(f"Running {len(todo)} trials on {n_jobs} workers "
+              f"(CPU budget {self.cpu_budget}, timeout {self.trial_timeout or 'none'})")
+        memmap_dir = tempfile.mkdtemp(prefix='fraud_training_')
         try:
-            model = model_class(**params)
-            
-            if algorithm_name == 'local_outlier_factor':
-                # LOF uses fit_predict
-                anomaly_predictions = model.fit_predict(X)
-                anomaly_scores = model.negative_outlier_factor_
-            else:
-                # Other models use fit + score methods
-                model.fit(X)
-                if hasattr(model, 'decision_function'):
-                    anomaly_scores = model.decision_function(X)
-                elif hasattr(model, 'score_samples'):
-                    anomaly_scores = model.score_samples(X)
-                else:
-                    anomaly_scores = model.predict(X)
-            
-            # Evaluate model
-            evaluation_metrics = self.evaluate_anomaly_detection(
-                X, anomaly_scores, f"{algorithm_name}_{str(params)[:30]}"
-            )
+            memmap_path = os.path.join(memmap_dir, 'X.mmap')
+            joblib.dump(np.ascontiguousarray(X), memmap_path)
+            # Cap BLAS/OpenMP threads so workers together stay within the CPU budget
+            threads = str(max(1, self.cpu_budget // n_jobs))
+            worker_env = {var: threads for var in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')}
             
-            return model, evaluation_metrics
+            queue = list(todo)
+            suspects = set()  # trials in flight when a worker died, rerun alone
+            while queue:
+                executor = ProcessPoolExecutor(max_workers=min(n_jobs, len(queue)), env=worker_env)
+                running = {}  # future -> (trial index, start, deadline)
+                try:
+                    while queue or running:
+                        # At most one trial per worker in flight, so a deadline starts with its trial;
+                        # a suspect runs with nothing beside it
+                        isolated = any(i in suspects for i, _, _ in running.values())
+                        while queue and len(running) < n_jobs and not isolated:
+                            if queue[0] in suspects and running:
+                                break
+                            i = queue.pop(0)
+                            trial = trials[i]
+                            future = executor.submit(
+                                _run_shared_trial, memmap_path, trial['algorithm'],
+                                self.algorithm_configs[trial['algorithm']]['model_class'],
+                                trial['params'], trial['seed'], trial.get('rows')
+                            )
+                            start = time.time()
+                            running[future] = (i, start, start + self.trial_timeout if self.trial_timeout else None)
+                            isolated = i in suspects
+                        
+                        deadlines = [deadline for _, _, deadline in running.values() if deadline is not None]
+                        wait_for = max(0.0, min(deadlines) - time.time()) if deadlines else None
+                        wait(running, timeout=wait_for, return_when=FIRST_COMPLETED)
+                        
+                        crashed = []
+                        for future in [future for future in running if future.done()]:
+                            i, start, _ = running.pop(future)
+                            try:
+                                *output, worker_peak = future.result()
+                            except BrokenProcessPool as e:  # loky's TerminatedWorkerError included
+                                crashed.append((i, start, e))
+                                continue
+                            if worker_peak is not None:
+                                self.worker_peak_rss_mb = max(self.worker_peak_rss_mb or 0.0, worker_peak)
+                            record(i, tuple(output))
+                        if crashed:
+                            # The pool is broken, so whatever is still in flight is lost with it
+                            crashed += [(i, start, None) for i, start, _ in running.values()]
+                            running = {}
+                            if len(crashed) == 1:
+                                i, start, error = crashed[0]
+                                trial = trials[i]
+                                print(f"💥 {trial['algorithm']} {trial['params']} killed its worker, skipping")
+                                results[i] = (None, {'error': f'Worker died: {error}'}, time.time() - start)
+                            else:
+                                print(f"💥 A worker died with {len(crashed)} trials in flight; rerunning them one at a time")
+                                suspects.update(i for i, _, _ in crashed)
+                                queue = [i for i, _, _ in crashed] + queue
+                            break
+                        
+                        now = time.time()
+                        expired = [future for future, (_, _, deadline) in running.items()
+                                   if deadline is not None and deadline <= now]
+                        if expired:
+                            for future in expired:
+                                i, _, _ = running.pop(future)
+                                trial = trials[i]
+                                print(f"⏱️  {trial['algorithm']} {trial['params']} exceeded {self.trial_timeout}s, skipping")
+                                results[i] = (None, {'error': f'Timed out after {self.trial_timeout}s'}, self.trial_timeout)
+                            # A running trial can't be interrupted, so the pool is restarted and
+                            # the trials still in flight are run again on the fresh workers
+                            queue = [i for i, _, _ in running.values()] + queue
+                            break
+                finally:
+                    executor.shutdown(wait=False, kill_workers=True)
             
-        except Exception as e:
-            print(f"Error training {algorithm_name}: {e}")
-            return None, {'error': str(e)}
+            return results
+        finally:
+            shutil.rmtree(memmap_dir, ignore_errors=True)
     
-    def hyperparameter_search(self, X: np.ndarray, algorithm_name: str, max_trials: int = 6):
-        """Perform hyperparameter search for algorithm"""
-        print(f"\n--- Hyperparameter search for {algorithm_name} ---")
+    def successive_halving(self, X: np.ndarray, trials_by_algorithm: Dict[str, List[Dict[str, Any]]],
+                           eta: int = HALVING_FACTOR, min_samples: int = HALVING_MIN_SAMPLES):
+        """
+        Successive halving: score every candidate on a small subsample, keep the
+        top 1/eta of each algorithm's candidates on an eta-times larger sample,
+        and only fit the finalists on all of X.
         
-        param_grid = self.algorithm_configs[algorithm_name]['param_grid']
-        param_combinations = list(ParameterGrid(param_grid))
+        Subsamples are nested prefixes of one seeded permutation, and candidates
+        compete only within their own algorithm because composite scores are not
+        comparable across algorithms. Returns {algorithm: (trials, outputs)} for
+        the final full-data rung.
+        """
+        n_samples = len(X)
+        max_candidates = max(len(trials) for trials in trials_by_algorithm.values())
+        n_rungs = 1 + int(np.ceil(np.log(max(max_candidates, 1)) / np.log(eta)))
+        sizes = sorted({min(n_samples, max(min_samples, n_samples // eta ** (n_rungs - 1 - rung)))
+                        for rung in range(n_rungs)})
+        order = np.random.default_rng(self.random_state).permutation(n_samples)
         
-        # Limit combinations for faster training
-        if len(param_combinations) > max_trials:
-            param_combinations = np.random.choice(param_combinations, max_trials, replace=False)
+        candidates = dict(trials_by_algorithm)
+        for rung, size in enumerate(sizes):
+            final = size == n_samples
+            X_rung = X if final else X[np.sort(order[:size])]
+            rung_trials = [trial for trials in candidates.values() for trial in trials]
+            print(f"\nHalving rung {rung + 1}/{len(sizes)}: {len(rung_trials)} candidates on {size:,} rows")
+            rung_outputs = self.run_trials(X_rung, rung_trials)
+            
+            results = {}
+            offset = 0
+            for algorithm_name, trials in candidates.items():
+                results[algorithm_name] = (trials, rung_outputs[offset:offset + len(trials)])
+                offset += len(trials)
+            if final:
+                return results
+            
+            # Promote the top 1/eta per algorithm (failed trials are dropped, ties keep trial order)
+            for algorithm_name, (trials, outputs) in results.items():
+                scored = [
+                    (-self.composite_score(metrics), position)
+                    for position, (model, metrics, _) in enumerate(outputs)
+                    if model is not None and 'error' not in metrics
+                ]
+                keep = max(1, int(np.ceil(len(trials) / eta)))
+                survivors = sorted(position for _, position in sorted(scored)[:keep])
+                candidates[algorithm_name] = [trials[position] for position in survivors]
         
+        return results
+    
+    def search(self, X: np.ndarray, trials_by_algorithm: Dict[str, List[Dict[str, Any]]]):
+        """Evaluate candidate trials with the configured search strategy"""
+        if self.search_strategy == 'halving':
+            return self.successive_halving(X, trials_by_algorithm)
+        if self.search_strategy != 'full':
+            raise ValueError(f"Unknown search strategy '{self.search_strategy}' (expected 'halving' or 'full')")
+        
+        all_trials = [trial for trials in trials_by_algorithm.values() for trial in trials]
+        all_outputs = self.run_trials(X, all_trials)
+        results = {}
+        offset = 0
+        for algorithm_name, trials in trials_by_algorithm.items():
+            results[algorithm_name] = (trials, all_outputs[offset:offset + len(trials)])
+            offset += len(trials)
+        return results
+    
+    def _best_trial(self, trials: List[Dict[str, Any]], outputs) -> Tuple[Any, Dict, Dict, float]:
+        """Pick the highest composite score (first trial wins ties)"""
         best_model = None
         best_score = float('-inf')
         best_params = None
         best_metrics = None
         
-        for params in param_combinations:
-            model, metrics = self.train_single_model(X, algorithm_name, params)
-            
+        for trial, (model, metrics, _) in zip(trials, outputs):
             if model is not None and 'error' not in metrics:
-                # Enhanced composite score for higher confidence
-                composite_score = (
-                    metrics['silhouette_score'] * 0.35 +
-                    metrics['separation_quality'] * 0.25 +
-                    (1 / (metrics['normal_score_variance'] + 1)) * 0.2 +
-                    (1 - metrics.get('anomaly_percentage', 0.05) / 100) * 0.1 +  # Prefer reasonable anomaly rates
-                    metrics.get('confidence_boost', 0) * 0.1  # Boost for confidence-enhancing features
-                )
-                
+                composite_score = self.composite_score(metrics)
                 if composite_score > best_score:
                     best_score = composite_score
                     best_model = model
-                    best_params = params
+                    best_params = trial['params']
                     best_metrics = metrics
         
         return best_model, best_params, best_metrics, best_score
     
-    def train_all_algorithms(self, X: np.ndarray) -> Dict[str, Any]:
+    def hyperparameter_search(self, X: np.ndarray, algorithm_name: str, max_trials: int = 6):
+        """Perform hyperparameter search for algorithm"""
+        print(f"\n--- Hyperparameter search for {algorithm_name} ---")
+        trials, outputs = self.search(X, {algorithm_name: self.sample_trials(algorithm_name, max_trials)})[algorithm_name]
+        return self._best_trial(trials, outputs)
+    
+    def train_all_algorithms(self, X: np.ndarray, max_trials: int = 6) -> Dict[str, Any]:
         """Train and compare all algorithms"""
         print("\n" + "="*60)
         print("TRAINING ALL ALGORITHMS")
         print("="*60)
         
+        # Algorithms finished in a checkpointed run are reused as-is
         results = {}
+        if self.checkpoint:
+            for algorithm_name in self.algorithm_configs:
+                if self.checkpoint.has(f'algorithm_{algorithm_name}'):
+                    results[algorithm_name] = self.checkpoint.load(f'algorithm_{algorithm_name}')
+                    print(f"♻️  Reusing checkpointed results for {algorithm_name}")
         
-        for algorithm_name in self.algorithm_configs.keys():
-            print(f"\nTraining {algorithm_name.upper().replace('_', ' ')}")
+        # One pool for every remaining algorithm's trials keeps all workers busy
+        trials_by_algorithm = {
+            name: self.sample_trials(name, max_trials) for name in self.algorithm_configs if name not in results
+        }
+        search_start = time.time()
+        searched = self.search(X, trials_by_algorithm) if trials_by_algorithm else {}
+        print(f"\n{self.search_strategy.title()} search finished in {time.time() - search_start:.1f}s")
+        
+        for algorithm_name, (trials, outputs) in searched.items():
+            print(f"\n{algorithm_name.upper().replace('_', ' ')}")
             print(f"Description: {self.algorithm_configs[algorithm_name]['description']}")
+            print(f"Trial time: {sum(output[2] for output in outputs):.1f}s across {len(trials)} trials")
             print("-" * 50)
             
-            try:
-                model, params, metrics, score = self.hyperparameter_search(X, algorithm_name)
-                
-                if model is not None:
-                    results[algorithm_name] = {
-                        'model': model,
-                        'best_params': params,
-                        'metrics': metrics,
-                        'composite_score': score,
-                        'description': self.algorithm_configs[algorithm_name]['description']
-                    }
-                    print(f"✅ {algorithm_name} completed - Score: {score:.4f}")
-                else:
-                    results[algorithm_name] = {'error': 'Training failed'}
-                    print(f"❌ {algorithm_name} failed")
-                
-            except Exception as e:
-                print(f"❌ {algorithm_name} failed with error: {e}")
-                results[algorithm_name] = {'error': str(e)}
+            model, params, metrics, score = self._best_trial(trials, outputs)
+            if model is not None:
+                metrics = self.report_metrics(model, X, algorithm_name, metrics)
+                results[algorithm_name] = {
+                    'model': model,
+                    'best_params': params,
+                    'metrics': metrics,
+                    'composite_score': score,
+                    'description': self.algorithm_configs[algorithm_name]['description']
+                }
+                print(f"✅ {algorithm_name} completed - Score: {score:.4f}")
+            else:
+                errors = {output[1].get('error') for output in outputs if 'error' in output[1]}
+                results[algorithm_name] = {'error': '; '.join(sorted(errors)) or 'Training failed'}
+                print(f"❌ {algorithm_name} failed")
+            
+            if self.checkpoint:
+                self.checkpoint.save(f'algorithm_{algorithm_name}', results[algorithm_name])
+                self._checkpoint_best_so_far(results)
         
-        return results
+        return {name: results[name] for name in self.algorithm_configs if name in results}
+    
+    def _checkpoint_best_so_far(self, results: Dict[str, Any]):
+        """Record which finished algorithm currently has the highest composite score"""
+        finished = {name: result for name, result in results.items() if 'error' not in result}
+        if not finished:
+            return
+        best_name = max(finished, key=lambda name: finished[name]['composite_score'])
+        self.checkpoint.save('best_so_far', {
+            'algorithm': best_name,
+            'composite_score': finished[best_name]['composite_score'],
+            'best_params': finished[best_name]['best_params'],
+            'model': finished[best_name]['model']
+        })
     
     def select_best_model(self, results: Dict[str, Any]) -> str:
         """Select best performing model"""
@@ -435,7 +876,12 @@ class ComprehensiveFraudDetectionModel:
                 'training_data_size': training_data_size,
                 'feature_count': len(self.feature_names),
                 'models_trained': len([r for r in results.values() if 'error' not in r]),
-                'failed_models': len([r for r in results.values() if 'error' in r])
+                'failed_models': len([r for r in results.values() if 'error' in r]),
+                'data_preparation_memory': self.memory_profile,
+                'ensemble': self.ensemble.summary() if self.ensemble else None,
+                'segments': self.segmented.summary() if self.segmented else None,
+                'feature_importance': self.feature_importance,
+                'rule_cascade': self.rule_cascade.summary() if self.rule_cascade else None
             },
             
             'unsupervised_learning_justification': {
@@ -470,11 +916,13 @@ class ComprehensiveFraudDetectionModel:
             'deployment_recommendations': {
                 'best_model': best_model_name,
                 'recommended_threshold': "Use 98th percentile of anomaly scores for flagging",
-                'retraining_frequency': "Monthly retraining recommended due to evolving fraud patterns",
+                'retraining_frequency': "Retrain when GET /drift reports retrain_recommended "
+                                        "(feature PSI >= 0.25), at least monthly",
                 'monitoring_metrics': [
                     "Daily anomaly detection rate (should be 1-3%)",
                     "Average anomaly scores over time",
-                    "Feature importance drift detection",
+                    "Feature distribution drift (PSI / KS per feature on GET /drift)",
+                    "Rule cascade hit rates and shadow agreement (GET /cascade)",
                     "Model performance degradation alerts"
                 ]
             }
@@ -494,6 +942,52 @@ class ComprehensiveFraudDetectionModel:
         
         return report
     
+    def train_segment_models(self, X: np.ndarray, algorithm_name: str, params: Dict[str, Any],
+                             fallback_model, min_rows: int = SEGMENT_MIN_ROWS) -> SegmentedDetector:
+        """
+        Fit algorithm_name with params on each segment's rows, all segments in
+        one process pool. Segments with fewer than min_rows rows are served by
+        fallback_model.
+        """
+        keys = segment_keys(self.segment_frame, self.segment_by)
+        groups = group_rows(keys)
+        trials = [
+            {'algorithm': algorithm_name, 'params': params, 'rows': rows, 'segment': key,
+             'seed': int(np.random.SeedSequence([self.random_state, position]).generate_state(1)[0])}
+            for position, (key, rows) in enumerate(groups.items()) if len(rows) >= min_rows
+        ]
+        skipped = {key: len(rows) for key, rows in groups.items() if len(rows) < min_rows}
+        print(f"Training {len(trials)} {algorithm_name} segment models by {' x '.join(self.segment_by)}"
+              f" ({len(skipped)} small segments use the global model)")
+        
+        segmented = SegmentedDetector(self.segment_by, algorithm_name, fallback_model, self.score_quantiles)
+        for trial, (model, metrics, elapsed) in zip(trials, self.run_trials(X, trials)):
+            if model is None:
+                print(f"❌ Segment {trial['segment']} failed: {metrics.get('error')}; using the global model")
+                continue
+            segmented.add_segment(trial['segment'], model, self.serving_scores(model, X[trial['rows']]), metrics)
+            print(f"   {trial['segment']:<32} {len(trial['rows']):>9,} rows  "
+                  f"{metrics['anomaly_percentage']:.2f}% flagged  {elapsed:.1f}s")
+        return segmented
+    
+    def build_ensemble(self, results: Dict[str, Any], X: np.ndarray, timing_rows: int = 5000) -> ScoreEnsemble:
+        """Combine every successfully trained detector, weighted by its composite score on rank-normalized scores"""
+        members = {name: result['model'] for name, result in results.items() if 'error' not in result}
+        training_scores = {name: self.serving_scores(model, X) for name, model in members.items()}
+        rng = np.random.default_rng(self.random_state)
+        timing_idx = np.sort(rng.choice(len(X), min(timing_rows, len(X)), replace=False))
+        ensemble = ScoreEnsemble(members).fit(
+            X, training_scores, lambda X, ranks: self.composite_score(fast_anomaly_metrics(X, ranks)),
+            X_timing=X[timing_idx]
+        )
+        
+        print(f"\n{'Member':<26} {'Weight':>8} {'Redundancy':>11} {'ms/1k rows':>11}")
+        print("-" * 60)
+        for name, stats in ensemble.member_stats.items():
+            print(f"{name:<26} {stats['weight']:>8.3f} {stats['redundancy']:>11.3f} {stats.get('ms_per_1k_rows', 0):>11.2f}")
+        print(f"Ensemble threshold: {ensemble.threshold:.4f}")
+        return ensemble
+    
     def save_model_and_report(self, results: Dict[str, Any], best_model_name: str, 
                             report: Dict[str, Any]):
         """Save trained model and comprehensive report"""
@@ -510,9 +1004,21 @@ class ComprehensiveFraudDetectionModel:
             'model': results[best_model_name]['model'],
             'model_type': best_model_name,
             'best_params': results[best_model_name]['best_params'],
+            'preprocessor': self.preprocessor,
             'scaler': self.scaler,
             'encoders': self.encoders,
             'feature_names': self.feature_names,
+            'cardinality_sketches': self.cardinality_store,
+            'transaction_graph': self.transaction_graph,
+            'score_quantiles': self.score_quantiles,
+            'ensemble': self.ensemble,
+            'segments': self.segmented,
+            'drift_reference': self.drift_reference,
+            'refit_reservoir': self.refit_reservoir,
+            'feature_importance': self.feature_importance,
+            'rule_cascade': self.rule_cascade,
+            'training_watermark': self.training_watermark,
+            'training_rows': self.training_rows,
             'performance_metrics': results[best_model_name]['metrics'],
             'training_timestamp': datetime.now().isoformat(),
             'model_version': '2.0',
@@ -520,11 +1026,7 @@ class ComprehensiveFraudDetectionModel:
         }
         
         # Save to both locations for compatibility
-        joblib.dump(best_model_data, 'trained_models/best_fraud_detection_model.joblib')
-        
-        # Create legacy directory if it doesn't exist
-        os.makedirs('ml/trained_models', exist_ok=True)
-        joblib.dump(best_model_data, 'ml/trained_models/isolation_forest_model.joblib')  # Legacy path
+        self.save_model_artifact(best_model_data)
         
         # Save comparison of all models
         joblib.dump(results, 'trained_models/all_models_comparison.joblib')
@@ -541,6 +1043,292 @@ class ComprehensiveFraudDetectionModel:
         print("✅ Detailed report saved to: reports/comprehensive_training_report.json")
         print("✅ Summary report saved to: reports/model_training_report.md")
     
+    @staticmethod
+    def save_model_artifact(model_data: Dict[str, Any]):
+        """Write the model artifact to the primary and legacy paths"""
+        os.makedirs(os.path.dirname(BEST_MODEL_PATH), exist_ok=True)
+        joblib.dump(model_data, BEST_MODEL_PATH)
+        
+        # Create legacy directory if it doesn't exist
+        os.makedirs(os.path.dirname(LEGACY_MODEL_PATH), exist_ok=True)
+        joblib.dump(model_data, LEGACY_MODEL_PATH)  # Legacy path
+    
+    def compute_feature_importance(self, model, X: np.ndarray, sample_rows: int = 20000) -> Dict[str, float]:
+        """
+        Mean contribution share of each feature over the most anomalous rows of
+        a training sample, from the served detector (the ensemble when built)
+        """
+        served = self.ensemble if self.ensemble is not None else model
+        rows = np.arange(len(X))
+        if len(X) > sample_rows:
+            rows = np.sort(np.random.RandomState(self.random_state).choice(len(X), sample_rows, replace=False))
+        if self.ensemble is not None:
+            scores = self.ensemble.score(X[rows])[0]
+        else:
+            # Indexed scoring, so LOF's training scores see the matrix it was fitted on
+            scores = self.serving_scores(model, X, rows)
+        explainer = FeatureExplainer(served, self.feature_names)
+        importance = explainer.global_importance(X[rows], scores)
+        print(f"🔎 Top contributing features ({explainer.method}): "
+              + ", ".join(f"{name} {share:.1%}" for name, share in list(importance.items())[:5]))
+        return importance
+    
+    def fit_rule_cascade(self, model, X: np.ndarray, raw_frame: pd.DataFrame, segment_frame: pd.DataFrame = None,
+                         sample_rows: int = 100000, fitted: bool = True) -> RuleCascade:
+        """
+        Tier-1 rules validated against the served detector (segment models,
+        else the ensemble, else model) on a sample of the rows of X; fitted
+        says whether X is the matrix model was fitted on
+        """
+        rows = np.arange(len(X))
+        if len(X) > sample_rows:
+            rows = np.sort(np.random.RandomState(self.random_state).choice(len(X), sample_rows, replace=False))
+        X_sample = X[rows]
+        if self.segmented is not None:
+            scores, thresholds, _ = self.segmented.score(X_sample, self.segmented.keys_for(segment_frame.iloc[rows]))
+        elif self.ensemble is not None:
+            scores = self.ensemble.score(X_sample)[0]
+            thresholds = np.full(len(rows), self.ensemble.threshold)
+        else:
+            scores = self.serving_scores(model, X, rows) if fitted else model.score_samples(X_sample)
+            thresholds = np.full(len(rows), single_model_threshold(model, self.score_quantiles))
+        cascade = RuleCascade.fit(raw_frame.iloc[rows], scores, thresholds)
+        enabled = [f"{transaction_type} ({', '.join(tier for tier in ('normal', 'anomaly') if rule[tier])})"
+                   for transaction_type, rule in cascade.rules.items() if rule['normal'] or rule['anomaly']]
+        print(f"🚦 Rule cascade settles "
+              + ", ".join(f"{rate:.1%} {tier}" for tier, rate in cascade.training_hit_rates.items()
+                          if tier != TIER_NAMES[TIER_MODEL])
+              + f" of training rows; rules on for {', '.join(enabled) or 'no transaction types'}")
+        return cascade
+    
+    @staticmethod
+    def serving_scores(model, X: np.ndarray, rows: np.ndarray = None) -> np.ndarray:
+        """
+        Scores on the score_samples scale the API uses for X[rows] (all of X
+        when rows is None), where X is the matrix the model was fitted on
+        """
+        if hasattr(model, 'training_scores'):
+            return model.training_scores(X, rows)
+        return model.score_samples(X if rows is None else X[rows])
+    
+    @staticmethod
+    def update_reservoir(reservoir: Optional[np.ndarray], X_new: np.ndarray, seen: int,
+                         capacity: int = INCREMENTAL_RESERVOIR_ROWS, seed: int = None) -> np.ndarray:
+        """
+        Reservoir sample (Algorithm R, vectorized) of X_new's rows following
+        `seen` earlier rows, stored as float32
+        """
+        rng = np.random.default_rng(seed)
+        X_new = np.asarray(X_new, dtype=np.float32)
+        reservoir = np.empty((0, X_new.shape[1]), dtype=np.float32) if reservoir is None else reservoir.copy()
+        fill = max(0, min(capacity - len(reservoir), len(X_new)))
+        if fill:
+            reservoir = np.vstack([reservoir, X_new[:fill]])
+        rest = X_new[fill:]
+        if len(rest):
+            # Row i of the stream replaces slot randint(0, i) when that is inside the reservoir;
+            # later rows win duplicate slots, as in the sequential algorithm
+            positions = seen + fill + np.arange(len(rest))
+            slots = (rng.random(len(rest)) * (positions + 1)).astype(np.int64)
+            accepted = slots < capacity
+            reservoir[slots[accepted]] = rest[accepted]
+        return reservoir
+    
+    def refresh_isolation_forest(self, model: IsolationForest, X_new: np.ndarray,
+                                 tree_fraction: float = INCREMENTAL_TREE_FRACTION, grow: bool = False,
+                                 seed: int = None, X_history: np.ndarray = None) -> IsolationForest:
+        """
+        Warm-start a fitted IsolationForest on new rows: replace the oldest
+        tree_fraction of its trees (or add that many when grow=True) with trees
+        grown on X_new, topped up with X_history rows when X_new is smaller than
+        the trees' subsample size.
+        """
+        n_trees = len(model.estimators_)
+        n_new_trees = max(1, int(round(n_trees * tree_fraction)))
+        kept_seeds = np.asarray(model._seeds)
+        if not grow:
+            # Trees are appended in order, so the oldest are at the front
+            del model.estimators_[:n_new_trees]
+            del model.estimators_features_[:n_new_trees]
+            kept_seeds = kept_seeds[n_new_trees:]
+        
+        X_fit = X_new
+        if len(X_new) < model.max_samples_ and X_history is not None and len(X_history):
+            top_up = np.random.default_rng(seed).choice(len(X_history), min(model.max_samples_ - len(X_new),
+                                                                            len(X_history)), replace=False)
+            X_fit = np.vstack([X_new, X_history[np.sort(top_up)]])
+        
+        # Keep the subsample size the existing trees were grown with so path lengths stay comparable
+        model.set_params(
+            warm_start=True,
+            n_estimators=len(model.estimators_) + n_new_trees,
+            max_samples=min(model.max_samples_, len(X_fit)),
+            random_state=seed if seed is not None else model.random_state
+        )
+        model.fit(X_fit)
+        model.set_params(warm_start=False)
+        # A warm-start fit stores only the new trees' seeds; keep one per tree in estimators_ order
+        model._seeds = np.concatenate([kept_seeds, model._seeds])
+        print(f"{'Added' if grow else 'Replaced'} {n_new_trees} of {n_trees} trees using {len(X_new):,} new rows")
+        return model
+    
+    def update_incremental(self, end_time: datetime = None, tree_fraction: float = INCREMENTAL_TREE_FRACTION,
+                           grow: bool = False, model_path: str = BEST_MODEL_PATH) -> Dict[str, Any]:
+        """
+        Refresh the saved model with transactions since its training watermark
+        instead of retraining from scratch.
+        
+        Sketches and the graph absorb the new rows. The preprocessor stays frozen,
+        so every consumer of its scaling (ensemble members, segment models, the
+        drift reference) keeps seeing features on the scale it was fitted on. An
+        IsolationForest replaces a fraction of its trees via warm_start; other
+        algorithms are refitted with their saved parameters on the saved
+        reservoir of earlier rows plus the new rows once at least
+        INCREMENTAL_MIN_ROWS new rows exist. Score quantiles are blended by row
+        count and the reservoir takes in the new rows. No hyperparameter search is run.
+        """
+        print("\n" + "="*80)
+        print("🔄 INCREMENTAL MODEL REFRESH")
+        print("="*80)
+        refresh_start = time.time()
+        
+        model_data = joblib.load(model_path)
+        if not model_data.get('training_watermark'):
+            raise Exception("Saved model has no training watermark; run a full training first")
+        watermark = pd.Timestamp(model_data['training_watermark'])
+        
+        # Load a lookback so velocity windows for the first new rows see their history
+        lookback = pd.Timedelta(seconds=max(VELOCITY_WINDOWS.values()))
+        df = self.load_data_streaming((watermark - lookback).to_pydatetime(), end_time)
+        new_rows = df['timestamp'] > watermark
+        if not new_rows.any():
+            print(f"✅ No transactions after {watermark.isoformat()}; model is up to date")
+            return model_data
+        print(f"Found {int(new_rows.sum()):,} transactions after watermark {watermark.isoformat()}")
+        
+        self.feature_names = model_data['feature_names']
+        self.preprocessor = model_data.get('preprocessor') or Preprocessor.from_legacy(
+            self.feature_names, model_data['scaler'], model_data['encoders']
+        )
+        self.cardinality_store = model_data.get('cardinality_sketches') or CardinalitySketchStore()
+        self.cardinality_store.add_frame(df[new_rows])
+        
+        # Only the new rows go into the saved graph (the lookback is already in it)
+        self.transaction_graph = model_data.get('transaction_graph')
+        if self.transaction_graph is None and graph_columns_available(df):
+            self.transaction_graph = TransactionGraph()
+        if self.transaction_graph is not None:
+            graph_features = self.transaction_graph.add_frame(df[new_rows])
+            for col in graph_features.columns:
+                df[col] = graph_features[col]
+        
+        df_engineered = calculate_derived_features_chunked(df, cardinality_store=self.cardinality_store,
+                                                           inplace=True)
+        df_engineered = df_engineered[df_engineered['timestamp'] > watermark].copy()
+        
+        new_rule_frame = rule_frame(df_engineered)
+        neutralize_cultural_transactions(df_engineered, self.feature_names, inplace=True)
+        X_new = self.preprocessor.transform(df_engineered)
+        
+        model = model_data['model']
+        model_type = model_data['model_type']
+        new_watermark = pd.Timestamp(df_engineered['timestamp'].max())
+        seed = int(new_watermark.timestamp()) % (2**31 - 1)
+        # Earlier rows on the same (frozen) scaling; artifacts saved before the reservoir have none
+        reservoir = model_data.get('refit_reservoir')
+        X_history = (reservoir.astype(np.float64) if reservoir is not None
+                     else np.empty((0, X_new.shape[1]), dtype=np.float64))
+        X_sample = np.vstack([X_history, X_new])
+        refitted = False
+        if isinstance(model, IsolationForest):
+            if len(X_new) >= 256:
+                model = self.refresh_isolation_forest(model, X_new, tree_fraction, grow, seed=seed,
+                                                      X_history=X_history)
+            else:
+                print(f"Only {len(X_new)} new rows; keeping trees, statistics updated")
+        elif len(X_new) >= INCREMENTAL_MIN_ROWS:
+            print(f"Refitting {model_type} with saved parameters on {len(X_history):,} reservoir "
+                  f"+ {len(X_new):,} new rows")
+            model = self.algorithm_configs[model_type]['model_class'](**model_data['best_params']).fit(X_sample)
+            refitted = True
+        else:
+            print(f"Only {len(X_new):,} new rows (< {INCREMENTAL_MIN_ROWS:,}); keeping {model_type}, statistics updated")
+        
+        X_scored = X_sample if refitted else X_new
+        scores = self.serving_scores(model, X_scored) if refitted else model.score_samples(X_new)
+        metrics = self.evaluate_anomaly_detection(X_scored, scores, f"{model_type}_incremental",
+                                                  random_state=self.random_state)
+        
+        # Blend score quantiles by row count unless the model was rebuilt (its scores on
+        # the reservoir plus the new rows stand for the whole history)
+        new_quantiles = np.quantile(scores, SCORE_QUANTILE_POINTS)
+        old_quantiles = model_data.get('score_quantiles')
+        previous_rows = model_data.get('training_rows', 0)
+        if old_quantiles is not None and not refitted:
+            weight = len(X_new) / (len(X_new) + previous_rows)
+            score_quantiles = (1 - weight) * np.asarray(old_quantiles) + weight * new_quantiles
+        else:
+            score_quantiles = new_quantiles
+        
+        # Keep an ensemble artifact's copy of this detector in step with the refresh, then
+        # relearn the weights and threshold on the same rows so they match the new ranks
+        ensemble = model_data.get('ensemble')
+        if ensemble is not None and model_type in ensemble.members:
+            ensemble.members[model_type] = model
+            ensemble.quantiles[model_type] = score_quantiles
+            ensemble.reweight(X_sample, lambda X, ranks: self.composite_score(fast_anomaly_metrics(X, ranks)))
+            print(f"Ensemble reweighted on {len(X_sample):,} reservoir and new rows, "
+                  f"threshold {ensemble.threshold:.4f}")
+        if model_data.get('segments') is not None:
+            print("⚠️  Segment models are not refreshed incrementally; retrain with --segment-by to update them")
+        
+        # Drift reference follows the data the model now represents; its bins stay valid
+        # because the preprocessor (and so the feature scaling) is frozen across refreshes
+        drift_reference = model_data.get('drift_reference')
+        if refitted or drift_reference is None:
+            drift_reference = FeatureReference.from_matrix(X_sample, self.feature_names)
+        else:
+            drift_reference = drift_reference.updated(X_new)
+        
+        # Re-validate the rule cascade against the refreshed detector once there are enough new rows
+        rule_cascade = model_data.get('rule_cascade')
+        if rule_cascade is not None and len(X_new) >= INCREMENTAL_MIN_ROWS:
+            self.ensemble = ensemble
+            self.segmented = model_data.get('segments')
+            self.score_quantiles = score_quantiles
+            rule_cascade = self.fit_rule_cascade(model, X_new, new_rule_frame, df_engineered.reset_index(drop=True),
+                                                 fitted=False)
+        
+        model_data.update({
+            'model': model,
+            'preprocessor': self.preprocessor,
+            'scaler': self.preprocessor.scaler,
+            'encoders': self.preprocessor.encoders,
+            'cardinality_sketches': self.cardinality_store,
+            'transaction_graph': self.transaction_graph,
+            'score_quantiles': score_quantiles,
+            'drift_reference': drift_reference,
+            'refit_reservoir': self.update_reservoir(reservoir, X_new, previous_rows, seed=seed),
+            'rule_cascade': rule_cascade,
+            'training_watermark': new_watermark.isoformat(),
+            'training_rows': previous_rows + len(X_new),
+            'incremental_metrics': metrics,
+            'training_timestamp': datetime.now().isoformat()
+        })
+        model_data.setdefault('incremental_updates', []).append({
+            'timestamp': datetime.now().isoformat(),
+            'from_watermark': watermark.isoformat(),
+            'to_watermark': new_watermark.isoformat(),
+            'rows': len(X_new),
+            'refitted': refitted
+        })
+        self.save_model_artifact(model_data)
+        
+        print(f"\n✅ Incremental refresh finished in {(time.time() - refresh_start)/60:.2f} minutes")
+        print(f"   Watermark: {watermark.isoformat()} → {new_watermark.isoformat()}")
+        print(f"   Saved to: {BEST_MODEL_PATH}")
+        return model_data
+    
     def generate_markdown_report(self, report: Dict[str, Any], filename: str):
         """Generate human-readable markdown report"""
         
@@ -564,20 +1352,66 @@ class ComprehensiveFraudDetectionModel:
             
             # Model Comparison
             f.write("## Algorithm Comparison Results\n\n")
-            f.write("| Algorithm | Silhouette Score | Separation Quality | Anomaly Detection % | Composite Score | Status |\n")
-            f.write("|-----------|------------------|--------------------|--------------------|-----------------|--------|\n")
+            f.write("| Algorithm | Silhouette Score | Exact Silhouette | Separation Quality | Anomaly Detection % | Composite Score | Status |\n")
+            f.write("|-----------|------------------|------------------|--------------------|--------------------|-----------------|--------|\n")
             
             for name, result in report['model_comparison'].items():
                 if 'training_failed' not in result:
                     metrics = result['performance_metrics']
+                    exact = metrics.get('silhouette_score_exact')
                     f.write(f"| {name.replace('_', ' ').title()} | "
                            f"{metrics['silhouette_score']:.4f} | "
+                           f"{'-' if exact is None else f'{exact:.4f}'} | "
                            f"{metrics['separation_quality']:.4f} | "
                            f"{metrics['anomaly_percentage']:.2f}% | "
                            f"{result['composite_score']:.4f} | Success |\n")  # Remove emoji
                 else:
-                    f.write(f"| {name.replace('_', ' ').title()} | - | - | - | - | Failed |\n")  # Remove emoji
-            
+                    f.write(f"| {name.replace('_', ' ').title()} | - | - | - | - | - | Failed |\n")  # Remove emoji
+
+            ensemble = summary.get('ensemble')
+            if ensemble:
+                f.write("\n## Ensemble Members\n\n")
+                f.write(f"Threshold on the rank-normalized ensemble score: {ensemble['threshold']:.4f}\n\n")
+                f.write("| Member | Weight | Redundancy | ms / 1k rows |\n")
+                f.write("|--------|--------|------------|--------------|\n")
+                for name, stats in ensemble['member_stats'].items():
+                    f.write(f"| {name.replace('_', ' ').title()} | {stats['weight']:.3f} | "
+                           f"{stats['redundancy']:.3f} | {stats.get('ms_per_1k_rows', 0):.2f} |\n")
+
+            segments = summary.get('segments')
+            if segments:
+                f.write(f"\n## Segment Models ({' x '.join(segments['segment_by'])})\n\n")
+                f.write(f"Algorithm: {segments['algorithm'].replace('_', ' ').title()}; "
+                        "smaller segments are scored by the global model.\n\n")
+                f.write("| Segment | Training Rows | Threshold | Anomaly Detection % |\n")
+                f.write("|---------|---------------|-----------|---------------------|\n")
+                for key, stats in segments['segments'].items():
+                    f.write(f"| {key} | {stats['rows']:,} | {stats['threshold']:.4f} | "
+                           f"{stats['anomaly_percentage']:.2f}% |\n")
+
+            importance = summary.get('feature_importance')
+            if importance:
+                f.write("\n## Top Contributing Features\n\n")
+                f.write("Mean contribution share over the most anomalous 2% of training rows.\n\n")
+                f.write("| Feature | Contribution |\n")
+                f.write("|---------|--------------|\n")
+                for name, share in list(importance.items())[:10]:
+                    f.write(f"| {name} | {share:.1%} |\n")
+
+            cascade = summary.get('rule_cascade')
+            if cascade:
+                f.write("\n## Tier-1 Rule Cascade\n\n")
+                f.write("Share of training rows each tier settles: "
+                        + ", ".join(f"{tier} {rate:.1%}" for tier, rate in cascade['training_hit_rates'].items())
+                        + ".\n\n")
+                f.write("| Transaction Type | Normal Band (MWK) | Normal Rule | Anomalous Above (MWK) | Anomalous Rule |\n")
+                f.write("|------------------|-------------------|-------------|-----------------------|----------------|\n")
+                for transaction_type, rule in cascade['rules'].items():
+                    normal = f"{rule['normal_agreement']:.1%} agreement" + ("" if rule['normal'] else " (off)")
+                    anomaly = f"{rule['anomaly_agreement']:.1%} agreement" + ("" if rule['anomaly'] else " (off)")
+                    f.write(f"| {transaction_type} | {rule['floor']:,.0f}-{rule['normal_cap']:,.0f} | {normal} | "
+                            f"{rule['anomaly_amount']:,.0f} | {anomaly} |\n")
+
             # Feature Engineering
             f.write("\n## Feature Engineering Summary\n\n")
             feat_eng = report['feature_engineering']
@@ -596,8 +1430,13 @@ class ComprehensiveFraudDetectionModel:
             for metric in deploy['monitoring_metrics']:
                 f.write(f"- [ ] {metric}\n")
     
-    def train_comprehensive_model(self, sample_size: int = 150000):
-        """Main training pipeline"""
+    def train_comprehensive_model(self, sample_size: int = 150000, start_time: datetime = None,
+                                  end_time: datetime = None, resume: str = None):
+        """
+        Main training pipeline. Stages are checkpointed unless use_checkpoints is
+        off; resume='latest' (or a run directory) continues an unfinished run
+        with its original parameters.
+        """
         print("\n" + "="*80)
         print("🚀 COMPREHENSIVE FRAUD DETECTION MODEL TRAINING")
         print("="*80)
@@ -609,16 +1448,37 @@ class ComprehensiveFraudDetectionModel:
         print("✓ Comprehensive reporting")
         print("="*80)
         
-        start_time = time.time()
+        pipeline_start = time.time()
+        
+        if resume:
+            self.checkpoint = TrainingCheckpoint.latest() if resume == 'latest' else TrainingCheckpoint.open(resume)
+            if self.checkpoint is None:
+                raise Exception("No unfinished training run to resume")
+            params = self.checkpoint.params
+            sample_size = params['sample_size']
+            start_time = datetime.fromisoformat(params['start_time']) if params['start_time'] else None
+            end_time = datetime.fromisoformat(params['end_time']) if params['end_time'] else None
+            self.search_strategy = params['search_strategy']
+            self.sampling = params.get('sampling', 'latest')
+            self.ensemble_mode = params.get('ensemble', False)
+            self.segment_by = parse_segment_by(params.get('segment_by'))
+            print(f"⏯️  Resuming {self.checkpoint.manifest['run_id']} "
+                  f"(completed stages: {', '.join(self.checkpoint.manifest['stages']) or 'none'})")
+        elif self.use_checkpoints:
+            self.checkpoint = TrainingCheckpoint.create({
+                'sample_size': sample_size,
+                'start_time': start_time.isoformat() if start_time else None,
+                'end_time': end_time.isoformat() if end_time else None,
+                'search_strategy': self.search_strategy,
+                'sampling': self.sampling,
+                'ensemble': self.ensemble_mode,
+                'segment_by': list(self.segment_by)
+            })
         
         try:
-            # Step 1: Load data
-            print("\n📊 STEP 1: Loading data from database")
-            df = self.load_data_from_db(sample_size)
-            
-            # Step 2: Feature engineering and preprocessing
-            print("\n🔧 STEP 2: Feature engineering and preprocessing")
-            X, feature_names = self.prepare_training_data(df)
+            # Steps 1-2: Load data, feature engineering and preprocessing (cached by data fingerprint)
+            print("\n📊 STEP 1-2: Loading data and preparing features")
+            X, feature_names = self.load_prepared_data(sample_size, start_time, end_time)
             
             # Step 3: Train all algorithms
             print("\n🤖 STEP 3: Training multiple algorithms")
@@ -627,23 +1487,41 @@ class ComprehensiveFraudDetectionModel:
             # Step 4: Select best model
             print("\n🏆 STEP 4: Model selection")
             best_model_name = self.select_best_model(results)
+            self.score_quantiles = np.quantile(
+                self.serving_scores(results[best_model_name]['model'], X), SCORE_QUANTILE_POINTS
+            )
+            if self.ensemble_mode:
+                print("\n🧩 Building ensemble of all trained detectors")
+                self.ensemble = self.build_ensemble(results, X)
+            if self.segment_by:
+                print(f"\n🧭 Training per-segment {best_model_name} models")
+                self.segmented = self.train_segment_models(
+                    X, best_model_name, results[best_model_name]['best_params'], results[best_model_name]['model']
+                )
+            self.feature_importance = self.compute_feature_importance(results[best_model_name]['model'], X)
+            if self.rule_frame is not None:
+                self.rule_cascade = self.fit_rule_cascade(results[best_model_name]['model'], X, self.rule_frame,
+                                                          self.segment_frame)
             
             # Step 5: Generate comprehensive report
             print("\n📝 STEP 5: Generating comprehensive report")
-            report = self.generate_comprehensive_report(results, best_model_name, len(df))
+            report = self.generate_comprehensive_report(results, best_model_name, self.training_rows)
             
             # Step 6: Save everything
             print("\n💾 STEP 6: Saving model and reports")
             self.save_model_and_report(results, best_model_name, report)
+            if self.checkpoint:
+                self.checkpoint.complete()
+                self.checkpoint = None
             
-            training_time = time.time() - start_time
+            training_time = time.time() - pipeline_start
             
             print("\n" + "="*80)
             print("🎉 TRAINING COMPLETED SUCCESSFULLY!")
             print("="*80)
             print(f"⏱️  Total Training Time: {training_time/60:.2f} minutes")
             print(f"🥇 Best Model: {best_model_name.replace('_', ' ').title()}")
-            print(f"📈 Training Data: {len(df):,} transactions")
+            print(f"📈 Training Data: {self.training_rows:,} transactions")
             print(f"🔍 Features Used: {len(feature_names)}")
             print(f"📊 Detection Rate: {results[best_model_name]['metrics']['anomaly_percentage']:.2f}%")
             print("\n📁 Generated Files:")
@@ -657,6 +1535,8 @@ class ComprehensiveFraudDetectionModel:
             
         except Exception as e:
             print(f"\n❌ TRAINING FAILED: {e}")
+            if self.checkpoint:
+                print(f"   Completed stages are saved in {self.checkpoint.run_dir}; continue with --resume")
             raise e
 
 # Legacy function for backward compatibility
@@ -667,9 +1547,55 @@ def train_unsupervised_model():
     return trainer.train_comprehensive_model()
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Train and compare fraud detection models")
+    parser.add_argument('--sample-size', type=int, default=200000)
+    parser.add_argument('--since', type=datetime.fromisoformat, default=None,
+                        help="Only train on transactions at or after this ISO timestamp (streams via COPY)")
+    parser.add_argument('--until', type=datetime.fromisoformat, default=None,
+                        help="Only train on transactions before this ISO timestamp (streams via COPY)")
+    parser.add_argument('--exact-silhouette', action='store_true', default=EVALUATION_EXACT_SILHOUETTE,
+                        help="Also compute the O(n^2) sampled silhouette for each algorithm's best model in reports")
+    parser.add_argument('--search', choices=['halving', 'full'], default=TRAINING_SEARCH_STRATEGY,
+                        help="halving screens candidates on subsamples; full fits every candidate on all rows")
+    parser.add_argument('--sampling', choices=['latest', 'sender'], default=TRAINING_SAMPLING,
+                        help="latest: most recent rows; sender: every transaction of a hashed sample of senders")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Always reload and re-engineer the training data instead of using the matrix cache")
+    parser.add_argument('--resume', nargs='?', const='latest', default=None, metavar='RUN_DIR',
+                        help="Continue the latest unfinished run (or RUN_DIR) from its last completed stage")
+    parser.add_argument('--no-checkpoints', action='store_true',
+                        help="Do not write per-stage checkpoints")
+    parser.add_argument('--ensemble', action='store_true', default=TRAINING_ENSEMBLE,
+                        help="Also save all trained detectors as a rank-normalized weighted ensemble")
+    parser.add_argument('--segment-by', default=TRAINING_SEGMENT_BY, metavar='COLUMNS',
+                        help="Also train one model per segment: transaction_type or transaction_type,network_operator")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Refresh the saved model with transactions since its training watermark")
+    parser.add_argument('--tree-fraction', type=float, default=INCREMENTAL_TREE_FRACTION,
+                        help="Share of IsolationForest trees replaced per incremental refresh")
+    parser.add_argument('--grow', action='store_true',
+                        help="Add new trees instead of replacing the oldest ones during --incremental")
+    args = parser.parse_args()
+    
+    if args.incremental:
+        ComprehensiveFraudDetectionModel().update_incremental(
+            end_time=args.until, tree_fraction=args.tree_fraction, grow=args.grow
+        )
+        raise SystemExit(0)
+    
     # Run comprehensive model training
     trainer = ComprehensiveFraudDetectionModel()
-    best_model, results, report = trainer.train_comprehensive_model(sample_size=200000)
+    trainer.search_strategy = args.search
+    trainer.use_cache = not args.no_cache
+    trainer.sampling = args.sampling
+    trainer.use_checkpoints = not args.no_checkpoints
+    trainer.exact_silhouette = args.exact_silhouette
+    trainer.ensemble_mode = args.ensemble
+    trainer.segment_by = parse_segment_by(args.segment_by)
+    best_model, results, report = trainer.train_comprehensive_model(
+        sample_size=args.sample_size, start_time=args.since, end_time=args.until, resume=args.resume
+    )
     
     print(f"\n🎯 Training Summary:")
     print(f"   Best Model: {best_model}")
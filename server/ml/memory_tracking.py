@@ -0,0 +1,76 @@
+"""
+Peak resident memory per pipeline stage.
+
+On Linux the kernel's high-water mark (VmHWM) can be reset by writing 5 to
+/proc/self/clear_refs, so each stage reports its own peak. Where that is not
+available the process-lifetime peak from getrusage is reported instead.
+"""
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _proc_status_mb(field: str) -> Optional[float]:
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def current_rss_mb() -> Optional[float]:
+    return _proc_status_mb('VmRSS')
+
+
+def peak_rss_mb() -> Optional[float]:
+    """High-water mark of resident memory since the last reset (or process start)"""
+    peak = _proc_status_mb('VmHWM')
+    if peak is None and resource is not None:
+        # ru_maxrss is KB on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return peak
+
+
+def reset_peak_rss() -> bool:
+    """Reset the kernel's peak RSS counter; False when the platform does not allow it"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+@contextmanager
+def track_peak_memory(stage: str, profile: Dict[str, Dict[str, float]] = None):
+    """Print (and record into profile) the peak RSS reached while the block runs"""
+    per_stage = reset_peak_rss()
+    start_rss = current_rss_mb()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        peak = peak_rss_mb()
+        end_rss = current_rss_mb()
+        elapsed = time.perf_counter() - start
+        if peak is not None:
+            scope = "" if per_stage else " (process peak)"
+            print(f"🧠 {stage}: peak RSS {peak:,.0f} MB{scope}, "
+                  f"{start_rss or 0:,.0f} -> {end_rss or 0:,.0f} MB, {elapsed:.2f}s")
+        if profile is not None:
+            profile[stage] = {
+                'peak_rss_mb': round(peak, 1) if peak is not None else None,
+                'start_rss_mb': round(start_rss, 1) if start_rss is not None else None,
+                'end_rss_mb': round(end_rss, 1) if end_rss is not None else None,
+                'seconds': round(elapsed, 3),
+                'per_stage_peak': per_stage
+            }
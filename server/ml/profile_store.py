@@ -0,0 +1,327 @@
+"""
+Array-backed per-user behavioral profiles for real-time scoring.
+
+Every user has one fixed-width record in a NumPy structured array: transaction
+count, amount sum, amount sum of squares, first-seen and last-seen time. A
+dict maps user IDs to record rows, so reading or updating a profile is O(1)
+however long the user's history is, replacing the per-user COUNT/SUM/MIN
+aggregation over the transactions table. With a path the records live in a
+memory-mapped .npy file and the user IDs in a small sidecar file, so a restart
+maps the records back in without reading or rebuilding them. The sidecar also
+records whether the store was closed cleanly: after a clean shutdown only the
+transactions newer than the latest profile are folded in from the database
+(reconcile_from_db); after a crash the mapped records may hold updates the
+sidecar does not know about, so the store is rebuilt from the database.
+
+    python profile_store.py --rebuild   # seed from the transactions table
+"""
+import os
+import time
+import argparse
+import threading
+from typing import Dict, List, Optional
+import joblib
+import numpy as np
+import pandas as pd
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROFILE_STORE_PATH = os.getenv("PROFILE_STORE_PATH", "trained_models/user_profiles.npy")
+
+PROFILE_DTYPE = np.dtype([
+    ('count', np.int64),
+    ('amount_sum', np.float64),
+    ('amount_sumsq', np.float64),
+    ('first_seen', np.float64),   # epoch seconds, NaN until the first transaction
+    ('last_seen', np.float64)
+])
+
+INITIAL_CAPACITY = 1024
+
+
+def _empty_records(n: int) -> np.ndarray:
+    records = np.zeros(n, dtype=PROFILE_DTYPE)
+    records['first_seen'] = np.nan
+    records['last_seen'] = np.nan
+    return records
+
+
+def _epoch_seconds(timestamps) -> np.ndarray:
+    return pd.to_datetime(pd.Series(timestamps)).to_numpy(dtype='datetime64[ns]').astype(np.int64) / 1e9
+
+
+class UserProfileStore:
+    """
+    Fixed-width profile records keyed by user ID, optionally backed by a
+    memory-mapped file. Lookups return the history before the transactions
+    being scored (as the SQL aggregation did); update() then folds them in.
+    """
+
+    def __init__(self, path: Optional[str] = None, capacity: int = INITIAL_CAPACITY):
+        self.path = path
+        self.keys: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.clean_shutdown = True
+        self._lock = threading.Lock()
+        self._last_snapshot = time.time()
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.records = np.lib.format.open_memmap(path, mode='w+', dtype=PROFILE_DTYPE, shape=(capacity,))
+            self.records[:] = _empty_records(capacity)
+        else:
+            self.records = _empty_records(capacity)
+
+    @property
+    def keys_path(self) -> str:
+        return f"{self.path}.keys.joblib"
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def memory_bytes(self) -> int:
+        """Record bytes plus the user ID map (dict entry and key string per user)"""
+        return self.records.nbytes + len(self.keys) * 150
+
+    def _grow(self):
+        """Double the record capacity; a file-backed store is remapped onto a larger file"""
+        capacity = 2 * len(self.records)
+        if self.path is None:
+            grown = _empty_records(capacity)
+            grown[:len(self.records)] = self.records
+            self.records = grown
+            return
+        tmp_path = f"{self.path}.tmp.npy"
+        grown = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=PROFILE_DTYPE, shape=(capacity,))
+        grown[:len(self.records)] = self.records
+        grown[len(self.records):] = _empty_records(capacity - len(self.records))
+        grown.flush()
+        del grown
+        self.records.flush()
+        self.records = None
+        os.replace(tmp_path, self.path)
+        self.records = np.load(self.path, mmap_mode='r+')
+
+    def _row(self, key: str) -> int:
+        row = self.rows.get(key)
+        if row is None:
+            row = len(self.keys)
+            if row == len(self.records):
+                self._grow()
+            # A row past the last saved key list may hold a record from before a crash
+            self.records[row] = _empty_records(1)[0]
+            self.rows[key] = row
+            self.keys.append(key)
+        return row
+
+    def clear(self):
+        """Drop every profile (the file keeps its capacity)"""
+        with self._lock:
+            self.keys = []
+            self.rows = {}
+            self.records[:] = _empty_records(len(self.records))
+
+    def watermark(self) -> Optional[float]:
+        """Latest transaction time folded into any profile (epoch seconds), None when empty"""
+        with self._lock:
+            last_seen = self.records['last_seen'][:len(self.keys)]
+            return float(np.nanmax(last_seen)) if len(last_seen) and not np.isnan(last_seen).all() else None
+
+    def lookup(self, keys) -> np.ndarray:
+        """Copies of the records for keys (empty records for unseen users)"""
+        with self._lock:
+            rows = np.array([self.rows.get(str(key), -1) for key in keys], dtype=np.int64)
+            result = _empty_records(len(rows))
+            known = rows >= 0
+            result[known] = self.records[rows[known]]
+            return result
+
+    def update(self, key: str, timestamp: float, amount: float):
+        """Fold one transaction into the user's record"""
+        with self._lock:
+            row = self._row(str(key))
+            records = self.records
+            records['count'][row] += 1
+            records['amount_sum'][row] += amount
+            records['amount_sumsq'][row] += amount * amount
+            records['first_seen'][row] = np.fmin(records['first_seen'][row], timestamp)
+            records['last_seen'][row] = np.fmax(records['last_seen'][row], timestamp)
+
+    def update_many(self, keys, timestamps, amounts):
+        """Fold a batch of transactions in, unbuffered so repeated users accumulate"""
+        seconds = _epoch_seconds(timestamps)
+        amounts = np.asarray(amounts, dtype=np.float64)
+        with self._lock:
+            rows = np.array([self._row(str(key)) for key in keys], dtype=np.int64)
+            records = self.records
+            np.add.at(records['count'], rows, 1)
+            np.add.at(records['amount_sum'], rows, amounts)
+            np.add.at(records['amount_sumsq'], rows, amounts * amounts)
+            np.fmin.at(records['first_seen'], rows, seconds)
+            np.fmax.at(records['last_seen'], rows, seconds)
+
+    def features(self, keys, timestamps) -> pd.DataFrame:
+        """
+        user_total_transactions, user_total_amount_spent, account_age_days and the
+        user's amount mean/std before these transactions, one row per key
+        """
+        records = self.lookup(keys)
+        count = records['count'].astype(np.float64)
+        mean = np.divide(records['amount_sum'], count, out=np.zeros(len(records)), where=count > 0)
+        variance = np.divide(records['amount_sumsq'], count, out=np.zeros(len(records)), where=count > 0) - mean ** 2
+        age_days = np.floor((_epoch_seconds(timestamps) - records['first_seen']) / 86400)
+        return pd.DataFrame({
+            'user_total_transactions': records['count'],
+            'user_total_amount_spent': records['amount_sum'],
+            'account_age_days': np.nan_to_num(age_days, nan=0.0),
+            'user_amount_mean': mean,
+            'user_amount_std': np.sqrt(np.maximum(variance, 0.0))
+        })
+
+    def add_aggregates(self, aggregates: pd.DataFrame):
+        """
+        Merge per-user aggregates (user_id, count, amount_sum, amount_sumsq,
+        first_seen, last_seen), e.g. from a grouped query over the transactions table
+        """
+        first_seen = _epoch_seconds(aggregates['first_seen'])
+        last_seen = _epoch_seconds(aggregates['last_seen'])
+        with self._lock:
+            rows = np.array([self._row(str(key)) for key in aggregates['user_id']], dtype=np.int64)
+            records = self.records
+            np.add.at(records['count'], rows, aggregates['count'].to_numpy(dtype=np.int64))
+            np.add.at(records['amount_sum'], rows, aggregates['amount_sum'].to_numpy(dtype=np.float64))
+            np.add.at(records['amount_sumsq'], rows, aggregates['amount_sumsq'].to_numpy(dtype=np.float64))
+            np.fmin.at(records['first_seen'], rows, first_seen)
+            np.fmax.at(records['last_seen'], rows, last_seen)
+
+    def _write_keys(self, clean: bool):
+        tmp_path = f"{self.keys_path}.tmp"
+        joblib.dump({'keys': self.keys, 'clean': clean}, tmp_path)
+        os.replace(tmp_path, self.keys_path)
+
+    def snapshot(self, clean: bool = False):
+        """
+        Flush the mapped records, then atomically write the user ID list;
+        clean=True marks a final snapshot taken after the last update
+        """
+        if self.path is None:
+            return
+        with self._lock:
+            self.records.flush()
+            self._write_keys(clean)
+            self._last_snapshot = time.time()
+
+    def maybe_snapshot(self, interval_seconds: float) -> bool:
+        """Snapshot if at least interval_seconds have passed since the last one"""
+        if time.time() - self._last_snapshot < interval_seconds:
+            return False
+        self.snapshot()
+        return True
+
+    @classmethod
+    def load(cls, path: str, read_only: bool = False) -> 'UserProfileStore':
+        """
+        Map a store written by snapshot() back in; no record is read up front.
+        Unless read_only, the sidecar is marked unclean until the next clean snapshot.
+        """
+        store = cls.__new__(cls)
+        store.path = path
+        saved = joblib.load(store.keys_path)
+        # Sidecars written before the clean flag hold just the key list
+        if isinstance(saved, dict):
+            store.keys, store.clean_shutdown = list(saved['keys']), bool(saved['clean'])
+        else:
+            store.keys, store.clean_shutdown = list(saved), False
+        store.rows = {key: row for row, key in enumerate(store.keys)}
+        store._lock = threading.Lock()
+        store._last_snapshot = time.time()
+        store.records = np.load(path, mmap_mode='r' if read_only else 'r+')
+        if store.records.dtype != PROFILE_DTYPE:
+            raise ValueError(f"{path} does not hold profile records")
+        if not read_only:
+            store._write_keys(clean=False)
+        return store
+
+    @classmethod
+    def open(cls, path: str) -> 'UserProfileStore':
+        """Load the store at path if one was saved, else create an empty one there"""
+        if os.path.exists(path) and os.path.exists(f"{path}.keys.joblib"):
+            return cls.load(path)
+        return cls(path)
+
+
+def _add_from_db(store: UserProfileStore, conn, since: Optional[float] = None) -> int:
+    """Add per-user aggregates of the transactions after `since` (all when None); returns transactions added"""
+    query = """
+        SELECT user_id, COUNT(*), SUM(amount), SUM(amount * amount), MIN(timestamp), MAX(timestamp)
+        FROM transactions
+    """
+    params = None
+    if since is not None:
+        query += " WHERE timestamp > %s"
+        params = (pd.Timestamp(since, unit='s').to_pydatetime(),)
+    with conn.cursor() as cur:
+        cur.execute(query + " GROUP BY user_id", params)
+        aggregates = pd.DataFrame(cur.fetchall(), columns=['user_id', 'count', 'amount_sum', 'amount_sumsq',
+                                                           'first_seen', 'last_seen'])
+    if len(aggregates):
+        store.add_aggregates(aggregates)
+    store.snapshot()
+    return int(aggregates['count'].sum()) if len(aggregates) else 0
+
+
+def seed_from_db(store: UserProfileStore, conn) -> int:
+    """Add every user's history from the transactions table (one grouped query); returns users added"""
+    _add_from_db(store, conn)
+    return len(store)
+
+
+def reconcile_from_db(store: UserProfileStore, conn) -> int:
+    """
+    Fold in the transactions written after the latest profile, e.g. while the
+    API was down or by paths that do not score; returns transactions added
+    """
+    watermark = store.watermark()
+    if watermark is None:
+        return _add_from_db(store, conn)
+    return _add_from_db(store, conn, since=watermark)
+
+
+def get_db_connection():
+    return psycopg2.connect(
+        dbname=os.getenv("DB_DATABASE"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT"),
+        connect_timeout=30
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or inspect the per-user profile store")
+    parser.add_argument('--path', default=PROFILE_STORE_PATH)
+    parser.add_argument('--rebuild', action='store_true',
+                        help="Replace the saved profiles with ones seeded from the transactions table "
+                             "(restart the API afterwards)")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        # Built beside the live files and swapped in, so a mapped store is never truncated
+        start = time.time()
+        store = UserProfileStore(f"{args.path}.rebuild.npy")
+        conn = get_db_connection()
+        try:
+            users = seed_from_db(store, conn)
+        finally:
+            conn.close()
+        store.snapshot(clean=True)
+        os.replace(store.path, args.path)
+        os.replace(store.keys_path, f"{args.path}.keys.joblib")
+        print(f"✅ Seeded {users:,} user profiles in {time.time() - start:.1f}s -> {args.path}")
+    else:
+        store = UserProfileStore.load(args.path, read_only=True)
+        print(f"📊 {len(store):,} user profiles, {store.memory_bytes() / 1e6:.1f} MB ({args.path})")
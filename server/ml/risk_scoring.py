@@ -0,0 +1,90 @@
+"""
+Vectorized risk scores stored in transactions.risk_score.
+
+The API's confidence calibration (feature confidence, threshold adjustment,
+prediction confidence and the 0.01-0.99 risk score) and the single-model base
+threshold applied to whole arrays, so the API and bulk rescoring share one
+calibration. Scores can still differ slightly for the same transaction because
+frame-level features such as amount_zscore_global are computed over the frame
+being scored (a request, a batch or a rescoring chunk).
+"""
+import numpy as np
+import pandas as pd
+
+from evaluation_metrics import DEFAULT_CONTAMINATION
+
+
+def _column(df: pd.DataFrame, name: str, default: float = np.nan) -> np.ndarray:
+    if name in df.columns:
+        return pd.to_numeric(df[name], errors='coerce').to_numpy(dtype=np.float64)
+    return np.full(len(df), default)
+
+
+def feature_confidences(df: pd.DataFrame) -> np.ndarray:
+    """Confidence from feature quality and completeness, per row in [0.3, 0.95]"""
+    confidence = np.fmax(0.5, _column(df, 'risk_confidence_score'))
+
+    # Behavioral consistency boosts confidence
+    if 'device_consistency_score' in df.columns and 'location_consistency_score' in df.columns:
+        behavioral_consistency = (_column(df, 'device_consistency_score') + _column(df, 'location_consistency_score')) / 2
+        confidence = confidence + behavioral_consistency * 0.15
+
+    # More confident during business hours and for normal amounts
+    confidence = confidence + np.where(_column(df, 'is_business_hours') == 1, 0.05, 0.0)
+    confidence = confidence + np.where(_column(df, 'is_amount_outlier') == 0, 0.05, 0.0)
+    return np.minimum(0.95, np.fmax(0.3, confidence))
+
+
+def single_model_threshold(model, score_quantiles: np.ndarray = None) -> float:
+    """
+    Base threshold for a single detector: its training score quantile at the
+    contamination target, else the detector's own fitted offset_
+    """
+    if score_quantiles is not None:
+        return float(np.interp(DEFAULT_CONTAMINATION, np.linspace(0, 1, len(score_quantiles)), score_quantiles))
+    return float(model.offset_)
+
+
+def adjusted_thresholds(thresholds: np.ndarray, feature_confidences: np.ndarray) -> np.ndarray:
+    """
+    Base thresholds moved by up to 10% of their magnitude with feature
+    confidence, lower (fewer flags) for confident rows. Applied in score space,
+    so it moves the same way for negative raw scores and [0, 1] rank scores.
+    """
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    return thresholds - np.abs(thresholds) * (np.asarray(feature_confidences) - 0.5) * 0.2
+
+
+def prediction_confidences(scores: np.ndarray, thresholds: np.ndarray, feature_confidences: np.ndarray,
+                           df: pd.DataFrame) -> np.ndarray:
+    """Overall prediction confidence per row, targeting 88-93%"""
+    scores = np.asarray(scores, dtype=np.float64)
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+
+    # Model separation and feature quality
+    separation_confidence = np.minimum(0.4, np.abs(scores - thresholds) / np.abs(thresholds) * 0.3)
+    feature_boost = np.asarray(feature_confidences) * 0.3
+
+    # Clear behavioral risk (high or low) means a confident call
+    behavioral_confidence = np.zeros(len(scores))
+    if 'composite_risk_score' in df.columns:
+        composite = _column(df, 'composite_risk_score')
+        behavioral_confidence = np.where((composite > 0.7) | (composite < 0.3), 0.15, 0.05)
+
+    # Well understood Malawi patterns: paydays, market days, cultural context
+    malawi_confidence = (np.where(_column(df, 'is_payday') == 1, 0.05, 0.0)
+                         + np.where(_column(df, 'is_market_day') == 1, 0.03, 0.0)
+                         + (0.02 if 'cultural_risk_modifier' in df.columns else 0.0))
+
+    total = 0.65 + separation_confidence + feature_boost + behavioral_confidence + malawi_confidence
+    return np.minimum(0.93, np.fmax(0.88, total))
+
+
+def enhanced_risk_scores(scores: np.ndarray, thresholds: np.ndarray, confidences: np.ndarray) -> np.ndarray:
+    """Risk in [0.01, 0.99]: above 0.7 for anomalies, below 0.3 for normal rows, nudged by confidence"""
+    scores = np.asarray(scores, dtype=np.float64)
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    distance = np.abs(thresholds - scores) / np.abs(thresholds) * 0.25
+    base_risk = np.where(scores <= thresholds, 0.7 + distance, 0.3 - distance)
+    final_risk = base_risk + (np.asarray(confidences) - 0.5) * 0.1
+    return np.clip(final_risk, 0.01, 0.99)
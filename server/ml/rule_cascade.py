@@ -0,0 +1,252 @@
+"""
+Tier-1 rules that settle clearly normal or clearly anomalous transactions
+before the context queries, feature engineering and model scoring run.
+
+Rules read raw request fields only:
+
+- clearly normal: the amount inside its transaction_type's usual band (between
+  the CASCADE_FLOOR_QUANTILE and CASCADE_NORMAL_QUANTILE training amounts), a
+  known device and location, and an hour inside CASCADE_NORMAL_HOURS
+- clearly anomalous: an amount above the type's CASCADE_ANOMALY_QUANTILE
+  training amount together with a new device, a new location or an hour
+  outside CASCADE_NORMAL_HOURS
+
+Each rule is checked against the served detector on the training rows and
+only enabled for a transaction type when the model agreed with it on at least
+CASCADE_MIN_AGREEMENT (normal) or CASCADE_MIN_ANOMALY_AGREEMENT (anomalous)
+of the rows it fired on. Settled rows are reported with the median model score
+and threshold of the training rows the rule settled; everything else (and any
+type without an enabled rule) goes to the full pipeline.
+"""
+import os
+import threading
+from typing import Any, Dict, Tuple
+import numpy as np
+import pandas as pd
+
+TIER_MODEL = 0
+TIER_NORMAL = 1
+TIER_ANOMALY = 2
+TIER_NAMES = {TIER_MODEL: 'model', TIER_NORMAL: 'rules_normal', TIER_ANOMALY: 'rules_anomaly'}
+
+CASCADE_FLOOR_QUANTILE = float(os.getenv("CASCADE_FLOOR_QUANTILE", "0.05"))
+CASCADE_NORMAL_QUANTILE = float(os.getenv("CASCADE_NORMAL_QUANTILE", "0.75"))
+CASCADE_ANOMALY_QUANTILE = float(os.getenv("CASCADE_ANOMALY_QUANTILE", "0.999"))
+# Inclusive local hours treated as ordinary activity, e.g. "6-21"
+CASCADE_NORMAL_HOURS = tuple(int(hour) for hour in os.getenv("CASCADE_NORMAL_HOURS", "6-21").split("-"))
+CASCADE_MIN_AGREEMENT = float(os.getenv("CASCADE_MIN_AGREEMENT", "0.995"))
+CASCADE_MIN_ANOMALY_AGREEMENT = float(os.getenv("CASCADE_MIN_ANOMALY_AGREEMENT", "0.9"))
+# Training rows a transaction type (and each rule within it) needs before it is trusted
+CASCADE_MIN_TYPE_ROWS = int(os.getenv("CASCADE_MIN_TYPE_ROWS", "500"))
+CASCADE_MIN_RULE_ROWS = int(os.getenv("CASCADE_MIN_RULE_ROWS", "20"))
+
+RULE_COLUMNS = ['amount', 'transaction_type', 'transaction_hour_of_day', 'is_new_device', 'is_new_location']
+
+
+def rule_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """The raw fields the rules read, hour filled from the timestamp where missing"""
+    frame = df.reindex(columns=RULE_COLUMNS).reset_index(drop=True)
+    if 'timestamp' in df.columns:
+        hours = pd.to_datetime(df['timestamp']).dt.hour.to_numpy()
+        frame['transaction_hour_of_day'] = frame['transaction_hour_of_day'].fillna(pd.Series(hours))
+    frame['transaction_type'] = frame['transaction_type'].astype('category')
+    return frame
+
+
+def _flags(df: pd.DataFrame, column: str) -> Tuple[np.ndarray, np.ndarray]:
+    """(explicitly true, explicitly false) per row; missing values are neither"""
+    if column not in df.columns:
+        return np.zeros(len(df), dtype=bool), np.zeros(len(df), dtype=bool)
+    values = df[column]
+    return values.eq(True).to_numpy(), values.eq(False).to_numpy()
+
+
+class RuleCascade:
+    """Per-transaction_type amount bands with the agreement each rule reached against the model"""
+
+    def __init__(self, rules: Dict[str, Dict[str, Any]], normal_hours: Tuple[int, int] = CASCADE_NORMAL_HOURS):
+        self.rules = rules
+        self.normal_hours = tuple(normal_hours)
+        self.training_hit_rates = {}
+        self._build_lookup()
+
+    def _build_lookup(self):
+        """Per-type arrays indexed by transaction_type code, so rules run vectorized"""
+        self.types = list(self.rules)
+        lookup = pd.DataFrame.from_dict(self.rules, orient='index').reindex(columns=[
+            'floor', 'normal_cap', 'anomaly_amount', 'normal', 'anomaly',
+            'normal_score', 'normal_threshold', 'anomaly_score', 'anomaly_threshold'
+        ])
+        column = lambda name: lookup[name].to_numpy(dtype=np.float64)
+        self.floors = column('floor')
+        self.normal_caps = column('normal_cap')
+        self.anomaly_amounts = column('anomaly_amount')
+        self.normal_enabled = column('normal') == 1
+        self.anomaly_enabled = column('anomaly') == 1
+        self.settled = {TIER_NORMAL: (column('normal_score'), column('normal_threshold')),
+                        TIER_ANOMALY: (column('anomaly_score'), column('anomaly_threshold'))}
+
+    def _codes(self, df: pd.DataFrame) -> np.ndarray:
+        """Position of each row's transaction_type in self.types, -1 when unknown"""
+        return pd.Categorical(df['transaction_type'].astype(object), categories=self.types).codes
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.normal_enabled.any() or self.anomaly_enabled.any())
+
+    def tiers(self, df: pd.DataFrame) -> np.ndarray:
+        """TIER_NORMAL / TIER_ANOMALY for rows an enabled rule settles, TIER_MODEL otherwise"""
+        tiers = np.full(len(df), TIER_MODEL, dtype=np.int8)
+        if not len(df) or not self.types or 'transaction_type' not in df.columns:
+            return tiers
+        codes = self._codes(df)
+        known = codes >= 0
+        codes = np.where(known, codes, 0)
+        amount = pd.to_numeric(df['amount'], errors='coerce').to_numpy(dtype=np.float64)
+        hour = (pd.to_numeric(df['transaction_hour_of_day'], errors='coerce').to_numpy(dtype=np.float64)
+                if 'transaction_hour_of_day' in df.columns else np.full(len(df), np.nan))
+        new_device, known_device = _flags(df, 'is_new_device')
+        new_location, known_location = _flags(df, 'is_new_location')
+
+        start, end = self.normal_hours
+        in_hours = (hour >= start) & (hour <= end)
+        off_hours = ~np.isnan(hour) & ~in_hours
+        normal = (known & self.normal_enabled[codes] & (amount >= self.floors[codes])
+                  & (amount <= self.normal_caps[codes]) & known_device & known_location & in_hours)
+        anomaly = (known & self.anomaly_enabled[codes] & (amount >= self.anomaly_amounts[codes])
+                   & (new_device | new_location | off_hours))
+        tiers[normal] = TIER_NORMAL
+        tiers[anomaly] = TIER_ANOMALY
+        return tiers
+
+    def settled_scores(self, df: pd.DataFrame, tiers: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Reported anomaly score and base threshold per settled row (NaN for TIER_MODEL rows)"""
+        scores = np.full(len(df), np.nan)
+        thresholds = np.full(len(df), np.nan)
+        if not (tiers != TIER_MODEL).any():
+            return scores, thresholds
+        codes = self._codes(df)
+        for tier, (tier_scores, tier_thresholds) in self.settled.items():
+            rows = tiers == tier
+            scores[rows] = tier_scores[codes[rows]]
+            thresholds[rows] = tier_thresholds[codes[rows]]
+        return scores, thresholds
+
+    def describe(self, transaction_type: str, tier: int) -> str:
+        rule = self.rules[transaction_type]
+        start, end = self.normal_hours
+        if tier == TIER_NORMAL:
+            return (f"{transaction_type} amount within {rule['floor']:,.0f}-{rule['normal_cap']:,.0f} MWK, "
+                    f"known device and location, {start:02d}:00-{end:02d}:59")
+        return (f"{transaction_type} amount above {rule['anomaly_amount']:,.0f} MWK with a new device, "
+                f"new location or a transaction outside {start:02d}:00-{end:02d}:59")
+
+    @classmethod
+    def fit(cls, frame: pd.DataFrame, scores: np.ndarray, thresholds: np.ndarray,
+            min_type_rows: int = CASCADE_MIN_TYPE_ROWS) -> 'RuleCascade':
+        """
+        Amount bands per transaction type from the training rows in frame
+        (see rule_frame), validated against the served detector's training
+        scores and thresholds for the same rows
+        """
+        frame = frame.reset_index(drop=True)
+        scores = np.asarray(scores, dtype=np.float64)
+        thresholds = np.asarray(thresholds, dtype=np.float64)
+        flagged = scores <= thresholds
+        amounts = pd.to_numeric(frame['amount'], errors='coerce')
+        types = frame['transaction_type'].astype(object)
+
+        rules = {}
+        for transaction_type, type_amounts in amounts.groupby(types, observed=True):
+            type_amounts = type_amounts.dropna()
+            if len(type_amounts) < min_type_rows:
+                continue
+            floor, normal_cap, anomaly_amount = np.quantile(
+                type_amounts, [CASCADE_FLOOR_QUANTILE, CASCADE_NORMAL_QUANTILE, CASCADE_ANOMALY_QUANTILE]
+            )
+            rules[str(transaction_type)] = {'rows': int(len(type_amounts)), 'floor': float(floor),
+                                            'normal_cap': float(normal_cap), 'anomaly_amount': float(anomaly_amount),
+                                            'normal': True, 'anomaly': True}
+
+        # Fire every candidate rule on the training rows and keep those the model agrees with
+        cascade = cls(rules)
+        tiers = cascade.tiers(frame)
+        type_values = types.to_numpy()
+        for transaction_type, rule in rules.items():
+            in_type = type_values == transaction_type
+            for tier, prefix, agree, minimum in ((TIER_NORMAL, 'normal', ~flagged, CASCADE_MIN_AGREEMENT),
+                                                 (TIER_ANOMALY, 'anomaly', flagged, CASCADE_MIN_ANOMALY_AGREEMENT)):
+                hits = in_type & (tiers == tier)
+                agreement = float(agree[hits].mean()) if hits.any() else 0.0
+                rule[f'{prefix}_rows'] = int(hits.sum())
+                rule[f'{prefix}_agreement'] = round(agreement, 4)
+                rule[prefix] = bool(hits.sum() >= CASCADE_MIN_RULE_ROWS and agreement >= minimum)
+                agreeing = hits & agree
+                rule[f'{prefix}_score'] = float(np.median(scores[agreeing])) if agreeing.any() else None
+                rule[f'{prefix}_threshold'] = float(np.median(thresholds[agreeing])) if agreeing.any() else None
+        cascade._build_lookup()
+
+        tiers = cascade.tiers(frame)
+        cascade.training_hit_rates = {TIER_NAMES[tier]: round(float((tiers == tier).mean()), 4)
+                                      for tier in TIER_NAMES} if len(frame) else {}
+        return cascade
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'normal_hours': list(self.normal_hours),
+            'training_hit_rates': self.training_hit_rates,
+            'rules': self.rules
+        }
+
+
+class CascadeStats:
+    """Running tier hit counts and per-row latency of the rule tier and the model path"""
+
+    def __init__(self):
+        self.rows = np.zeros(len(TIER_NAMES), dtype=np.int64)
+        self.rule_seconds = 0.0
+        self.model_rows = 0
+        self.model_seconds = 0.0
+        self.shadow_rows = np.zeros(len(TIER_NAMES), dtype=np.int64)
+        self.shadow_agreed = np.zeros(len(TIER_NAMES), dtype=np.int64)
+        self._lock = threading.Lock()
+
+    def record(self, tiers: np.ndarray, rule_seconds: float, model_rows: int = 0, model_seconds: float = 0.0):
+        with self._lock:
+            self.rows += np.bincount(tiers, minlength=len(TIER_NAMES))
+            self.rule_seconds += rule_seconds
+            self.model_rows += model_rows
+            self.model_seconds += model_seconds
+
+    def record_shadow(self, tiers: np.ndarray, is_anomaly: np.ndarray):
+        """Model decisions for rows the rules would have settled (shadow mode)"""
+        is_anomaly = np.asarray(is_anomaly, dtype=bool)
+        with self._lock:
+            for tier, expected in ((TIER_NORMAL, False), (TIER_ANOMALY, True)):
+                hits = tiers == tier
+                self.shadow_rows[tier] += int(hits.sum())
+                self.shadow_agreed[tier] += int((is_anomaly[hits] == expected).sum())
+
+    def report(self, mode: str) -> Dict[str, Any]:
+        with self._lock:
+            rows = self.rows.copy()
+            total = int(rows.sum())
+            rule_ms = self.rule_seconds * 1000 / total if total else 0.0
+            model_ms = self.model_seconds * 1000 / self.model_rows if self.model_rows else 0.0
+            settled = int(rows[TIER_NORMAL] + rows[TIER_ANOMALY])
+            report = {
+                'rows': total,
+                'hit_rates': {TIER_NAMES[tier]: round(float(rows[tier] / total), 4) if total else 0.0
+                              for tier in TIER_NAMES},
+                'counts': {TIER_NAMES[tier]: int(rows[tier]) for tier in TIER_NAMES},
+                'rule_ms_per_row': round(rule_ms, 4),
+                'model_ms_per_row': round(model_ms, 4),
+                # Settled rows times what the model path costs per row; in shadow mode what would be saved
+                'estimated_latency_saved_ms': round(settled * max(model_ms - rule_ms, 0.0), 1)
+            }
+            if mode == 'shadow':
+                report['shadow_agreement'] = {
+                    TIER_NAMES[tier]: round(float(self.shadow_agreed[tier] / self.shadow_rows[tier]), 4)
+                    if self.shadow_rows[tier] else None for tier in (TIER_NORMAL, TIER_ANOMALY)
+                }
+        return report
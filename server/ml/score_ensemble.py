@@ -0,0 +1,149 @@
+"""
+Rank-normalized ensemble of fitted anomaly detectors.
+
+Each member's score_samples output is mapped to its position in that member's
+own training score distribution (stored as quantiles), so detectors on very
+different scales become comparable values in [0, 1] where low means anomalous.
+The ensemble score is a weighted mean of those ranks, with weights learned from
+each member's evaluation score computed on its ranks (so no member wins just
+because its raw scores are on a larger scale). A batch is scored in one vectorized
+pass: every member scores the whole matrix once, normalization is one
+np.interp per member and the combination is a single matrix-vector product.
+Per-member timings and a redundancy measure are kept so expensive members that
+add little signal can be dropped.
+"""
+import time
+from typing import Any, Callable, Dict, List
+import numpy as np
+
+from evaluation_metrics import DEFAULT_CONTAMINATION
+
+QUANTILE_POINTS = np.linspace(0, 1, 101)
+
+
+def rank_normalize(scores: np.ndarray, quantiles: np.ndarray) -> np.ndarray:
+    """Approximate share of training scores below each score (0 = most anomalous)"""
+    return np.interp(scores, quantiles, np.linspace(0, 1, len(quantiles)))
+
+
+class ScoreEnsemble:
+    """Weighted ensemble over rank-normalized member scores"""
+
+    def __init__(self, members: Dict[str, Any], contamination: float = DEFAULT_CONTAMINATION):
+        self.members = dict(members)
+        self.contamination = contamination
+        self.quantiles = {}
+        self.weights = {}
+        self.threshold = None
+        self.member_stats = {}
+
+    @property
+    def member_names(self) -> List[str]:
+        return list(self.members)
+
+    def fit(self, X: np.ndarray, training_scores: Dict[str, np.ndarray],
+            quality_function: Callable[[np.ndarray, np.ndarray], float],
+            X_timing: np.ndarray = None) -> 'ScoreEnsemble':
+        """
+        Learn each member's score quantiles and weight from its scores on the
+        training rows X. quality_function(X, ranks) rates a member from its
+        rank-normalized scores and weights are proportional to the (positive)
+        ratings; X_timing, when given, is scored once to record the per-member
+        cost in ms per 1,000 rows.
+        """
+        self.quantiles = {name: np.quantile(training_scores[name], QUANTILE_POINTS) for name in self.members}
+        ranks = np.column_stack([rank_normalize(training_scores[name], self.quantiles[name]) for name in self.members])
+        self._fit_weights(X, ranks, quality_function)
+        if X_timing is not None:
+            _, _, timings = self.score(X_timing)
+            for name, seconds in timings.items():
+                self.member_stats[name]['ms_per_1k_rows'] = round(seconds * 1000 / len(X_timing) * 1000, 3)
+        return self
+
+    def reweight(self, X: np.ndarray, quality_function: Callable[[np.ndarray, np.ndarray], float]) -> 'ScoreEnsemble':
+        """
+        Relearn the weights and threshold on rows X with the current members and
+        quantiles, e.g. after a member was refreshed; per-member timings are kept
+        """
+        timings = {name: stats['ms_per_1k_rows'] for name, stats in self.member_stats.items()
+                   if 'ms_per_1k_rows' in stats}
+        _, ranks, _ = self.score(X)
+        self._fit_weights(X, ranks, quality_function)
+        for name, ms in timings.items():
+            self.member_stats[name]['ms_per_1k_rows'] = ms
+        return self
+
+    def _fit_weights(self, X: np.ndarray, ranks: np.ndarray, quality_function: Callable[[np.ndarray, np.ndarray], float]):
+        """Weights, threshold and member stats from the (n_rows, n_members) rank matrix of rows X"""
+        quality = {name: float(quality_function(X, ranks[:, position])) for position, name in enumerate(self.members)}
+        raw_weights = {name: max(quality[name], 0.0) for name in self.members}
+        total = sum(raw_weights.values())
+        self.weights = {
+            name: weight / total if total > 0 else 1.0 / len(self.members) for name, weight in raw_weights.items()
+        }
+
+        combined = ranks @ self._weight_vector()
+        self.threshold = float(np.quantile(combined, self.contamination))
+
+        # Correlation with the mean of the other members: close to 1 means the member is redundant
+        self.member_stats = {}
+        for position, name in enumerate(self.members):
+            others = np.delete(ranks, position, axis=1)
+            if others.shape[1] and ranks[:, position].std() > 0 and others.mean(axis=1).std() > 0:
+                redundancy = float(np.corrcoef(ranks[:, position], others.mean(axis=1))[0, 1])
+            else:
+                redundancy = 0.0
+            self.member_stats[name] = {
+                'weight': round(self.weights[name], 4),
+                'quality': round(quality[name], 4),
+                'redundancy': round(redundancy, 4)
+            }
+
+    def _weight_vector(self) -> np.ndarray:
+        return np.array([self.weights[name] for name in self.members])
+
+    def score(self, X: np.ndarray):
+        """
+        Ensemble scores for every row of X plus the (n_rows, n_members) rank
+        matrix and each member's scoring time in seconds.
+        """
+        X = np.asarray(X, dtype=np.float64)
+        ranks = np.empty((len(X), len(self.members)))
+        timings = {}
+        for position, (name, model) in enumerate(self.members.items()):
+            start = time.perf_counter()
+            ranks[:, position] = rank_normalize(model.score_samples(X), self.quantiles[name])
+            timings[name] = time.perf_counter() - start
+        return ranks @ self._weight_vector(), ranks, timings
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """+1 for inliers, -1 for outliers"""
+        scores, _, _ = self.score(X)
+        return np.where(scores <= self.threshold, -1, 1)
+
+    def drop(self, names: List[str]) -> 'ScoreEnsemble':
+        """
+        Copy without the named members. Remaining weights are renormalized and
+        the threshold is kept, which is approximate until the ensemble is refitted.
+        """
+        kept = {name: model for name, model in self.members.items() if name not in set(names)}
+        if not kept:
+            raise ValueError("Cannot drop every ensemble member")
+        pruned = ScoreEnsemble(kept, self.contamination)
+        total = sum(self.weights[name] for name in kept)
+        pruned.quantiles = {name: self.quantiles[name] for name in kept}
+        pruned.weights = {
+            name: self.weights[name] / total if total > 0 else 1.0 / len(kept) for name in kept
+        }
+        pruned.threshold = self.threshold
+        pruned.member_stats = {name: dict(self.member_stats.get(name, {}), weight=round(pruned.weights[name], 4))
+                               for name in kept}
+        return pruned
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'members': self.member_names,
+            'threshold': self.threshold,
+            'contamination': self.contamination,
+            'member_stats': self.member_stats
+        }
@@ -0,0 +1,349 @@
+"""
+Offline scoring of exported transaction files without touching the database.
+
+CSV, JSON Lines, JSON arrays (e.g. realistic_malawi_transactions.json from
+generate_data.py) and Parquet files are read in fixed-size chunks: CSV and
+JSON Lines through pandas' chunked readers, Parquet by record batches, and JSON
+arrays by a streaming decoder that parses one object at a time from 1 MB
+blocks, so no input is ever loaded whole.
+
+Each chunk gets the columns and time fields the API derives, plus sender
+velocity from a SenderVelocityStore advanced row by row in file order (as
+/predict/batch does), then goes to a process pool where every worker loads the
+model artifact once and scores with the same feature engineering, Preprocessor
+and model routing as api.py (artifact_scoring.ArtifactScorer). Results are
+appended to the output in input order as chunks finish; at most 2 x workers
+chunks are in flight, so memory stays flat whatever the file size.
+
+    python score_file.py realistic_malawi_transactions.json scored.csv --workers 4
+"""
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Dict, Iterator, Optional, Tuple
+import pandas as pd
+
+from artifact_scoring import ArtifactScorer, MODEL_PATH
+from streaming_loader import TRANSACTION_COLUMNS, BOOLEAN_COLUMNS
+from velocity_store import SenderVelocityStore
+from memory_tracking import current_rss_mb, peak_rss_mb
+
+SCORE_FILE_CHUNK_SIZE = int(os.getenv("SCORE_FILE_CHUNK_SIZE", "20000"))
+SCORE_FILE_WORKERS = int(os.getenv("SCORE_FILE_WORKERS", "0")) or os.cpu_count() or 1
+# Characters read per block by the streaming JSON array decoder
+JSON_READ_BLOCK_CHARS = 1 << 20
+
+# Export column names -> model input names (telco_provider -> network_operator)
+COLUMN_ALIASES = {expression: name for expression, name in TRANSACTION_COLUMNS if expression != name}
+INPUT_COLUMNS = ['transaction_id'] + [name for _, name in TRANSACTION_COLUMNS]
+OUTPUT_COLUMNS = ['transaction_id', 'anomaly_score', 'threshold', 'is_anomaly', 'risk_score', 'model']
+# Identifier-like columns kept as text so leading zeros and MSISDNs survive parsing
+TEXT_COLUMNS = ['transaction_id', 'user_id', 'sender_account', 'receiver_account', 'sender_msisdn', 'receiver_msisdn']
+BOOLEAN_VALUES = {'t': True, 'true': True, '1': True, 'yes': True, 'f': False, 'false': False, '0': False, 'no': False}
+
+
+def file_format(path: str) -> str:
+    """'csv', 'jsonl', 'json' or 'parquet' from the file extension (a trailing .gz is ignored)"""
+    name = path.lower()
+    if name.endswith('.gz'):
+        name = name[:-3]
+    extension = os.path.splitext(name)[1]
+    formats = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.json': 'json',
+               '.parquet': 'parquet', '.pq': 'parquet'}
+    if extension not in formats:
+        raise ValueError(f"Unsupported file type '{extension}' for {path} (expected csv, json, jsonl or parquet)")
+    return formats[extension]
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        return pyarrow
+    except ImportError:
+        raise ImportError("Parquet files need pyarrow: pip install pyarrow") from None
+
+
+def iter_json_array(path: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+    """
+    Frames of up to chunk_size objects from a file holding one JSON array,
+    decoding one element at a time so only the current block and chunk are in memory
+    """
+    decoder = json.JSONDecoder()
+    with open(path, encoding='utf-8') as f:
+        buffer = f.read(JSON_READ_BLOCK_CHARS).lstrip()
+        if not buffer.startswith('['):
+            raise ValueError(f"{path} does not hold a JSON array")
+        position = 1
+        records = []
+        eof = False
+        while True:
+            # Skip separators; refill when the buffer runs out
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position >= len(buffer):
+                if eof:
+                    raise ValueError(f"{path}: unexpected end of file inside the JSON array")
+                buffer, position = f.read(JSON_READ_BLOCK_CHARS), 0
+                eof = not buffer
+                continue
+            if buffer[position] == ']':
+                break
+            try:
+                record, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # Element cut at the block boundary: keep its start and read more
+                more = f.read(JSON_READ_BLOCK_CHARS)
+                if not more:
+                    raise
+                buffer, position = buffer[position:] + more, 0
+                continue
+            records.append(record)
+            position = end
+            if len(records) >= chunk_size:
+                yield pd.DataFrame.from_records(records)
+                records = []
+        if records:
+            yield pd.DataFrame.from_records(records)
+
+
+def iter_file_chunks(path: str, chunk_size: int = SCORE_FILE_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """Raw frames of up to chunk_size rows from a CSV, JSON, JSON Lines or Parquet file"""
+    kind = file_format(path)
+    if kind == 'csv':
+        yield from pd.read_csv(path, chunksize=chunk_size, dtype={column: str for column in TEXT_COLUMNS})
+    elif kind == 'jsonl':
+        yield from pd.read_json(path, lines=True, chunksize=chunk_size, dtype=False)
+    elif kind == 'parquet':
+        pyarrow = _import_pyarrow()
+        for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        with open(path, encoding='utf-8') as f:
+            first = f.read(4096).lstrip()[:1]
+        # A .json export is either one array or one object per line
+        if first == '[':
+            yield from iter_json_array(path, chunk_size)
+        else:
+            yield from pd.read_json(path, lines=True, chunksize=chunk_size, dtype=False)
+
+
+def _coerce_boolean(values: pd.Series) -> pd.Series:
+    if values.dtype == bool:
+        return values
+    return values.map(lambda value: value if isinstance(value, bool) or value is None
+                      else BOOLEAN_VALUES.get(str(value).strip().lower()))
+
+
+def prepare_chunk(raw: pd.DataFrame, first_row: int, velocity_store: Optional[SenderVelocityStore]) -> pd.DataFrame:
+    """
+    Model input columns for a raw file chunk: aliases renamed, missing columns
+    added empty, time fields derived as the API does and sender velocity from
+    the store. Rows without a parseable timestamp or amount are dropped; the
+    index is kept so they can be matched back to raw.
+    """
+    df = raw.rename(columns=COLUMN_ALIASES).reindex(columns=INPUT_COLUMNS)
+    if df['transaction_id'].isna().any():
+        # Files without ids are reported by 1-based row number
+        row_numbers = pd.Series(range(first_row + 1, first_row + len(df) + 1), index=df.index).astype(str)
+        df['transaction_id'] = df['transaction_id'].fillna(row_numbers)
+    for column in TEXT_COLUMNS:
+        df[column] = df[column].astype(object).where(df[column].notna(), None)
+        df[column] = df[column].map(lambda value: value if value is None else str(value))
+    for column in BOOLEAN_COLUMNS:
+        df[column] = _coerce_boolean(df[column])
+    df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
+
+    timestamps = pd.to_datetime(df['timestamp'], errors='coerce', format='mixed', utc=True)
+    # Offsets are normalized to UTC so files mixing offsets parse
+    df['timestamp'] = timestamps.dt.tz_localize(None)
+    valid = df['timestamp'].notna() & df['amount'].notna()
+    if not valid.all():
+        df = df[valid].copy()
+    df['transaction_hour_of_day'] = df['timestamp'].dt.hour
+    df['transaction_day_of_week'] = df['timestamp'].dt.dayofweek
+    df['is_weekend'] = df['transaction_day_of_week'].isin([5, 6]).astype(bool)
+    df['is_business_hours'] = df['transaction_hour_of_day'].between(8, 17).astype(bool)
+
+    # Velocity counters advance row by row in file order, like /predict/batch
+    if velocity_store is not None:
+        keys = df['sender_account'].where(df['sender_account'].notna(), df['user_id']).fillna('unknown')
+        velocity_rows = [
+            velocity_store.update(key, timestamp.timestamp(), float(amount))
+            for key, timestamp, amount in zip(keys, df['timestamp'], df['amount'])
+        ]
+        velocity = pd.DataFrame(velocity_rows, index=df.index)
+        for feature in velocity.columns:
+            df[feature] = velocity[feature]
+    return df
+
+
+class ScoredFileWriter:
+    """Appends scored chunks to a CSV, JSON Lines or Parquet file, written to a .partial file until closed"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.kind = file_format(path)
+        if self.kind == 'json':
+            self.kind = 'jsonl'  # One object per line keeps appends streaming
+        self.partial_path = f"{path}.partial"
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.rows = 0
+        self._file = None
+        self._parquet = None
+        if self.kind == 'parquet':
+            self._pyarrow = _import_pyarrow()
+        else:
+            self._file = open(self.partial_path, 'w', encoding='utf-8', newline='')
+
+    def write(self, frame: pd.DataFrame):
+        if self.kind == 'csv':
+            frame.to_csv(self._file, header=self.rows == 0, index=False)
+        elif self.kind == 'jsonl':
+            if len(frame):
+                text = frame.to_json(orient='records', lines=True, date_format='iso')
+                self._file.write(text if text.endswith('\n') else text + '\n')
+        else:
+            table = self._pyarrow.Table.from_pandas(
+                frame, schema=self._parquet.schema if self._parquet else None, preserve_index=False
+            )
+            if self._parquet is None:
+                self._parquet = self._pyarrow.parquet.ParquetWriter(self.partial_path, table.schema)
+            self._parquet.write_table(table)
+        self.rows += len(frame)
+
+    def close(self, completed: bool = True):
+        if self._file is not None:
+            self._file.close()
+        if self._parquet is not None:
+            self._parquet.close()
+        if completed and os.path.exists(self.partial_path):
+            os.replace(self.partial_path, self.path)
+
+
+_worker_scorer = None
+
+
+def _init_worker(model_path: str):
+    global _worker_scorer
+    _worker_scorer = ArtifactScorer.load(model_path)
+
+
+def _score_chunk(chunk_index: int, chunk: pd.DataFrame) -> Tuple[int, pd.DataFrame, float]:
+    """Worker task: (chunk index, scored frame in chunk row order, seconds)"""
+    start = time.perf_counter()
+    transaction_ids = chunk['transaction_id'].to_numpy()
+    scored = _worker_scorer.score(chunk)
+    scored.insert(0, 'transaction_id', transaction_ids)
+    scored['anomaly_score'] = scored['anomaly_score'].round(6)
+    scored['threshold'] = scored['threshold'].round(6)
+    scored['risk_score'] = scored['risk_score'].round(2)
+    return chunk_index, scored[OUTPUT_COLUMNS], time.perf_counter() - start
+
+
+def _with_input(scored: pd.DataFrame, raw: pd.DataFrame) -> pd.DataFrame:
+    """Scores followed by the row's original columns (prefixed input_ where names clash)"""
+    raw = raw.reset_index(drop=True)
+    raw.columns = [f"input_{column}" if column in OUTPUT_COLUMNS else column for column in raw.columns]
+    return pd.concat([scored.reset_index(drop=True), raw], axis=1)
+
+
+def score_file(input_path: str, output_path: str, model_path: str = MODEL_PATH,
+               chunk_size: int = SCORE_FILE_CHUNK_SIZE, workers: int = SCORE_FILE_WORKERS,
+               include_input: bool = False, use_velocity: bool = True) -> Dict[str, Any]:
+    """Score every row of input_path into output_path and return the run summary"""
+    if not os.path.exists(input_path):
+        raise FileNotFoundError(input_path)
+    if os.path.abspath(input_path) == os.path.abspath(output_path):
+        raise ValueError("Output path must differ from the input path")
+
+    velocity_store = SenderVelocityStore.from_env() if use_velocity else None
+    writer = ScoredFileWriter(output_path)
+    executor = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(model_path,)) if workers > 1 else None
+    if executor is None:
+        _init_worker(model_path)
+    print(f"📄 Scoring {input_path} -> {output_path} with {model_path} on {workers} worker(s), "
+          f"{chunk_size:,}-row chunks")
+
+    start = time.perf_counter()
+    summary = {'input': input_path, 'output': output_path, 'model': model_path,
+               'rows_read': 0, 'rows_scored': 0, 'rows_skipped': 0, 'anomalies': 0}
+    raw_chunks = {}  # chunk index -> original rows, kept only with include_input
+    finished = {}
+    next_to_write = 0
+
+    def record(chunk_index: int, scored: pd.DataFrame, seconds: float):
+        nonlocal next_to_write
+        finished[chunk_index] = scored
+        # Write in input order: only the contiguous prefix of finished chunks
+        while next_to_write in finished:
+            frame = finished.pop(next_to_write)
+            if include_input:
+                frame = _with_input(frame, raw_chunks.pop(next_to_write))
+            writer.write(frame)
+            summary['rows_scored'] += len(frame)
+            summary['anomalies'] += int(frame['is_anomaly'].sum())
+            next_to_write += 1
+        elapsed = time.perf_counter() - start
+        rss = current_rss_mb()
+        print(f"   ...scored {summary['rows_scored']:,} rows ({summary['rows_scored'] / max(elapsed, 1e-9):,.0f} rows/sec, "
+              f"chunk {len(scored):,} rows in {seconds:.2f}s"
+              + (f", RSS {rss:,.0f} MB)" if rss is not None else ")"))
+
+    completed = False
+    try:
+        pending = set()
+        max_pending = workers * 2
+        for chunk_index, raw in enumerate(iter_file_chunks(input_path, chunk_size)):
+            chunk = prepare_chunk(raw, summary['rows_read'], velocity_store)
+            summary['rows_read'] += len(raw)
+            summary['rows_skipped'] += len(raw) - len(chunk)
+            if include_input:
+                raw_chunks[chunk_index] = raw.loc[chunk.index]
+            if executor is None:
+                record(*_score_chunk(chunk_index, chunk))
+                continue
+            pending.add(executor.submit(_score_chunk, chunk_index, chunk))
+            while len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    record(*future.result())
+        for future in list(pending):
+            record(*future.result())
+        completed = True
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        writer.close(completed)
+
+    elapsed = time.perf_counter() - start
+    summary.update({
+        'seconds': round(elapsed, 3),
+        'rows_per_second': round(summary['rows_scored'] / max(elapsed, 1e-9), 1),
+        'peak_rss_mb': peak_rss_mb()
+    })
+    if summary['rows_skipped']:
+        print(f"⚠️  Skipped {summary['rows_skipped']:,} rows without a parseable timestamp or amount")
+    print(f"\n✅ Scored {summary['rows_scored']:,} rows in {elapsed:.1f}s ({summary['rows_per_second']:,.0f} rows/sec); "
+          f"{summary['anomalies']:,} anomalies written to {output_path}")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score an exported transactions file offline with the current model")
+    parser.add_argument('input', help="CSV, JSON array, JSON Lines or Parquet file of transactions")
+    parser.add_argument('output', help="Scored output; .csv, .jsonl/.json or .parquet")
+    parser.add_argument('--model-path', default=MODEL_PATH)
+    parser.add_argument('--chunk-size', type=int, default=SCORE_FILE_CHUNK_SIZE)
+    parser.add_argument('--workers', type=int, default=SCORE_FILE_WORKERS)
+    parser.add_argument('--include-input', action='store_true', help="Append the input columns to each scored row")
+    parser.add_argument('--no-velocity', action='store_true',
+                        help="Compute sender velocity within each chunk instead of across the whole file")
+    args = parser.parse_args()
+
+    score_file(args.input, args.output, args.model_path, args.chunk_size, args.workers,
+               args.include_input, not args.no_velocity)
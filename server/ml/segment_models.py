@@ -0,0 +1,125 @@
+"""
+Per-segment anomaly detectors routed by transaction attributes.
+
+Amounts and rhythms differ too much between e.g. airtime_purchase (100-5,000
+MWK) and cash_in (up to 200,000 MWK) for one global detector to fit them all
+well. A SegmentedDetector holds one fitted model per segment (transaction_type,
+optionally x network_operator) with that segment's training score quantiles;
+segments too small to train on fall back to the global model. Scoring groups
+the rows of a batch by segment so each model runs once per batch.
+"""
+import os
+from typing import Any, Dict, List, Sequence, Tuple
+import numpy as np
+import pandas as pd
+
+SEGMENT_COLUMNS = ('transaction_type', 'network_operator')
+SEGMENT_MIN_ROWS = int(os.getenv("SEGMENT_MIN_ROWS", "2000"))
+SEGMENT_SEPARATOR = ':'
+# Share of each segment's lowest training scores flagged, matching the global 2% target
+SEGMENT_CONTAMINATION = 0.02
+
+
+def parse_segment_by(value) -> Tuple[str, ...]:
+    """'transaction_type,network_operator' -> validated column tuple ('' / None -> no segmentation)"""
+    if not value:
+        return ()
+    columns = tuple(column.strip() for column in (value.split(',') if isinstance(value, str) else value)
+                    if column.strip())
+    unknown = [column for column in columns if column not in SEGMENT_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown segment column(s) {unknown} (expected {', '.join(SEGMENT_COLUMNS)})")
+    return columns
+
+
+def segment_keys(frame: pd.DataFrame, segment_by: Sequence[str]) -> np.ndarray:
+    """One 'value:value' key per row; missing values become 'unknown'"""
+    columns = [frame[column].astype(object).where(frame[column].notna(), 'unknown').astype(str).to_numpy()
+               if column in frame.columns else np.full(len(frame), 'unknown', dtype=object)
+               for column in segment_by]
+    keys = columns[0].astype(object)
+    for column in columns[1:]:
+        keys = keys + SEGMENT_SEPARATOR + column
+    return keys
+
+
+def group_rows(keys: np.ndarray) -> Dict[str, np.ndarray]:
+    """Row indices of each distinct key"""
+    unique, inverse = np.unique(keys.astype(str), return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    boundaries = np.cumsum(np.bincount(inverse, minlength=len(unique)))[:-1]
+    return dict(zip(unique.tolist(), np.split(order, boundaries)))
+
+
+class SegmentedDetector:
+    """Segment models with per-segment thresholds and a global fallback"""
+
+    def __init__(self, segment_by: Sequence[str], algorithm: str, fallback_model, fallback_quantiles: np.ndarray):
+        self.segment_by = tuple(segment_by)
+        self.algorithm = algorithm
+        self.models = {}
+        self.quantiles = {}
+        self.segment_rows = {}
+        self.segment_metrics = {}
+        self.fallback_model = fallback_model
+        self.fallback_quantiles = np.asarray(fallback_quantiles) if fallback_quantiles is not None else None
+
+    def add_segment(self, key: str, model, training_scores: np.ndarray, metrics: Dict[str, float] = None):
+        self.models[key] = model
+        self.quantiles[key] = np.quantile(training_scores, np.linspace(0, 1, 101))
+        self.segment_rows[key] = int(len(training_scores))
+        self.segment_metrics[key] = metrics or {}
+
+    @staticmethod
+    def _threshold(quantiles: np.ndarray) -> float:
+        return float(np.interp(SEGMENT_CONTAMINATION, np.linspace(0, 1, len(quantiles)), quantiles))
+
+    def threshold_for(self, key: str) -> float:
+        quantiles = self.quantiles.get(key, self.fallback_quantiles)
+        return self._threshold(quantiles) if quantiles is not None else None
+
+    def keys_for(self, frame: pd.DataFrame) -> np.ndarray:
+        return segment_keys(frame, self.segment_by)
+
+    def key_for_record(self, record: Dict[str, Any]) -> str:
+        return SEGMENT_SEPARATOR.join(
+            str(record.get(column)) if record.get(column) is not None else 'unknown' for column in self.segment_by
+        )
+
+    def score(self, X: np.ndarray, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+        """
+        score_samples of each row under its segment's model (the fallback for
+        unknown segments), the matching per-row thresholds and the model used
+        per row ('global' for the fallback). Each model scores its rows in one call.
+        """
+        X = np.asarray(X, dtype=np.float64)
+        scores = np.empty(len(X))
+        thresholds = np.full(len(X), np.nan)
+        routed = np.empty(len(X), dtype=object)
+        fallback_rows = []
+        for key, rows in group_rows(keys).items():
+            if key in self.models:
+                scores[rows] = self.models[key].score_samples(X[rows])
+                thresholds[rows] = self.threshold_for(key)
+                routed[rows] = key
+            else:
+                fallback_rows.append(rows)
+        if fallback_rows:
+            rows = np.concatenate(fallback_rows)
+            scores[rows] = self.fallback_model.score_samples(X[rows])
+            if self.fallback_quantiles is not None:
+                thresholds[rows] = self._threshold(self.fallback_quantiles)
+            routed[rows] = 'global'
+        return scores, thresholds, routed.tolist()
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'segment_by': list(self.segment_by),
+            'algorithm': self.algorithm,
+            'segments': {
+                key: {'rows': self.segment_rows[key], 'threshold': self.threshold_for(key),
+                      **{metric: self.segment_metrics[key].get(metric)
+                         for metric in ('silhouette_score', 'anomaly_percentage')}}
+                for key in self.models
+            }
+        }
@@ -0,0 +1,304 @@
+"""
+Streaming extraction of transactions from PostgreSQL.
+
+Rows are exported with COPY (SELECT ...) TO STDOUT in CSV format and parsed by
+pandas' C reader into typed columns chunk by chunk, so no per-row Python tuples
+are created and memory stays bounded by the chunk size. Time-range predicates
+on `timestamp` use idx_transactions_timestamp instead of a global sort.
+
+Training samples can also be drawn across the whole window by sender (every
+transaction of an indexed hash bucket range of senders) instead of taking the most
+recent rows.
+"""
+import os
+import json
+import time
+import threading
+from datetime import datetime
+from typing import Iterator, Optional, List, Tuple
+import pandas as pd
+import psycopg2
+
+# SELECT expression -> output column name, in the order load_data_from_db returns them
+TRANSACTION_COLUMNS = [
+    ('user_id', 'user_id'),
+    ('amount', 'amount'),
+    ('timestamp', 'timestamp'),
+    ('status', 'status'),
+    ('transaction_type', 'transaction_type'),
+    ('sender_account', 'sender_account'),
+    ('receiver_account', 'receiver_account'),
+    ('location_city', 'location_city'),
+    ('location_country', 'location_country'),
+    ('device_type', 'device_type'),
+    ('os_type', 'os_type'),
+    ('merchant_category', 'merchant_category'),
+    ('is_new_location', 'is_new_location'),
+    ('is_new_device', 'is_new_device'),
+    ('transaction_hour_of_day', 'transaction_hour_of_day'),
+    ('transaction_day_of_week', 'transaction_day_of_week'),
+    ('risk_score', 'risk_score'),
+    ('sender_msisdn', 'sender_msisdn'),
+    ('receiver_msisdn', 'receiver_msisdn'),
+    ('telco_provider', 'network_operator'),
+]
+
+COLUMN_DTYPES = {
+    'user_id': 'object',
+    'amount': 'float64',
+    'status': 'object',
+    'transaction_type': 'object',
+    'sender_account': 'object',
+    'receiver_account': 'object',
+    'location_city': 'object',
+    'location_country': 'object',
+    'device_type': 'object',
+    'os_type': 'object',
+    'merchant_category': 'object',
+    'transaction_hour_of_day': 'float64',
+    'transaction_day_of_week': 'float64',
+    'risk_score': 'float64',
+    'sender_msisdn': 'object',
+    'receiver_msisdn': 'object',
+    'network_operator': 'object',
+    # COPY writes booleans as t/f; parsed as text and mapped in _coerce_chunk
+    'is_new_location': 'object',
+    'is_new_device': 'object',
+}
+
+BOOLEAN_COLUMNS = ['is_new_location', 'is_new_device']
+
+
+def _where_clause(start_time: Optional[datetime] = None, end_time: Optional[datetime] = None,
+                  status: str = 'completed', extra_where: str = None) -> Tuple[str, list]:
+    """WHERE conditions and parameters for a status + time-range filter"""
+    conditions = ['status = %s']
+    params = [status]
+    if start_time is not None:
+        conditions.append('timestamp >= %s')
+        params.append(start_time)
+    if end_time is not None:
+        conditions.append('timestamp < %s')
+        params.append(end_time)
+    if extra_where:
+        conditions.append(extra_where)
+    return ' AND '.join(conditions), params
+
+
+def build_transactions_query(cursor, start_time: Optional[datetime] = None, end_time: Optional[datetime] = None,
+                             limit: Optional[int] = None, status: str = 'completed',
+                             columns: List[tuple] = None, extra_where: str = None) -> str:
+    """Render the SELECT for COPY with parameters safely bound via mogrify"""
+    columns = columns or TRANSACTION_COLUMNS
+    select_list = ', '.join(
+        expression if expression == alias else f"{expression} AS {alias}" for expression, alias in columns
+    )
+    where, params = _where_clause(start_time, end_time, status, extra_where)
+
+    query = f"SELECT {select_list} FROM transactions WHERE {where}"
+    if limit is not None:
+        # The most recent rows in the window, deterministically (served by the timestamp index)
+        query += " ORDER BY timestamp DESC, transaction_id LIMIT %s"
+        params.append(int(limit))
+    return cursor.mogrify(query, params).decode('utf-8')
+
+
+def fingerprint_transactions(conn, start_time: Optional[datetime] = None, end_time: Optional[datetime] = None,
+                             status: str = 'completed') -> Tuple[int, Optional[str]]:
+    """Row count and latest timestamp of the rows a training load would read"""
+    where, params = _where_clause(start_time, end_time, status)
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*), MAX(timestamp) FROM transactions WHERE {where}", params)
+        count, latest = cursor.fetchone()
+    return int(count), latest.isoformat() if latest is not None else None
+
+
+SAMPLING_METHODS = ('sender',)
+# Senders are hashed into SENDER_BUCKETS buckets by an indexed expression (a power of
+# two, so the bucket is a bit mask); a sample reads a contiguous run of buckets
+SENDER_BUCKETS = 4096
+SENDER_BUCKET_EXPRESSION = f"(hashtextextended(COALESCE(sender_account, user_id::text), 0) & {SENDER_BUCKETS - 1})"
+
+
+def ensure_sender_bucket_index(conn):
+    """
+    Expression index on (sender bucket, timestamp), so a sender sample reads
+    only its buckets' rows instead of hashing the whole table. Built
+    CONCURRENTLY (outside a transaction, hence autocommit) so writes are not
+    blocked; an invalid index left by an interrupted build is rebuilt.
+    """
+    autocommit = conn.autocommit
+    conn.commit()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                "WHERE c.relname = 'idx_transactions_sender_bucket'"
+            )
+            existing = cursor.fetchone()
+            if existing is not None and existing[0]:
+                return
+            if existing is not None:
+                cursor.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_transactions_sender_bucket")
+            print("Building idx_transactions_sender_bucket concurrently...")
+            cursor.execute(
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_transactions_sender_bucket "
+                f"ON transactions ({SENDER_BUCKET_EXPRESSION}, timestamp)"
+            )
+            # Statistics on the expression let the planner see how selective a bucket range is
+            cursor.execute("ANALYZE transactions")
+    except psycopg2.Error as e:
+        print(f"⚠️  Could not create idx_transactions_sender_bucket ({e}); sampling will scan the window")
+    finally:
+        conn.autocommit = autocommit
+
+
+def estimate_row_count(conn, start_time: Optional[datetime] = None, end_time: Optional[datetime] = None,
+                       status: str = 'completed') -> int:
+    """Planner's row estimate for a window, from EXPLAIN (nothing is scanned)"""
+    where, params = _where_clause(start_time, end_time, status)
+    with conn.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) SELECT 1 FROM transactions WHERE {where}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def build_sampled_query(cursor, sample_size: int, method: str = 'sender', estimated_rows: int = None,
+                        start_time: Optional[datetime] = None, end_time: Optional[datetime] = None,
+                        seed: int = 42, status: str = 'completed', columns: List[tuple] = None) -> str:
+    """
+    Render a SELECT returning about sample_size rows spread over the window.
+
+    Whole senders are sampled: every sender (sender_account, else user_id, the
+    key velocity and customer aggregates use) hashes into one of SENDER_BUCKETS
+    buckets, a run of buckets starting at seed is kept, and every transaction
+    of those senders in the window is returned. Per-sender features (velocity,
+    customer aggregates, sketches, graph degrees) are therefore computed on
+    complete histories, as at serving time, and paydays and market days keep
+    their real weight. The bucket predicate matches idx_transactions_sender_bucket
+    (see ensure_sender_bucket_index), so only the sampled rows are read. The
+    share comes from the planner's row estimate, so nothing is counted up
+    front; the row count varies around sample_size.
+    """
+    if method not in SAMPLING_METHODS:
+        raise ValueError(f"Unknown sampling method '{method}' (expected one of {', '.join(SAMPLING_METHODS)})")
+    columns = columns or TRANSACTION_COLUMNS
+    select_list = ', '.join(
+        expression if expression == alias else f"{expression} AS {alias}" for expression, alias in columns
+    )
+    where, where_params = _where_clause(start_time, end_time, status)
+    fraction = min(1.0, sample_size / max(estimated_rows or sample_size, 1))
+    buckets = max(1, int(round(fraction * SENDER_BUCKETS)))
+    first = int(seed) % SENDER_BUCKETS
+    if buckets >= SENDER_BUCKETS:
+        bucket_filter, bucket_params = "TRUE", []
+    elif first + buckets <= SENDER_BUCKETS:
+        bucket_filter = f"{SENDER_BUCKET_EXPRESSION} >= %s AND {SENDER_BUCKET_EXPRESSION} < %s"
+        bucket_params = [first, first + buckets]
+    else:
+        # The run wraps past the last bucket
+        bucket_filter = f"({SENDER_BUCKET_EXPRESSION} >= %s OR {SENDER_BUCKET_EXPRESSION} < %s)"
+        bucket_params = [first, first + buckets - SENDER_BUCKETS]
+    query = f"SELECT {select_list} FROM transactions WHERE {where} AND {bucket_filter}"
+    return cursor.mogrify(query, where_params + bucket_params).decode('utf-8')
+
+
+def _coerce_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    for col in BOOLEAN_COLUMNS:
+        if col in chunk.columns:
+            chunk[col] = chunk[col].map({'t': True, 'f': False})
+    return chunk
+
+
+def iter_transaction_chunks(conn, start_time: Optional[datetime] = None, end_time: Optional[datetime] = None,
+                            limit: Optional[int] = None, chunk_size: int = 100000,
+                            columns: List[tuple] = None, extra_where: str = None,
+                            select_sql: str = None) -> Iterator[pd.DataFrame]:
+    """
+    Yield typed DataFrame chunks streamed from COPY ... TO STDOUT.
+
+    The COPY runs in a background thread writing into an OS pipe while pandas
+    parses the other end, so at most one chunk plus the pipe buffer is in memory.
+    Pass select_sql to stream an arbitrary pre-rendered SELECT instead.
+    """
+    with conn.cursor() as cursor:
+        if select_sql is None:
+            select_sql = build_transactions_query(cursor, start_time, end_time, limit,
+                                                  columns=columns, extra_where=extra_where)
+    copy_sql = f"COPY ({select_sql}) TO STDOUT WITH (FORMAT csv, HEADER true)"
+
+    read_fd, write_fd = os.pipe()
+    reader = os.fdopen(read_fd, 'rb')
+    writer = os.fdopen(write_fd, 'wb')
+    errors = []
+
+    def run_copy():
+        try:
+            with conn.cursor() as cursor:
+                cursor.copy_expert(copy_sql, writer)
+        except Exception as e:  # surfaced to the consumer below
+            errors.append(e)
+        finally:
+            try:
+                writer.close()
+            except OSError:
+                pass
+
+    copy_thread = threading.Thread(target=run_copy, daemon=True)
+    copy_thread.start()
+
+    closed_early = False
+    try:
+        csv_chunks = pd.read_csv(reader, chunksize=chunk_size, dtype=COLUMN_DTYPES,
+                                 parse_dates=['timestamp'], keep_default_na=False, na_values=[''])
+        for chunk in csv_chunks:
+            yield _coerce_chunk(chunk)
+    except GeneratorExit:
+        # Consumer stopped early: abort the server-side COPY instead of draining it
+        closed_early = True
+        conn.cancel()
+        raise
+    except (pd.errors.EmptyDataError, ValueError):
+        if not errors:
+            raise
+    finally:
+        reader.close()
+        copy_thread.join()
+        if errors and not closed_early:
+            raise errors[0]
+
+
+def stream_transactions(conn, start_time: Optional[datetime] = None, end_time: Optional[datetime] = None,
+                        limit: Optional[int] = None, chunk_size: int = 100000,
+                        select_sql: str = None) -> pd.DataFrame:
+    """Stream a time range (or select_sql) into one DataFrame, reporting rows/sec as chunks arrive"""
+    start = time.perf_counter()
+    chunks = []
+    total_rows = 0
+    for chunk in iter_transaction_chunks(conn, start_time, end_time, limit, chunk_size, select_sql=select_sql):
+        chunks.append(chunk)
+        total_rows += len(chunk)
+        elapsed = time.perf_counter() - start
+        print(f"   ...streamed {total_rows:,} rows ({total_rows / max(elapsed, 1e-9):,.0f} rows/sec)")
+
+    elapsed = time.perf_counter() - start
+    if not chunks:
+        return pd.DataFrame(columns=[alias for _, alias in TRANSACTION_COLUMNS])
+    df = pd.concat(chunks, ignore_index=True)
+    print(f"Streamed {len(df):,} transactions in {elapsed:.2f}s ({len(df) / max(elapsed, 1e-9):,.0f} rows/sec)")
+    return df
+
+
+def stream_sampled_transactions(conn, sample_size: int, method: str = 'sender',
+                                start_time: Optional[datetime] = None, end_time: Optional[datetime] = None,
+                                seed: int = 42, chunk_size: int = 100000) -> pd.DataFrame:
+    """Stream a representative sample of the window drawn with build_sampled_query"""
+    ensure_sender_bucket_index(conn)
+    estimated_rows = estimate_row_count(conn, start_time, end_time)
+    print(f"Sampling ~{sample_size:,} of ~{estimated_rows:,} transactions by sender")
+    with conn.cursor() as cursor:
+        select_sql = build_sampled_query(cursor, sample_size, method, estimated_rows, start_time, end_time, seed)
+    return stream_transactions(conn, chunk_size=chunk_size, select_sql=select_sql)
@@ -0,0 +1,82 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from cardinality_sketches import CardinalitySketchStore, HyperLogLog, precision_for_error
+
+
+@pytest.mark.parametrize('n', [1, 10, 200])
+def test_small_counts_are_near_exact(n):
+    sketch = HyperLogLog(precision_for_error(0.05))
+    sketch.add_many([f'value-{i}' for i in range(n)])
+    assert abs(sketch.count() - n) <= max(1, 0.02 * n)
+
+
+@pytest.mark.parametrize('n', [5_000, 50_000, 200_000])
+def test_large_counts_within_error_bound(n):
+    sketch = HyperLogLog(precision_for_error(0.05))
+    sketch.add_many(np.arange(n).astype(str))
+    # Hashes are deterministic, so three standard errors is a fixed, safe margin
+    assert abs(sketch.count() - n) / n < 3 * sketch.relative_error
+
+
+def test_duplicates_do_not_count():
+    sketch = HyperLogLog()
+    sketch.add_many(['a', 'b', 'c'] * 1000)
+    assert round(sketch.count()) == 3
+
+
+def test_add_matches_add_many_across_sparse_to_dense():
+    one_by_one, bulk = HyperLogLog(), HyperLogLog()
+    values = [f'city-{i}' for i in range(3000)]
+    for value in values:
+        one_by_one.add(value)
+    bulk.add_many(values)
+    assert not one_by_one.is_sparse
+    np.testing.assert_array_equal(one_by_one.dense_registers(), bulk.dense_registers())
+
+
+def test_merge_is_union():
+    left, right, union = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    left.add_many(range(0, 6000))
+    right.add_many(range(4000, 10000))
+    union.add_many(range(0, 10000))
+    left.merge(right)
+    np.testing.assert_array_equal(left.dense_registers(), union.dense_registers())
+
+
+def test_merge_rejects_other_precision():
+    with pytest.raises(ValueError):
+        HyperLogLog(10).merge(HyperLogLog(12))
+
+
+def test_pickle_round_trip_keeps_registers():
+    for n in (5, 5000):
+        sketch = HyperLogLog()
+        sketch.add_many(range(n))
+        restored = pickle.loads(pickle.dumps(sketch))
+        assert restored.is_sparse == sketch.is_sparse
+        assert restored.count() == sketch.count()
+
+
+def test_store_matches_nunique_and_single_updates():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'sender_account': rng.choice([f'acct-{i}' for i in range(50)], 5000),
+        'location_city': rng.choice([f'city-{i}' for i in range(400)], 5000),
+        'device_type': rng.choice(['android', 'ios', 'feature'], 5000),
+        'transaction_type': rng.choice(['deposit', 'withdrawal', 'transfer'], 5000),
+        'timestamp': pd.date_range('2024-01-01', periods=5000, freq='min'),
+    })
+    bulk = CardinalitySketchStore.from_frame(df)
+    estimates = bulk.estimates_for_frame(df)
+    exact = df.groupby('sender_account')['location_city'].transform('nunique')
+    relative = np.abs(estimates['user_location_diversity'] - exact) / exact
+    assert relative.max() < 3 * 1.04 / np.sqrt(1 << bulk.precision)
+
+    streamed = CardinalitySketchStore()
+    for record in df.to_dict('records'):
+        streamed.update(record)
+    pd.testing.assert_frame_equal(streamed.estimates_for_frame(df), estimates)
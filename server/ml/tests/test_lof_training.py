@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from anomaly_models import PrototypeLocalOutlierFactor
+from fraud_detection_model import ComprehensiveFraudDetectionModel
+from rule_cascade import RuleCascade
+
+N_ROWS = 3000
+
+
+@pytest.fixture(scope='module')
+def training():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(N_ROWS, 12))
+    X[:30] += 6
+    # Fewer prototypes than rows, so some training rows are prototypes and some are not
+    lof = PrototypeLocalOutlierFactor(n_neighbors=10, max_prototypes=800, n_components=5, random_state=0).fit(X)
+    raw = pd.DataFrame({
+        'amount': np.exp(X[:, 0] + 9),
+        'transaction_type': rng.choice(['deposit', 'transfer'], N_ROWS),
+        'transaction_hour_of_day': rng.integers(0, 24, N_ROWS),
+        'is_new_device': X[:, 1] > 1.5,
+        'is_new_location': False,
+    })
+    return X, lof, raw
+
+
+@pytest.fixture
+def model():
+    model = ComprehensiveFraudDetectionModel()
+    model.ensemble = None
+    model.segmented = None
+    model.score_quantiles = None
+    model.feature_names = [f'f{i}' for i in range(12)]
+    return model
+
+
+def test_training_scores_for_a_subset_match_the_full_scores(training):
+    X, lof, _ = training
+    full = lof.training_scores(X)
+    # Prototypes score against their neighbours, not themselves
+    np.testing.assert_allclose(full[lof.prototype_indices_], lof.negative_outlier_factor_)
+    rows = np.sort(np.random.default_rng(1).choice(N_ROWS, 1000, replace=False))
+    np.testing.assert_allclose(lof.training_scores(X, rows), full[rows])
+    np.testing.assert_allclose(lof.training_scores(X, rows, chunk_size=64), full[rows])
+    with pytest.raises(ValueError):
+        lof.training_scores(X[:100])
+
+
+def test_feature_importance_on_a_sample(training, model):
+    X, lof, _ = training
+    importance = model.compute_feature_importance(lof, X, sample_rows=1000)
+    assert set(importance) == set(model.feature_names)
+    assert sum(importance.values()) == pytest.approx(1.0, abs=1e-3)
+
+
+@pytest.mark.parametrize('fitted', [True, False])
+def test_rule_cascade_on_a_sample(training, model, fitted):
+    X, lof, raw = training
+    # Incremental updates validate against rows the model was not fitted on
+    X_scored = X if fitted else X[::-1].copy()
+    cascade = model.fit_rule_cascade(lof, X_scored, raw, sample_rows=1000, fitted=fitted)
+    assert isinstance(cascade, RuleCascade)
+    assert sum(cascade.training_hit_rates.values()) == pytest.approx(1.0)
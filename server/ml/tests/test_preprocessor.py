@@ -0,0 +1,73 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import LabelEncoder, StandardScaler
+
+from feature_engineering import Preprocessor
+
+FEATURES = ['amount', 'transaction_type', 'is_new_device', 'risk_score']
+
+
+def _frame(n=500, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'amount': rng.lognormal(8, 1, n),
+        'transaction_type': rng.choice(['deposit', 'withdrawal', 'transfer'], n, p=[0.2, 0.2, 0.6]),
+        'is_new_device': rng.random(n) < 0.1,
+        'risk_score': np.where(rng.random(n) < 0.1, np.nan, rng.random(n)),
+    })
+
+
+def test_fit_transform_standardizes_in_feature_order():
+    df = _frame()
+    X = Preprocessor(FEATURES).fit_transform(df[FEATURES[::-1]])
+    assert X.shape == (len(df), len(FEATURES))
+    np.testing.assert_allclose(X.mean(axis=0), 0, atol=1e-9)
+    np.testing.assert_allclose(X.std(axis=0), 1, atol=1e-9)
+
+
+def test_pickle_round_trip_transforms_identically():
+    df = _frame()
+    preprocessor = Preprocessor(FEATURES).fit(df, chunk_size=64)
+    restored = pickle.loads(pickle.dumps(preprocessor))
+    new = _frame(seed=1)
+    np.testing.assert_array_equal(restored.transform(new), preprocessor.transform(new))
+
+
+def test_chunked_fit_matches_single_pass():
+    df = _frame(2000)
+    chunked = Preprocessor(FEATURES).fit(df, chunk_size=300)
+    whole = Preprocessor(FEATURES).fit(df, chunk_size=len(df))
+    np.testing.assert_allclose(chunked.scaler.mean_, whole.scaler.mean_)
+    np.testing.assert_allclose(chunked.scaler.scale_, whole.scaler.scale_)
+
+
+def test_unseen_and_missing_values_use_training_defaults():
+    df = _frame()
+    preprocessor = Preprocessor(FEATURES).fit(df)
+    row = pd.DataFrame({'amount': [np.nan], 'transaction_type': ['airtime'], 'is_new_device': [False]})
+    X = preprocessor._encode(row)[0]
+    assert X[0] == df['amount'].median()
+    # Unseen category -> the most frequent training category
+    assert preprocessor.encoders['transaction_type'].classes_[int(X[1])] == 'transfer'
+    # Column absent from the frame -> its training median
+    assert X[3] == preprocessor.fill_values['risk_score']
+
+
+def test_from_legacy_matches_the_old_encoder_and_scaler():
+    df = _frame().fillna(0)
+    encoder = LabelEncoder().fit(df['transaction_type'].astype(str))
+    legacy = df[FEATURES].copy()
+    legacy['transaction_type'] = encoder.transform(legacy['transaction_type'])
+    legacy['is_new_device'] = legacy['is_new_device'].astype(float)
+    scaler = StandardScaler().fit(legacy.to_numpy(dtype=float))
+
+    preprocessor = Preprocessor.from_legacy(FEATURES, scaler, {'transaction_type': encoder})
+    np.testing.assert_allclose(preprocessor.transform(df), scaler.transform(legacy.to_numpy(dtype=float)))
+
+    # The old path sent unseen categories to classes_[0] and missing numbers to 0
+    unseen = pd.DataFrame({'amount': [np.nan], 'transaction_type': ['airtime'],
+                           'is_new_device': [True], 'risk_score': [0.5]})
+    expected = scaler.transform(np.array([[0.0, 0.0, 1.0, 0.5]]))
+    np.testing.assert_allclose(preprocessor.transform(unseen), expected)
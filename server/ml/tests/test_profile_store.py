@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from profile_store import UserProfileStore
+
+
+def history(n, users, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'user_id': [f'u{i}' for i in rng.integers(0, users, n)],
+        'timestamp': pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.uniform(0, 30 * 86400, n), unit='s'),
+        'amount': rng.lognormal(8, 1, n).round(2),
+    })
+
+
+def expected_features(df, keys, at):
+    grouped = df.groupby('user_id')
+    count = grouped['amount'].count().reindex(keys, fill_value=0)
+    first_seen = grouped['timestamp'].min().reindex(keys)
+    return pd.DataFrame({
+        'user_total_transactions': count.to_numpy(),
+        'user_total_amount_spent': grouped['amount'].sum().reindex(keys, fill_value=0.0).to_numpy(),
+        'account_age_days': ((at - first_seen).dt.total_seconds() // 86400).fillna(0.0).to_numpy(),
+        'user_amount_mean': grouped['amount'].mean().reindex(keys, fill_value=0.0).to_numpy(),
+        'user_amount_std': grouped['amount'].std(ddof=0).reindex(keys, fill_value=0.0).to_numpy(),
+    })
+
+
+def check_features(store, df):
+    keys = sorted(df['user_id'].unique()) + ['never-seen']
+    at = pd.Timestamp('2024-03-01')
+    features = store.features(keys, [at] * len(keys))
+    pd.testing.assert_frame_equal(features, expected_features(df, keys, at), check_dtype=False, rtol=1e-9)
+
+
+@pytest.mark.parametrize('file_backed', [False, True])
+def test_grows_past_initial_capacity(tmp_path, file_backed):
+    df = history(3000, users=700)
+    store = UserProfileStore(str(tmp_path / 'profiles.npy') if file_backed else None, capacity=16)
+    # Repeated users within one batch accumulate
+    store.update_many(df['user_id'][:2000], df['timestamp'][:2000], df['amount'][:2000])
+    for row in df[2000:].itertuples():
+        store.update(row.user_id, row.timestamp.timestamp(), row.amount)
+    assert len(store) == df['user_id'].nunique()
+    assert len(store.records) >= len(store) and len(store.records) % 16 == 0
+    check_features(store, df)
+    assert store.watermark() == pytest.approx(df['timestamp'].max().timestamp())
+
+
+def test_snapshot_and_reload(tmp_path):
+    path = str(tmp_path / 'profiles.npy')
+    df = history(2000, users=300, seed=1)
+    store = UserProfileStore.open(path)
+    store.update_many(df['user_id'], df['timestamp'], df['amount'])
+    store.snapshot(clean=True)
+
+    loaded = UserProfileStore.open(path)
+    assert loaded.clean_shutdown
+    check_features(loaded, df)
+    # Loading for writing marks the sidecar unclean until the next clean snapshot
+    assert not UserProfileStore.load(path, read_only=True).clean_shutdown
+
+    more = history(500, users=400, seed=2)
+    loaded.update_many(more['user_id'], more['timestamp'], more['amount'])
+    loaded.snapshot(clean=True)
+    check_features(UserProfileStore.load(path, read_only=True), pd.concat([df, more]))
+
+
+def test_rows_past_the_saved_keys_are_reset_after_a_crash(tmp_path):
+    path = str(tmp_path / 'profiles.npy')
+    store = UserProfileStore(path)
+    store.update('a', 0.0, 10.0)
+    store.snapshot()
+    # Updated after the last snapshot, then the process dies
+    store.update('b', 5.0, 99.0)
+    store.records.flush()
+
+    loaded = UserProfileStore.load(path)
+    assert not loaded.clean_shutdown
+    assert len(loaded) == 1
+    loaded.update('c', 6.0, 1.0)
+    record = loaded.lookup(['c'])[0]
+    assert record['count'] == 1 and record['amount_sum'] == 1.0
+
+
+def test_clear_keeps_capacity(tmp_path):
+    store = UserProfileStore(str(tmp_path / 'profiles.npy'), capacity=8)
+    store.update_many([f'u{i}' for i in range(20)], [pd.Timestamp('2024-01-01')] * 20, np.ones(20))
+    capacity = len(store.records)
+    store.clear()
+    assert len(store) == 0 and len(store.records) == capacity
+    assert store.watermark() is None
+    assert store.lookup(['u1'])[0]['count'] == 0
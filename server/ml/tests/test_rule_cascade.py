@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from rule_cascade import RuleCascade, rule_frame, TIER_MODEL, TIER_NORMAL, TIER_ANOMALY
+
+
+@pytest.fixture(scope='module')
+def cascade():
+    rng = np.random.default_rng(3)
+    n = 30000
+    frames = []
+    for transaction_type, scale in (('deposit', 20000), ('transfer', 50000)):
+        frames.append(pd.DataFrame({
+            'amount': rng.lognormal(np.log(scale), 0.5, n),
+            'transaction_type': transaction_type,
+            'transaction_hour_of_day': rng.integers(6, 22, n),
+            'is_new_device': False,
+            'is_new_location': False,
+        }))
+    frames.append(pd.DataFrame({'amount': [1000.0] * 100, 'transaction_type': 'airtime',
+                                'transaction_hour_of_day': 12, 'is_new_device': False, 'is_new_location': False}))
+    df = pd.concat(frames, ignore_index=True)
+
+    # The largest amounts of each type come from new devices, and the model flags exactly those
+    top = df.groupby('transaction_type')['amount'].rank(ascending=False) <= 60
+    df.loc[top, 'is_new_device'] = True
+    flagged = top.to_numpy().copy()
+    # On transfers the model also flags 5% of ordinary rows, so their normal rule can't be trusted
+    transfers = np.flatnonzero(df['transaction_type'].eq('transfer').to_numpy() & ~flagged)
+    flagged[rng.choice(transfers, len(transfers) // 20, replace=False)] = True
+
+    scores = np.where(flagged, -0.7, -0.3) + rng.normal(0, 0.01, len(df))
+    thresholds = np.full(len(df), -0.5)
+    return RuleCascade.fit(rule_frame(df), scores, thresholds)
+
+
+def _rows(*rows):
+    return pd.DataFrame(rows, columns=['amount', 'transaction_type', 'transaction_hour_of_day',
+                                       'is_new_device', 'is_new_location'])
+
+
+def test_rules_enabled_only_where_the_model_agrees(cascade):
+    assert cascade.rules['deposit']['normal'] and cascade.rules['deposit']['anomaly']
+    assert not cascade.rules['transfer']['normal']
+    assert cascade.rules['transfer']['anomaly']
+    # Too few training rows for a rule
+    assert 'airtime' not in cascade.rules
+
+
+def test_clear_cut_rows_are_settled_and_the_rest_go_to_the_model(cascade):
+    deposit = cascade.rules['deposit']
+    in_band = (deposit['floor'] + deposit['normal_cap']) / 2
+    huge = deposit['anomaly_amount'] * 2
+    df = _rows(
+        (in_band, 'deposit', 12, False, False),   # clearly normal
+        (in_band, 'deposit', 12, True, False),    # new device: not clear-cut
+        (in_band, 'deposit', 3, False, False),    # outside normal hours
+        (in_band, 'deposit', 12, None, False),    # unknown device flag is not "known"
+        (huge, 'deposit', 12, True, False),       # clearly anomalous
+        (huge, 'deposit', 12, False, False),      # large but nothing else unusual
+        (huge, 'deposit', 2, False, False),       # large at night
+        (in_band, 'transfer', 12, False, False),  # normal rule disabled for transfers
+        (in_band, 'airtime', 12, False, False),   # no rule for the type
+        (in_band, 'merchant', 12, False, False),  # type never seen in training
+    )
+    assert cascade.tiers(df).tolist() == [
+        TIER_NORMAL, TIER_MODEL, TIER_MODEL, TIER_MODEL, TIER_ANOMALY,
+        TIER_MODEL, TIER_ANOMALY, TIER_MODEL, TIER_MODEL, TIER_MODEL
+    ]
+
+
+def test_settled_rows_report_the_training_medians(cascade):
+    deposit = cascade.rules['deposit']
+    df = _rows(((deposit['floor'] + deposit['normal_cap']) / 2, 'deposit', 12, False, False),
+               (deposit['anomaly_amount'] * 2, 'deposit', 12, True, False),
+               (1.0, 'transfer', 12, False, False))
+    tiers = cascade.tiers(df)
+    scores, thresholds = cascade.settled_scores(df, tiers)
+    assert scores[0] == pytest.approx(deposit['normal_score'])
+    assert scores[1] == pytest.approx(deposit['anomaly_score'])
+    assert scores[0] > thresholds[0] and scores[1] <= thresholds[1]
+    assert np.isnan(scores[2]) and np.isnan(thresholds[2])
+
+
+def test_rule_frame_fills_the_hour_from_the_timestamp():
+    df = pd.DataFrame({'amount': [1.0, 2.0], 'transaction_type': ['deposit', 'deposit'],
+                       'transaction_hour_of_day': [None, 9],
+                       'timestamp': ['2024-05-01 23:15:00', '2024-05-01 10:00:00']})
+    assert rule_frame(df)['transaction_hour_of_day'].tolist() == [23, 9]
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from fraud_detection_model import ComprehensiveFraudDetectionModel
+
+
+@pytest.fixture
+def model():
+    model = ComprehensiveFraudDetectionModel()
+    model.rungs = []
+    model.rung_seeds = []
+
+    def run_trials(X, trials):
+        model.rungs.append((X[:, 0].copy(), [trial['params']['quality'] for trial in trials]))
+        model.rung_seeds.append([trial['seed'] for trial in trials])
+        return [(None, {'error': 'failed'}, 0.0) if trial['params']['quality'] is None
+                else (object(), {'quality': trial['params']['quality']}, 0.0) for trial in trials]
+
+    model.run_trials = run_trials
+    model.composite_score = lambda metrics: metrics['quality']
+    return model
+
+
+def _trials(algorithm, qualities):
+    return [{'algorithm': algorithm, 'params': {'quality': quality}, 'seed': i} for i, quality in enumerate(qualities)]
+
+
+def test_promotes_top_third_per_algorithm_on_nested_samples(model):
+    X = np.arange(9000, dtype=float).reshape(-1, 1)
+    forest = [0.3, 0.9, 0.1, 0.5, None, 0.7, 0.2, 0.8, 0.4]
+    svm = [0.2, 0.6, 0.4]
+    results = model.successive_halving(X, {'forest': _trials('forest', forest), 'svm': _trials('svm', svm)},
+                                       eta=3, min_samples=100)
+
+    assert [len(rows) for rows, _ in model.rungs] == [1000, 3000, 9000]
+    # Rung samples are nested prefixes of one permutation
+    assert set(model.rungs[0][0]) <= set(model.rungs[1][0])
+    # Every candidate first, then the top ceil(n / 3) of each algorithm, in trial order
+    assert model.rungs[0][1] == forest + svm
+    assert model.rungs[1][1] == [0.9, 0.7, 0.8, 0.6]
+    assert model.rungs[2][1] == [0.9, 0.6]
+
+    trials, outputs = results['forest']
+    assert [trial['params']['quality'] for trial in trials] == [0.9]
+    assert len(outputs) == 1
+
+
+def test_ties_keep_trial_order_and_failures_are_dropped(model):
+    X = np.arange(900, dtype=float).reshape(-1, 1)
+    qualities = [None, 0.5, 0.5, 0.5]
+    model.successive_halving(X, {'forest': _trials('forest', qualities)}, eta=2, min_samples=100)
+    # Trials 1-3 tie; the first two (in trial order) go through, the failed trial 0 never does
+    assert model.rung_seeds[1] == [1, 2]
+
+
+def test_single_candidate_goes_straight_to_full_data(model):
+    X = np.arange(500, dtype=float).reshape(-1, 1)
+    model.successive_halving(X, {'forest': _trials('forest', [0.4])}, eta=3, min_samples=100)
+    assert [len(rows) for rows, _ in model.rungs] == [500]
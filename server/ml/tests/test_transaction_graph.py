@@ -0,0 +1,89 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from transaction_graph import TransactionGraph, GRAPH_FEATURE_COLUMNS
+
+
+def transactions(n, seed=0, accounts=40, start='2024-01-01'):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'sender_account': [f'A{i}' for i in rng.integers(0, accounts, n)],
+        'receiver_account': [f'A{i}' for i in rng.integers(0, accounts, n)],
+        'timestamp': pd.Timestamp(start) + pd.to_timedelta(np.sort(rng.uniform(0, 3 * 86400, n)), unit='s'),
+    })
+
+
+def test_features_count_distinct_counterparties_and_pairs():
+    df = pd.DataFrame({'sender_account': ['a', 'a', 'a', 'b'],
+                       'receiver_account': ['b', 'c', 'b', 'c'],
+                       'timestamp': pd.date_range('2024-01-01', periods=4, freq='h')})
+    graph, features = TransactionGraph.from_frame(df)
+    assert features['graph_sender_fan_out'].tolist() == [1, 2, 2, 1]
+    assert features['graph_receiver_fan_in'].tolist() == [1, 1, 1, 2]
+    assert features['graph_pair_transaction_count'].tolist() == [1, 1, 2, 1]
+    # a paid b and c; only b pays onward (to c)
+    assert graph.two_hop_reach('a') == 1
+    assert graph.fan_in('c') == 2 and graph.fan_out('c') == 0
+
+
+def test_missing_account_leaves_its_side_nan():
+    graph = TransactionGraph()
+    features = graph.update(None, 'b', 0.0)
+    assert np.isnan(features['graph_sender_fan_out'])
+    assert features['graph_receiver_fan_in'] == 0
+
+
+def test_pruning_drops_idle_edges_and_orphaned_accounts():
+    graph = TransactionGraph(retention_seconds=100)
+    graph.update('old', 'stale', 0.0)
+    graph.update('a', 'b', 50.0)
+    assert graph.n_nodes == 4
+    # Event time advancing past a tenth of the retention window prunes edges idle for 100s
+    graph.update('a', 'c', 120.0)
+    assert 'old' not in graph.node_ids and 'stale' not in graph.node_ids
+    assert graph.fan_out('a') == 2
+    # a -> b was last seen at 50, a -> c at 120
+    assert graph.evict_idle(now=200.0) == 1
+    assert sorted(graph.node_ids) == ['a', 'c']
+    assert graph.fan_out('a') == 1 and graph.fan_in('c') == 1
+    # Surviving IDs are renumbered densely and keep working
+    assert graph.update('c', 'a', 201.0)['graph_sender_fan_out'] == 1
+    assert graph.fan_in('a') == 1
+
+
+def test_pickle_and_snapshot_round_trip_continue_identically(tmp_path):
+    first, later = transactions(400, seed=1), transactions(200, seed=2, start='2024-01-04')
+    graph, _ = TransactionGraph.from_frame(first)
+    restored = pickle.loads(pickle.dumps(graph))
+    path = str(tmp_path / 'graph.joblib')
+    graph.snapshot(path)
+    loaded = TransactionGraph.load(path)
+
+    expected = graph.add_frame(later)
+    pd.testing.assert_frame_equal(restored.add_frame(later), expected)
+    pd.testing.assert_frame_equal(loaded.add_frame(later), expected)
+    assert restored.n_nodes == graph.n_nodes and restored.n_transactions == graph.n_transactions
+
+
+def test_preview_matches_add_frame_and_records_nothing():
+    graph, _ = TransactionGraph.from_frame(transactions(400, seed=3))
+    state = pickle.dumps(graph)
+    # New accounts, repeated pairs within the batch, and rows out of timestamp order
+    batch = transactions(60, seed=4, accounts=60, start='2024-01-04').iloc[::-1]
+    preview = graph.preview_frame(batch)
+    assert pickle.dumps(graph) == state
+
+    pd.testing.assert_frame_equal(preview, graph.add_frame(batch))
+    assert list(preview.columns) == GRAPH_FEATURE_COLUMNS
+
+
+def test_from_frame_matches_serving_one_row_at_a_time():
+    df = transactions(300, seed=5)
+    _, batch = TransactionGraph.from_frame(df)
+    graph = TransactionGraph()
+    served = [graph.update(row.sender_account, row.receiver_account, row.timestamp.timestamp())
+              for row in df.itertuples()]
+    np.testing.assert_allclose(pd.DataFrame(served)[GRAPH_FEATURE_COLUMNS].to_numpy(), batch.to_numpy())
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from velocity_store import SenderVelocityStore, DEFAULT_RINGS
+from feature_engineering import VELOCITY_WINDOWS, VELOCITY_MAX_GAP_SECONDS
+
+
+def _expected(history, timestamp):
+    """Bucket-aligned window totals, computed by brute force over the history"""
+    expected = {}
+    for label, window_seconds in VELOCITY_WINDOWS.items():
+        bucket_seconds = next(seconds for seconds, n_buckets in DEFAULT_RINGS
+                              if window_seconds % seconds == 0 and window_seconds // seconds <= n_buckets)
+        n_window = window_seconds // bucket_seconds
+        current = timestamp // bucket_seconds
+        inside = [(t, amount) for t, amount in history if t // bucket_seconds > current - n_window]
+        expected[f'sender_txn_count_{label}'] = len(inside)
+        expected[f'sender_txn_amount_{label}'] = sum(amount for _, amount in inside)
+    return expected
+
+
+def test_ring_windows_match_brute_force():
+    rng = np.random.default_rng(7)
+    store = SenderVelocityStore()
+    # Mixed gaps: bursts within a minute, hour-scale pauses and multi-day silences
+    gaps = rng.choice([5, 40, 300, 2000, 7200, 90000, 400000], size=600)
+    timestamps = 1_700_000_000 + np.cumsum(gaps)
+    history = []
+    for timestamp in timestamps:
+        amount = float(rng.integers(100, 50000))
+        history.append((int(timestamp), amount))
+        features = store.update('acct', float(timestamp), amount)
+        for name, value in _expected(history, int(timestamp)).items():
+            assert features[name] == pytest.approx(value), name
+
+
+def test_time_since_last_and_first_gap():
+    store = SenderVelocityStore()
+    assert store.update('acct', 1000.0, 1.0)['time_since_last_seconds'] == VELOCITY_MAX_GAP_SECONDS
+    assert store.update('acct', 1090.0, 1.0)['time_since_last_seconds'] == 90.0
+
+
+def test_long_silence_clears_every_window():
+    store = SenderVelocityStore()
+    for offset in range(10):
+        store.update('acct', 1_000_000.0 + offset * 30, 10.0)
+    features = store.update('acct', 1_000_000.0 + 3 * 24 * 3600, 5.0)
+    for label in VELOCITY_WINDOWS:
+        assert features[f'sender_txn_count_{label}'] == 1
+        assert features[f'sender_txn_amount_{label}'] == 5.0
+
+
+def test_preview_does_not_record_and_matches_update():
+    store = SenderVelocityStore()
+    store.update('acct', 1000.0, 10.0)
+    previews = store.preview_many(['acct', 'acct', 'other'], [1010.0, 1020.0, 1020.0], [1.0, 2.0, 3.0])
+    assert store.query('acct', 1020.0)['sender_txn_count_10m'] == 1
+    assert 'other' not in store.senders
+    recorded = [store.update('acct', 1010.0, 1.0), store.update('acct', 1020.0, 2.0), store.update('other', 1020.0, 3.0)]
+    assert previews == recorded
+
+
+def test_lru_cap_and_event_time_eviction():
+    store = SenderVelocityStore(max_senders=3)
+    for i, sender in enumerate(['a', 'b', 'c', 'd']):
+        store.update(sender, 1000.0 + i, 1.0)
+    assert list(store.senders) == ['b', 'c', 'd']
+
+    store.update('d', 1000.0 + store.idle_seconds + 10, 1.0)
+    # Idle relative to the latest event, whatever the wall clock says
+    assert store.evict_idle() == 2
+    assert list(store.senders) == ['d']
+
+
+def test_snapshot_round_trip(tmp_path):
+    store = SenderVelocityStore()
+    for offset in range(50):
+        store.update(f'acct-{offset % 5}', 1_000_000.0 + offset * 45, float(offset))
+    path = str(tmp_path / 'velocity.joblib')
+    store.snapshot(path)
+    restored = SenderVelocityStore.load(path)
+    assert restored.max_event_time == store.max_event_time
+    for sender in store.senders:
+        assert restored.query(sender, 1_003_000.0) == store.query(sender, 1_003_000.0)
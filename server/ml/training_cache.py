@@ -0,0 +1,88 @@
+"""
+Content-addressed cache of the prepared training matrix.
+
+prepare_training_data output (the neutralized, scaled X) is stored as a .npy
+file next to the fitted preprocessor and sketches, under a key derived from the
+query window, the fingerprint of the rows it would read (count and latest
+timestamp) and a hash of the feature-engineering code. Repeat experiments on
+unchanged data memory-map X instead of reloading and re-engineering it; any
+change to the data or the feature code produces a new key.
+"""
+import os
+import json
+import shutil
+import hashlib
+import inspect
+from typing import Any, Dict, Optional, Tuple
+import joblib
+import numpy as np
+
+TRAINING_CACHE_DIR = os.getenv("TRAINING_CACHE_DIR", "trained_models/cache")
+TRAINING_CACHE_MAX_ENTRIES = int(os.getenv("TRAINING_CACHE_MAX_ENTRIES", "5"))
+
+# Modules whose code determines the contents of X and the fitted state cached with it
+FEATURE_CODE_MODULES = ['feature_engineering.py', 'cardinality_sketches.py', 'transaction_graph.py', 'streaming_loader.py',
+                        'rule_cascade.py', 'drift_monitor.py', 'segment_models.py']
+
+
+def feature_code_version(extra_functions=()) -> str:
+    """Hash of the feature-engineering modules plus the source of extra_functions"""
+    digest = hashlib.blake2b(digest_size=16)
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    for module in FEATURE_CODE_MODULES:
+        with open(os.path.join(module_dir, module), 'rb') as f:
+            digest.update(f.read())
+    for function in extra_functions:
+        digest.update(inspect.getsource(function).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def cache_key(**parts) -> str:
+    """Stable key for a set of JSON-serializable parts"""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class TrainingMatrixCache:
+    """Directory of <key>/X.npy + <key>/state.joblib entries, oldest evicted first"""
+
+    def __init__(self, cache_dir: str = TRAINING_CACHE_DIR, max_entries: int = TRAINING_CACHE_MAX_ENTRIES):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, key: str) -> Optional[Tuple[np.ndarray, Dict[str, Any]]]:
+        """Memory-mapped X and the saved state for key, or None on a miss"""
+        entry = self._entry(key)
+        if not os.path.exists(os.path.join(entry, 'state.joblib')):
+            return None
+        X = np.load(os.path.join(entry, 'X.npy'), mmap_mode='r')
+        state = joblib.load(os.path.join(entry, 'state.joblib'))
+        os.utime(entry)  # Mark as recently used for eviction
+        return X, state
+
+    def store(self, key: str, X: np.ndarray, state: Dict[str, Any]) -> np.ndarray:
+        """Write X and state under key atomically and return X memory-mapped from disk"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entry = self._entry(key)
+        tmp_entry = f"{entry}.tmp{os.getpid()}"
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        os.makedirs(tmp_entry)
+        np.save(os.path.join(tmp_entry, 'X.npy'), np.ascontiguousarray(X))
+        joblib.dump(state, os.path.join(tmp_entry, 'state.joblib'))
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp_entry, entry)
+        self._evict()
+        return np.load(os.path.join(entry, 'X.npy'), mmap_mode='r')
+
+    def _evict(self):
+        """Keep only the max_entries most recently used entries"""
+        entries = [
+            os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)
+            if os.path.isdir(os.path.join(self.cache_dir, name)) and '.tmp' not in name
+        ]
+        entries.sort(key=os.path.getmtime, reverse=True)
+        for stale in entries[self.max_entries:]:
+            shutil.rmtree(stale, ignore_errors=True)
@@ -0,0 +1,131 @@
+"""
+Per-stage checkpoints for train_comprehensive_model.
+
+Each run gets a directory under TRAINING_CHECKPOINT_DIR holding a manifest with
+the run's parameters and completed stages, the loaded data, the prepared
+matrix, every finished hyperparameter trial and each algorithm's final search
+result. A crashed or killed run can be resumed with --resume: completed stages
+are loaded instead of recomputed and only unfinished trials are fitted. The
+directory is removed once the run has saved its model and reports.
+"""
+import os
+import json
+import shutil
+from datetime import datetime
+from typing import Any, Dict, Optional
+import joblib
+import numpy as np
+
+from training_cache import cache_key
+
+TRAINING_CHECKPOINT_DIR = os.getenv("TRAINING_CHECKPOINT_DIR", "trained_models/checkpoints")
+
+
+def _atomic_dump(obj, path: str):
+    tmp_path = f"{path}.tmp"
+    joblib.dump(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+class TrainingCheckpoint:
+    """Checkpoint directory for one training run"""
+
+    def __init__(self, run_dir: str, manifest: Dict[str, Any]):
+        self.run_dir = run_dir
+        self.manifest = manifest
+        os.makedirs(os.path.join(run_dir, 'trials'), exist_ok=True)
+
+    @classmethod
+    def create(cls, params: Dict[str, Any], checkpoint_dir: str = TRAINING_CHECKPOINT_DIR) -> 'TrainingCheckpoint':
+        """Start a new run directory recording the parameters needed to resume it"""
+        run_id = datetime.now().strftime('run_%Y%m%d_%H%M%S_%f')
+        checkpoint = cls(os.path.join(checkpoint_dir, run_id), {
+            'run_id': run_id,
+            'created': datetime.now().isoformat(),
+            'params': params,
+            'stages': [],
+            'completed': False
+        })
+        checkpoint._write_manifest()
+        print(f"📌 Checkpointing training run to {checkpoint.run_dir}")
+        return checkpoint
+
+    @classmethod
+    def open(cls, run_dir: str) -> 'TrainingCheckpoint':
+        with open(os.path.join(run_dir, 'manifest.json')) as f:
+            return cls(run_dir, json.load(f))
+
+    @classmethod
+    def latest(cls, checkpoint_dir: str = TRAINING_CHECKPOINT_DIR) -> Optional['TrainingCheckpoint']:
+        """Most recently created run that has not completed, if any"""
+        if not os.path.isdir(checkpoint_dir):
+            return None
+        runs = sorted(
+            (name for name in os.listdir(checkpoint_dir)
+             if os.path.exists(os.path.join(checkpoint_dir, name, 'manifest.json'))),
+            reverse=True
+        )
+        for name in runs:
+            checkpoint = cls.open(os.path.join(checkpoint_dir, name))
+            if not checkpoint.manifest['completed']:
+                return checkpoint
+        return None
+
+    @property
+    def params(self) -> Dict[str, Any]:
+        return self.manifest['params']
+
+    def _write_manifest(self):
+        os.makedirs(self.run_dir, exist_ok=True)
+        path = os.path.join(self.run_dir, 'manifest.json')
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(self.manifest, f, indent=2, default=str)
+        os.replace(f"{path}.tmp", path)
+
+    def _mark(self, stage: str):
+        if stage not in self.manifest['stages']:
+            self.manifest['stages'].append(stage)
+            self._write_manifest()
+
+    def has(self, stage: str) -> bool:
+        return stage in self.manifest['stages']
+
+    def save(self, stage: str, obj):
+        """Persist a stage's output; the stage counts as done only once written"""
+        _atomic_dump(obj, os.path.join(self.run_dir, f'{stage}.joblib'))
+        self._mark(stage)
+
+    def load(self, stage: str):
+        return joblib.load(os.path.join(self.run_dir, f'{stage}.joblib'))
+
+    def save_matrix(self, stage: str, X: np.ndarray):
+        path = os.path.join(self.run_dir, f'{stage}.npy')
+        with open(f"{path}.tmp", 'wb') as f:
+            np.save(f, np.ascontiguousarray(X))
+        os.replace(f"{path}.tmp", path)
+        self._mark(stage)
+
+    def load_matrix(self, stage: str) -> np.ndarray:
+        """Stage matrix memory-mapped read-only"""
+        return np.load(os.path.join(self.run_dir, f'{stage}.npy'), mmap_mode='r')
+
+    @staticmethod
+    def trial_key(trial: Dict[str, Any], X: np.ndarray) -> str:
+        """Identify a trial by its configuration, seed, segment (if any) and the shape of the data it was fitted on"""
+        parts = dict(algorithm=trial['algorithm'], params=trial['params'], seed=trial['seed'], shape=list(X.shape))
+        if trial.get('segment') is not None:
+            parts['segment'] = trial['segment']
+        return cache_key(**parts)
+
+    def load_trial(self, key: str):
+        path = os.path.join(self.run_dir, 'trials', f'{key}.joblib')
+        return joblib.load(path) if os.path.exists(path) else None
+
+    def save_trial(self, key: str, output):
+        _atomic_dump(output, os.path.join(self.run_dir, 'trials', f'{key}.joblib'))
+
+    def complete(self):
+        """Mark the run finished and delete its checkpoint data"""
+        self.manifest['completed'] = True
+        self._write_manifest()
+        shutil.rmtree(self.run_dir, ignore_errors=True)
@@ -0,0 +1,433 @@
+"""
+Incremental sender -> receiver transaction graph for mule-account features.
+
+Accounts are mapped to dense integer IDs; each node keeps growable adjacency
+arrays of (neighbor ID, last seen, transaction count) for its outgoing and
+incoming edges, and per-node degree arrays. Recording a transaction and every
+per-account query (fan-in, fan-out, distinct counterparties in a window,
+two-hop reach) touch only the account's own adjacency, so they are O(degree)
+with no scan of the graph. Edges idle for longer than the retention window
+(measured against the latest event time, not the wall clock) are pruned as
+event time advances, together with accounts left without edges, so the graph
+stays bounded in a long-running process. The same code builds features for a
+training frame (rows replayed in timestamp order, pruned at the same points)
+and serves them online, and the graph can be snapshotted to disk so it
+survives API restarts.
+"""
+import os
+import time
+import threading
+from typing import Dict, List, Optional, Tuple
+import joblib
+import numpy as np
+import pandas as pd
+
+# Trailing window for the distinct counterparty features
+GRAPH_WINDOW_LABEL = '24h'
+GRAPH_WINDOW_SECONDS = 24 * 60 * 60
+
+# Edges not seen for this long are dropped; pruning runs every tenth of the retention window of event time
+GRAPH_RETENTION_SECONDS = float(os.getenv("GRAPH_RETENTION_DAYS", "90")) * 24 * 60 * 60
+
+GRAPH_FEATURE_COLUMNS = [
+    'graph_sender_fan_out', 'graph_sender_fan_in',
+    'graph_receiver_fan_in', 'graph_receiver_fan_out',
+    f'graph_sender_counterparties_{GRAPH_WINDOW_LABEL}', f'graph_receiver_counterparties_{GRAPH_WINDOW_LABEL}',
+    'graph_sender_two_hop_reach', 'graph_pair_transaction_count'
+]
+
+# Account columns, first non-empty wins
+SENDER_COLUMNS = ['sender_account', 'sender_msisdn']
+RECEIVER_COLUMNS = ['receiver_account', 'receiver_msisdn']
+
+EDGE_DTYPE = np.dtype([('node', np.int32), ('last_seen', np.float64), ('count', np.int32)])
+INITIAL_EDGE_CAPACITY = 4
+
+
+def _account_keys(df: pd.DataFrame, columns: List[str]) -> Optional[np.ndarray]:
+    """Per-row account key (object array, None where missing), or None if df has none of the columns"""
+    present = [col for col in columns if col in df.columns]
+    if not present:
+        return None
+    keys = df[present[0]]
+    for col in present[1:]:
+        keys = keys.where(keys.notna() & (keys.astype(str) != ''), df[col])
+    keys = keys.where(keys.notna() & (keys.astype(str) != ''), None)
+    return np.array([None if key is None else str(key) for key in keys], dtype=object)
+
+
+def graph_columns_available(df: pd.DataFrame) -> bool:
+    """Whether df carries both a sender and a receiver account column"""
+    return (any(col in df.columns for col in SENDER_COLUMNS)
+            and any(col in df.columns for col in RECEIVER_COLUMNS))
+
+
+class TransactionGraph:
+    """Adjacency index over sender -> receiver edges with integer node IDs"""
+
+    def __init__(self, window_seconds: int = GRAPH_WINDOW_SECONDS,
+                 retention_seconds: float = GRAPH_RETENTION_SECONDS):
+        self.window_seconds = window_seconds
+        self.retention_seconds = retention_seconds
+        self.max_event_time = None
+        self._pruned_at = None
+        self.node_ids: Dict[str, int] = {}
+        self.out_edges: List[Optional[np.ndarray]] = []
+        self.in_edges: List[Optional[np.ndarray]] = []
+        self.out_degree = np.zeros(1024, dtype=np.int32)
+        self.in_degree = np.zeros(1024, dtype=np.int32)
+        self.n_edges = 0
+        self.n_transactions = 0
+        self._lock = threading.Lock()
+        self._last_snapshot = time.time()
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.node_ids)
+
+    def memory_bytes(self) -> int:
+        """Approximate resident size of the ID map, adjacency arrays and degree arrays"""
+        edge_bytes = sum(edges.nbytes + 112 for edges in self.out_edges if edges is not None)
+        edge_bytes += sum(edges.nbytes + 112 for edges in self.in_edges if edges is not None)
+        # dict entry plus the account string, and two list slots per node
+        node_bytes = self.n_nodes * (100 + 16)
+        return edge_bytes + node_bytes + self.out_degree.nbytes + self.in_degree.nbytes
+
+    def _node(self, account: str) -> int:
+        node = self.node_ids.get(account)
+        if node is None:
+            node = len(self.node_ids)
+            self.node_ids[account] = node
+            self.out_edges.append(None)
+            self.in_edges.append(None)
+            if node >= len(self.out_degree):
+                self.out_degree = np.concatenate((self.out_degree, np.zeros_like(self.out_degree)))
+                self.in_degree = np.concatenate((self.in_degree, np.zeros_like(self.in_degree)))
+        return node
+
+    @staticmethod
+    def _touch(adjacency: List[Optional[np.ndarray]], degrees: np.ndarray, node: int,
+               neighbor: int, timestamp: float) -> Tuple[int, bool]:
+        """Count a transaction on node's edge to neighbor; returns (edge count, new edge)"""
+        edges = adjacency[node]
+        degree = degrees[node]
+        if edges is not None:
+            slot = int((edges['node'][:degree] == neighbor).argmax())
+            if edges['node'][slot] == neighbor and slot < degree:
+                edges['count'][slot] += 1
+                edges['last_seen'][slot] = max(edges['last_seen'][slot], timestamp)
+                return int(edges['count'][slot]), False
+        if edges is None or degree == len(edges):
+            grown = np.zeros(INITIAL_EDGE_CAPACITY if edges is None else 2 * len(edges), dtype=EDGE_DTYPE)
+            if edges is not None:
+                grown[:degree] = edges
+            adjacency[node] = edges = grown
+        edges[degree] = (neighbor, timestamp, 1)
+        degrees[node] = degree + 1
+        return 1, True
+
+    def _counterparties(self, node: int, since: float) -> int:
+        """Distinct accounts node sent to or received from at or after `since`"""
+        active = []
+        for edges, degree in ((self.out_edges[node], self.out_degree[node]),
+                              (self.in_edges[node], self.in_degree[node])):
+            if edges is not None and degree:
+                used = edges[:degree]
+                active.append(used['node'][used['last_seen'] >= since])
+        if len(active) < 2 or not len(active[0]) or not len(active[1]):
+            return sum(len(nodes) for nodes in active)
+        # Adjacency lists are short, so a set union beats np.unique here
+        return len(set(active[0].tolist()).union(active[1].tolist()))
+
+    def _two_hop_reach(self, node: int) -> int:
+        """Two-hop paths out of node: the summed fan-out of every account it paid"""
+        edges = self.out_edges[node]
+        if edges is None:
+            return 0
+        return int(self.out_degree[edges['node'][:self.out_degree[node]]].sum())
+
+    def _record(self, sender: int, receiver: int, timestamp: float, features: np.ndarray):
+        """
+        Record one transaction between node IDs (-1 for a missing account) and
+        write its features, in GRAPH_FEATURE_COLUMNS order, into `features`
+        """
+        if sender >= 0 and receiver >= 0 and sender != receiver:
+            features[7], new_edge = self._touch(self.out_edges, self.out_degree, sender, receiver, timestamp)
+            self._touch(self.in_edges, self.in_degree, receiver, sender, timestamp)
+            self.n_edges += new_edge
+            self.n_transactions += 1
+        since = timestamp - self.window_seconds
+        if sender >= 0:
+            features[0] = self.out_degree[sender]
+            features[1] = self.in_degree[sender]
+            features[4] = self._counterparties(sender, since)
+            features[6] = self._two_hop_reach(sender)
+        if receiver >= 0:
+            features[2] = self.in_degree[receiver]
+            features[3] = self.out_degree[receiver]
+            features[5] = self._counterparties(receiver, since)
+
+    def _record_sorted(self, senders: np.ndarray, receivers: np.ndarray, seconds: np.ndarray,
+                       features: np.ndarray):
+        """Record time-sorted transactions, pruning whenever event time has advanced far enough"""
+        prune_every = self.retention_seconds / 10
+        start = 0
+        while start < len(seconds):
+            now = float(seconds[start])
+            if self.max_event_time is not None:
+                now = max(now, self.max_event_time)
+            if self._pruned_at is None:
+                self._pruned_at = now
+            elif now - self._pruned_at >= prune_every:
+                self._prune(now - self.retention_seconds)
+                self._pruned_at = now
+            # Rows up to the next prune point share one set of node IDs
+            end = max(int(np.searchsorted(seconds, self._pruned_at + prune_every, side='left')), start + 1)
+            sender_nodes = [-1 if account is None else self._node(account) for account in senders[start:end]]
+            receiver_nodes = [-1 if account is None else self._node(account) for account in receivers[start:end]]
+            for row, sender, receiver in zip(range(start, end), sender_nodes, receiver_nodes):
+                self._record(sender, receiver, float(seconds[row]), features[row])
+            self.max_event_time = max(now, float(seconds[end - 1]))
+            start = end
+
+    def update(self, sender: Optional[str], receiver: Optional[str], timestamp: float) -> Dict[str, float]:
+        """
+        Record a transaction and return its graph features (counts include the
+        transaction itself). A missing account leaves its side's features NaN.
+        """
+        features = np.full((1, len(GRAPH_FEATURE_COLUMNS)), np.nan)
+        with self._lock:
+            self._record_sorted(np.array([sender], dtype=object), np.array([receiver], dtype=object),
+                                np.array([timestamp], dtype=np.float64), features)
+        return dict(zip(GRAPH_FEATURE_COLUMNS, features[0].tolist()))
+
+    def add_frame(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Record every transaction in df, replayed in timestamp order, and return
+        each row's point-in-time graph features indexed like df. Rows are replayed
+        one by one because each row's features depend on every earlier row.
+        """
+        with self._lock:
+            return self._replay(df)
+
+    def preview_frame(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        add_frame()'s features for df, each row seeing the ones before it,
+        computed on copies of the accounts it touches so nothing is recorded
+        """
+        with self._lock:
+            return _GraphPreview(self)._replay(df)
+
+    def _replay(self, df: pd.DataFrame) -> pd.DataFrame:
+        senders = _account_keys(df, SENDER_COLUMNS)
+        receivers = _account_keys(df, RECEIVER_COLUMNS)
+        if senders is None:
+            senders = np.full(len(df), None, dtype=object)
+        if receivers is None:
+            receivers = np.full(len(df), None, dtype=object)
+        seconds = pd.to_datetime(df['timestamp']).to_numpy(dtype='datetime64[ns]').astype(np.int64) / 1e9
+
+        order = np.argsort(seconds, kind='stable')
+        features = np.full((len(df), len(GRAPH_FEATURE_COLUMNS)), np.nan)
+        self._record_sorted(senders[order], receivers[order], seconds[order], features)
+        result = np.empty_like(features)
+        result[order] = features
+        return pd.DataFrame(result, index=df.index, columns=GRAPH_FEATURE_COLUMNS)
+
+    def _prune(self, cutoff: float):
+        """Drop edges last seen before cutoff and the accounts left without any edge"""
+        out_offsets, out_edges = self._packed(self.out_edges, self.out_degree)
+        in_offsets, in_edges = self._packed(self.in_edges, self.in_degree)
+        n_nodes = self.n_nodes
+        kept = []
+        degrees = []
+        for offsets, edges in ((out_offsets, out_edges), (in_offsets, in_edges)):
+            owners = np.repeat(np.arange(n_nodes), np.diff(offsets))
+            keep = edges['last_seen'] >= cutoff
+            kept.append((owners[keep], edges[keep]))
+            degrees.append(np.bincount(owners[keep], minlength=n_nodes))
+        alive = (degrees[0] + degrees[1]) > 0
+        if alive.all() and len(kept[0][1]) == len(out_edges):
+            return
+        new_ids = np.cumsum(alive) - 1
+        accounts = [account for account, live in zip(self.node_ids.keys(), alive) if live]
+        packed = []
+        for (owners, edges), node_degrees in zip(kept, degrees):
+            edges['node'] = new_ids[edges['node']]
+            offsets = np.zeros(len(accounts) + 1, dtype=np.int64)
+            np.cumsum(node_degrees[alive], out=offsets[1:])
+            packed.append((offsets, edges))
+        self._unpack(accounts, packed[0], packed[1])
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """
+        Prune edges idle for longer than the retention window before `now`
+        (default: the latest event time recorded); returns accounts dropped
+        """
+        now = self.max_event_time if now is None else now
+        if now is None:
+            return 0
+        with self._lock:
+            before = self.n_nodes
+            self._prune(now - self.retention_seconds)
+            return before - self.n_nodes
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> Tuple['TransactionGraph', pd.DataFrame]:
+        """Graph of every transaction in df and each row's features"""
+        graph = cls()
+        return graph, graph.add_frame(df)
+
+    def fan_out(self, account: str) -> int:
+        """Distinct accounts this account has paid"""
+        node = self.node_ids.get(account)
+        return 0 if node is None else int(self.out_degree[node])
+
+    def fan_in(self, account: str) -> int:
+        """Distinct accounts that have paid this account"""
+        node = self.node_ids.get(account)
+        return 0 if node is None else int(self.in_degree[node])
+
+    def counterparties(self, account: str, window_seconds: Optional[int] = None,
+                       now: Optional[float] = None) -> int:
+        """Distinct accounts this account exchanged money with in the trailing window"""
+        node = self.node_ids.get(account)
+        if node is None:
+            return 0
+        now = self.max_event_time if now is None else now
+        with self._lock:
+            return self._counterparties(node, now - (window_seconds or self.window_seconds))
+
+    def two_hop_reach(self, account: str) -> int:
+        """Accounts reachable through one intermediary, counted per path"""
+        node = self.node_ids.get(account)
+        if node is None:
+            return 0
+        with self._lock:
+            return self._two_hop_reach(node)
+
+    def _packed(self, adjacency: List[Optional[np.ndarray]], degrees: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Adjacency as CSR offsets plus one concatenated edge array"""
+        n_nodes = self.n_nodes
+        offsets = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(degrees[:n_nodes], out=offsets[1:])
+        edges = np.zeros(int(offsets[-1]), dtype=EDGE_DTYPE)
+        for node, node_edges in enumerate(adjacency):
+            if node_edges is not None:
+                edges[offsets[node]:offsets[node + 1]] = node_edges[:degrees[node]]
+        return offsets, edges
+
+    def _unpack(self, accounts: List[str], out_packed: Tuple[np.ndarray, np.ndarray],
+                in_packed: Tuple[np.ndarray, np.ndarray]):
+        """Replace the nodes and adjacency with packed CSR arrays"""
+        capacity = max(1024, 1 << max(len(accounts) - 1, 0).bit_length())
+        self.node_ids = {account: node for node, account in enumerate(accounts)}
+        self.out_edges = [None] * len(accounts)
+        self.in_edges = [None] * len(accounts)
+        self.out_degree = np.zeros(capacity, dtype=np.int32)
+        self.in_degree = np.zeros(capacity, dtype=np.int32)
+        for adjacency, degrees, (offsets, edges) in ((self.out_edges, self.out_degree, out_packed),
+                                                     (self.in_edges, self.in_degree, in_packed)):
+            degrees[:len(accounts)] = np.diff(offsets)
+            for node in np.flatnonzero(degrees[:len(accounts)]):
+                adjacency[node] = edges[offsets[node]:offsets[node + 1]].copy()
+        self.n_edges = int(self.out_degree.sum())
+
+    def __getstate__(self):
+        # Packed into flat CSR arrays: far smaller and faster to pickle than per-node arrays
+        with self._lock:
+            out_offsets, out_edges = self._packed(self.out_edges, self.out_degree)
+            in_offsets, in_edges = self._packed(self.in_edges, self.in_degree)
+            return {
+                'window_seconds': self.window_seconds,
+                'retention_seconds': self.retention_seconds,
+                'max_event_time': self.max_event_time,
+                'pruned_at': self._pruned_at,
+                'accounts': list(self.node_ids.keys()),
+                'out_offsets': out_offsets, 'out_edges': out_edges,
+                'in_offsets': in_offsets, 'in_edges': in_edges,
+                'n_transactions': self.n_transactions
+            }
+
+    def __setstate__(self, state):
+        self.__init__(state['window_seconds'], state.get('retention_seconds', GRAPH_RETENTION_SECONDS))
+        self._unpack(state['accounts'], (state['out_offsets'], state['out_edges']),
+                     (state['in_offsets'], state['in_edges']))
+        self.n_transactions = state['n_transactions']
+        edges = state['out_edges']
+        self.max_event_time = state.get('max_event_time', float(edges['last_seen'].max()) if len(edges) else None)
+        self._pruned_at = state.get('pruned_at', self.max_event_time)
+
+    def snapshot(self, path: str):
+        """Atomically write the graph to disk"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        joblib.dump(self, tmp_path)
+        os.replace(tmp_path, path)
+        self._last_snapshot = time.time()
+
+    def maybe_snapshot(self, path: str, interval_seconds: float) -> bool:
+        """Snapshot if at least interval_seconds have passed since the last one"""
+        if time.time() - self._last_snapshot < interval_seconds:
+            return False
+        self.snapshot(path)
+        return True
+
+    @classmethod
+    def load(cls, path: str) -> 'TransactionGraph':
+        """Restore a graph written by snapshot()"""
+        return joblib.load(path)
+
+
+class _CopiedAdjacency:
+    """Adjacency list view handing out copies of the graph's arrays, so writes never reach it"""
+
+    def __init__(self, adjacency: List[Optional[np.ndarray]]):
+        self.adjacency = adjacency
+        self.copies: Dict[int, Optional[np.ndarray]] = {}
+
+    def __getitem__(self, node: int) -> Optional[np.ndarray]:
+        if node not in self.copies:
+            edges = self.adjacency[node] if node < len(self.adjacency) else None
+            self.copies[node] = None if edges is None else edges.copy()
+        return self.copies[node]
+
+    def __setitem__(self, node: int, edges: np.ndarray):
+        self.copies[node] = edges
+
+
+class _GraphPreview(TransactionGraph):
+    """
+    Throwaway view of a graph that records into copies: the degree arrays are
+    copied whole, adjacency arrays only for the accounts a preview touches, and
+    new accounts get IDs past the graph's. Pruning is left to the recording,
+    so a preview crossing a prune point still counts edges it would drop.
+    """
+
+    def __init__(self, graph: TransactionGraph):
+        self.window_seconds = graph.window_seconds
+        self.retention_seconds = graph.retention_seconds
+        self.max_event_time = graph.max_event_time
+        self._pruned_at = graph._pruned_at
+        self.graph = graph
+        self.new_node_ids: Dict[str, int] = {}
+        self.out_edges = _CopiedAdjacency(graph.out_edges)
+        self.in_edges = _CopiedAdjacency(graph.in_edges)
+        self.out_degree = graph.out_degree.copy()
+        self.in_degree = graph.in_degree.copy()
+        self.n_edges = graph.n_edges
+        self.n_transactions = graph.n_transactions
+
+    def _node(self, account: str) -> int:
+        node = self.graph.node_ids.get(account)
+        if node is None:
+            node = self.new_node_ids.setdefault(account, self.graph.n_nodes + len(self.new_node_ids))
+            if node >= len(self.out_degree):
+                self.out_degree = np.concatenate((self.out_degree, np.zeros_like(self.out_degree)))
+                self.in_degree = np.concatenate((self.in_degree, np.zeros_like(self.in_degree)))
+        return node
+
+    def _prune(self, cutoff: float):
+        pass
@@ -0,0 +1,323 @@
+"""
+In-process sliding-window velocity counters for real-time scoring.
+
+Each sender keeps two small rings of time buckets (1-minute buckets covering
+the last hour and 1-hour buckets covering the last day) plus running totals for
+every configured window. Updates and window queries are amortized O(1); the
+store is an LRU map with a hard cap on the number of senders and can be
+snapshotted to disk so counters survive API restarts. preview() returns the
+features a transaction would get without recording it, so callers can record
+only transactions that were scored successfully.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import joblib
+import numpy as np
+
+from feature_engineering import VELOCITY_WINDOWS, VELOCITY_MAX_GAP_SECONDS
+
+# (bucket_seconds, n_buckets) for each ring, finest first
+DEFAULT_RINGS = ((60, 60), (3600, 24))
+
+
+class _SenderCounters:
+    """Bucket rings and running window totals for one sender"""
+    __slots__ = ('counts', 'amounts', 'last_bucket', 'window_counts', 'window_amounts', 'last_seen')
+
+    def __init__(self, rings, n_windows: int):
+        self.counts = [np.zeros(n_buckets, dtype=np.int32) for _, n_buckets in rings]
+        self.amounts = [np.zeros(n_buckets, dtype=np.float64) for _, n_buckets in rings]
+        self.last_bucket = [None] * len(rings)
+        self.window_counts = np.zeros(n_windows, dtype=np.int64)
+        self.window_amounts = np.zeros(n_windows, dtype=np.float64)
+        self.last_seen = None
+
+
+class SenderVelocityStore:
+    """
+    Per-sender bucketed counters answering "transactions and amount in the last
+    N minutes" for the windows in VELOCITY_WINDOWS.
+
+    Window totals are bucket-aligned: a window of W seconds covers the current
+    bucket plus the W / bucket_seconds - 1 buckets before it.
+    """
+
+    def __init__(self, windows: Dict[str, int] = None, rings=DEFAULT_RINGS,
+                 max_senders: int = 100000, idle_seconds: Optional[int] = None):
+        self.windows = dict(windows or VELOCITY_WINDOWS)
+        self.rings = tuple(rings)
+        self.max_senders = max_senders
+        self.idle_seconds = idle_seconds or max(self.windows.values())
+        self.senders = OrderedDict()
+        # Latest event time recorded; idle eviction is measured against it, not the wall clock
+        self.max_event_time = None
+        self._lock = threading.Lock()
+        self._last_snapshot = time.time()
+
+        # Assign every window to the finest ring that covers it exactly
+        self.window_labels = list(self.windows.keys())
+        self.window_plan = []
+        for label in self.window_labels:
+            window_seconds = self.windows[label]
+            for ring_index, (bucket_seconds, n_buckets) in enumerate(self.rings):
+                if window_seconds % bucket_seconds == 0 and window_seconds // bucket_seconds <= n_buckets:
+                    self.window_plan.append((ring_index, window_seconds // bucket_seconds))
+                    break
+            else:
+                raise ValueError(f"No bucket ring can represent velocity window '{label}' ({window_seconds}s)")
+
+    @classmethod
+    def from_env(cls) -> 'SenderVelocityStore':
+        """Build a store sized from VELOCITY_MAX_SENDERS / VELOCITY_MAX_MEMORY_MB"""
+        store = cls()
+        max_memory_mb = os.getenv("VELOCITY_MAX_MEMORY_MB")
+        if max_memory_mb:
+            store.max_senders = max(1, int(float(max_memory_mb) * 1024 * 1024 // store.bytes_per_sender()))
+        if os.getenv("VELOCITY_MAX_SENDERS"):
+            store.max_senders = int(os.getenv("VELOCITY_MAX_SENDERS"))
+        return store
+
+    def bytes_per_sender(self) -> int:
+        """Approximate resident size of one sender's counters"""
+        bucket_bytes = sum(n_buckets * (4 + 8) for _, n_buckets in self.rings)
+        window_bytes = len(self.windows) * (8 + 8)
+        # numpy array headers, __slots__ object and OrderedDict entry
+        overhead = 112 * (2 * len(self.rings) + 2) + 200
+        return bucket_bytes + window_bytes + overhead
+
+    def memory_bytes(self) -> int:
+        """Approximate total memory used by all tracked senders"""
+        return len(self.senders) * self.bytes_per_sender()
+
+    def _advance(self, state: _SenderCounters, ring_index: int, bucket: int):
+        """Expire buckets that fall out of each window and clear reused slots"""
+        last = state.last_bucket[ring_index]
+        if last is None:
+            state.last_bucket[ring_index] = bucket
+            return
+        if bucket <= last:
+            return
+
+        n_buckets = self.rings[ring_index][1]
+        counts = state.counts[ring_index]
+        amounts = state.amounts[ring_index]
+        steps = bucket - last
+
+        for window_index, (window_ring, window_buckets) in enumerate(self.window_plan):
+            if window_ring != ring_index:
+                continue
+            if steps >= window_buckets:
+                state.window_counts[window_index] = 0
+                state.window_amounts[window_index] = 0.0
+            else:
+                expired = np.arange(last - window_buckets + 1, bucket - window_buckets + 1) % n_buckets
+                state.window_counts[window_index] -= counts[expired].sum()
+                state.window_amounts[window_index] -= amounts[expired].sum()
+
+        if steps >= n_buckets:
+            counts[:] = 0
+            amounts[:] = 0.0
+        else:
+            reused = np.arange(last + 1, bucket + 1) % n_buckets
+            counts[reused] = 0
+            amounts[reused] = 0.0
+        state.last_bucket[ring_index] = bucket
+
+    def _advance_all(self, state: _SenderCounters, timestamp: float):
+        for ring_index, (bucket_seconds, _) in enumerate(self.rings):
+            self._advance(state, ring_index, int(timestamp // bucket_seconds))
+
+    def _features(self, state: _SenderCounters, gap: float) -> Dict[str, float]:
+        features = {}
+        for window_index, label in enumerate(self.window_labels):
+            features[f'sender_txn_count_{label}'] = int(state.window_counts[window_index])
+            features[f'sender_txn_amount_{label}'] = float(state.window_amounts[window_index])
+        features['time_since_last_seconds'] = float(gap)
+        return features
+
+    def _record(self, state: _SenderCounters, timestamp: float, amount: float) -> Dict[str, float]:
+        """Add a transaction to a sender's counters and return its velocity features"""
+        gap = VELOCITY_MAX_GAP_SECONDS
+        if state.last_seen is not None:
+            gap = min(max(timestamp - state.last_seen, 0.0), VELOCITY_MAX_GAP_SECONDS)
+
+        self._advance_all(state, timestamp)
+        for ring_index, (bucket_seconds, n_buckets) in enumerate(self.rings):
+            bucket = int(timestamp // bucket_seconds)
+            last = state.last_bucket[ring_index]
+            if bucket <= last - n_buckets:
+                continue  # Too old for this ring
+            slot = bucket % n_buckets
+            state.counts[ring_index][slot] += 1
+            state.amounts[ring_index][slot] += amount
+            for window_index, (window_ring, window_buckets) in enumerate(self.window_plan):
+                if window_ring == ring_index and bucket > last - window_buckets:
+                    state.window_counts[window_index] += 1
+                    state.window_amounts[window_index] += amount
+
+        state.last_seen = timestamp if state.last_seen is None else max(state.last_seen, timestamp)
+        return self._features(state, gap)
+
+    def _copy_state(self, sender: str) -> _SenderCounters:
+        """A sender's counters copied (fresh counters for an unseen sender)"""
+        copy = _SenderCounters(self.rings, len(self.windows))
+        state = self.senders.get(sender)
+        if state is not None:
+            copy.counts = [counts.copy() for counts in state.counts]
+            copy.amounts = [amounts.copy() for amounts in state.amounts]
+            copy.last_bucket = list(state.last_bucket)
+            copy.window_counts = state.window_counts.copy()
+            copy.window_amounts = state.window_amounts.copy()
+            copy.last_seen = state.last_seen
+        return copy
+
+    def update(self, sender: str, timestamp: float, amount: float) -> Dict[str, float]:
+        """
+        Record a scored transaction and return its velocity features (windows
+        include the transaction itself, matching compute_sender_velocity_features).
+        """
+        with self._lock:
+            state = self.senders.get(sender)
+            if state is None:
+                state = _SenderCounters(self.rings, len(self.windows))
+                self.senders[sender] = state
+                while len(self.senders) > self.max_senders:
+                    self.senders.popitem(last=False)
+            else:
+                self.senders.move_to_end(sender)
+            self.max_event_time = timestamp if self.max_event_time is None else max(self.max_event_time, timestamp)
+            return self._record(state, timestamp, amount)
+
+    def preview(self, sender: str, timestamp: float, amount: float) -> Dict[str, float]:
+        """The features update() would return, without recording the transaction"""
+        return self.preview_many([sender], [timestamp], [amount])[0]
+
+    def preview_many(self, senders, timestamps, amounts) -> List[Dict[str, float]]:
+        """
+        update()'s features for a sequence of transactions, each seeing the ones
+        before it, computed on copies so nothing is recorded
+        """
+        copies = {}
+        features = []
+        with self._lock:
+            for sender, timestamp, amount in zip(senders, timestamps, amounts):
+                state = copies.get(sender)
+                if state is None:
+                    state = copies[sender] = self._copy_state(sender)
+                features.append(self._record(state, timestamp, amount))
+        return features
+
+    def query(self, sender: str, now: Optional[float] = None) -> Dict[str, float]:
+        """Velocity features for a sender as of `now` without recording anything"""
+        now = time.time() if now is None else now
+        with self._lock:
+            state = self.senders.get(sender)
+            if state is None:
+                state = _SenderCounters(self.rings, len(self.windows))
+                return self._features(state, VELOCITY_MAX_GAP_SECONDS)
+            self._advance_all(state, now)
+            gap = min(max(now - state.last_seen, 0.0), VELOCITY_MAX_GAP_SECONDS)
+            return self._features(state, gap)
+
+    def window_totals(self, sender: str, minutes: int, now: Optional[float] = None) -> Tuple[int, float]:
+        """
+        Transaction count and amount for an arbitrary trailing window. Configured
+        windows are O(1); other lengths sum at most one ring's worth of buckets.
+        """
+        window_seconds = int(minutes * 60)
+        now = time.time() if now is None else now
+        if window_seconds in self.windows.values():
+            label = next(label for label, seconds in self.windows.items() if seconds == window_seconds)
+            features = self.query(sender, now)
+            return features[f'sender_txn_count_{label}'], features[f'sender_txn_amount_{label}']
+
+        with self._lock:
+            state = self.senders.get(sender)
+            if state is None:
+                return 0, 0.0
+            self._advance_all(state, now)
+            for ring_index, (bucket_seconds, n_buckets) in enumerate(self.rings):
+                if window_seconds <= bucket_seconds * n_buckets:
+                    n_window = max(1, -(-window_seconds // bucket_seconds))
+                    last = state.last_bucket[ring_index]
+                    slots = np.arange(last - n_window + 1, last + 1) % n_buckets
+                    return int(state.counts[ring_index][slots].sum()), float(state.amounts[ring_index][slots].sum())
+            raise ValueError(f"Window of {minutes} minutes exceeds the longest bucket ring")
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """
+        Drop senders with no activity inside the longest window before `now`
+        (default: the latest event time recorded, so replayed or backfilled
+        events and clock skew do not evict live senders); returns how many
+        """
+        now = self.max_event_time if now is None else now
+        if now is None:
+            return 0
+        cutoff = now - self.idle_seconds
+        evicted = 0
+        with self._lock:
+            # OrderedDict is in recency order, so idle senders sit at the front
+            while self.senders:
+                sender, state = next(iter(self.senders.items()))
+                if state.last_seen is not None and state.last_seen >= cutoff:
+                    break
+                self.senders.popitem(last=False)
+                evicted += 1
+        return evicted
+
+    def snapshot(self, path: str):
+        """Atomically write all counters to disk (copied under the lock, written outside it)"""
+        with self._lock:
+            payload = {
+                'windows': self.windows,
+                'rings': self.rings,
+                'max_senders': self.max_senders,
+                'idle_seconds': self.idle_seconds,
+                'max_event_time': self.max_event_time,
+                'senders': [
+                    (sender, [counts.copy() for counts in state.counts], [amounts.copy() for amounts in state.amounts],
+                     list(state.last_bucket), state.window_counts.copy(), state.window_amounts.copy(), state.last_seen)
+                    for sender, state in self.senders.items()
+                ]
+            }
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        joblib.dump(payload, tmp_path)
+        os.replace(tmp_path, path)
+        self._last_snapshot = time.time()
+
+    def maybe_snapshot(self, path: str, interval_seconds: float) -> bool:
+        """Snapshot if at least interval_seconds have passed since the last one"""
+        if time.time() - self._last_snapshot < interval_seconds:
+            return False
+        self.evict_idle()
+        self.snapshot(path)
+        return True
+
+    @classmethod
+    def load(cls, path: str, max_senders: Optional[int] = None) -> 'SenderVelocityStore':
+        """Restore a store written by snapshot()"""
+        payload = joblib.load(path)
+        store = cls(windows=payload['windows'], rings=payload['rings'],
+                    max_senders=max_senders or payload['max_senders'],
+                    idle_seconds=payload['idle_seconds'])
+        for sender, counts, amounts, last_bucket, window_counts, window_amounts, last_seen in payload['senders']:
+            state = _SenderCounters(store.rings, len(store.windows))
+            state.counts = counts
+            state.amounts = amounts
+            state.last_bucket = list(last_bucket)
+            state.window_counts = window_counts
+            state.window_amounts = window_amounts
+            state.last_seen = last_seen
+            store.senders[sender] = state
+        while len(store.senders) > store.max_senders:
+            store.senders.popitem(last=False)
+        store.max_event_time = payload.get('max_event_time', max(
+            (state.last_seen for state in store.senders.values() if state.last_seen is not None), default=None
+        ))
+        return store